@@ -0,0 +1,64 @@
+import os
+from contextlib import contextmanager
+from typing import IO, Iterator
+
+# Index files are never rewritten in place. They are written to a temporary file next
+# to their final path, flushed to disk and renamed over the old file, so after a crash
+# a reader finds either the complete old file or the complete new one. The directory
+# is synced as well, otherwise the rename itself can be lost.
+
+TEMP_SUFFIX = '.tmp'
+
+
+def fsync_directory(path: str) -> None:
+    """makes renames and new files in the directory durable"""
+
+    # directories can not be opened on windows, their entries are durable there anyway
+    if os.name != 'posix':
+        return
+    fd = os.open(path or '.', os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def fsync_files(directory: str) -> None:
+    """flushes every file of the directory and the directory itself to disk"""
+
+    for file_name in os.listdir(directory):
+        path = os.path.join(directory, file_name)
+        if os.path.isfile(path):
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+    fsync_directory(directory)
+
+
+@contextmanager
+def atomic_open(path: str, mode: str = 'w') -> Iterator[IO]:
+    """returns a file to write the new content of path to, it replaces path only
+    when the block finishes without an exception
+    """
+
+    temp_path = path + TEMP_SUFFIX
+    try:
+        with open(temp_path, mode) as temp_file:
+            yield temp_file
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    fsync_directory(os.path.dirname(path))
+
+
+def atomic_write(path: str, data: str | bytes) -> None:
+    """replaces the file at path with data"""
+
+    with atomic_open(path, 'wb' if isinstance(data, bytes) else 'w') as output_file:
+        output_file.write(data)
@@ -0,0 +1,333 @@
+import os
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import argparse
+import resource
+import tempfile
+import statistics
+import contextlib
+import subprocess
+from itertools import accumulate
+from typing import List, Dict, Any, Tuple
+
+CODE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CODE_DIR)
+
+from indexer import generate_forward_index
+from sorter import inverted_index_generator
+from near_duplicates import DUPLICATES_FILE
+from segments import (DOCUMENT_INDEX_KEY, DOCUMENT_KEYS_KEY, SEGMENTS_PATH, STATS_KEY, SURFACE_FORMS_KEY, get_merger,
+                      load_manifest)
+from searcher import Searcher
+
+# Builds a synthetic corpus in the article json schema, indexes it in a temporary directory
+# and times queries against the index. Words are drawn from a Zipf distribution over a
+# generated vocabulary, so a few words occur in most documents like in natural text.
+# Everything is derived from the seed, so runs on different commits index the same corpus
+# and search the same queries, and their json results can be compared with --baseline.
+# Startup is measured by timing fresh interpreters which import the search or index
+# modules or run one search from the command line against the index.
+
+WORKLOADS = ('single', 'multi', 'phrase')
+
+# stems saved by the indexing run in the index directory, read by the timed search commands
+STEM_CACHE_FILE = 'stem_cache.json'
+
+LETTERS = 'bcdfghjklmnprstvwz'
+VOWELS = 'aeiou'
+
+
+def make_vocabulary(size: int, rng: random.Random) -> List[str]:
+    """returns distinct pronounceable words made of letters only, so the tokenizer keeps them"""
+
+    words = set()
+    vocabulary = []
+    while len(vocabulary) < size:
+        word = ''.join(rng.choice(LETTERS) + rng.choice(VOWELS)
+                       for _ in range(rng.randint(2, 5)))
+        if word not in words:
+            words.add(word)
+            vocabulary.append(word)
+    return vocabulary
+
+
+def get_zipf_weights(size: int, exponent: float) -> List[float]:
+    """returns cumulative weights of ranks 1 to size under Zipf's law"""
+
+    return list(accumulate(1 / rank ** exponent for rank in range(1, size + 1)))
+
+
+def sample_words(vocabulary: List[str], cum_weights: List[float], count: int, rng: random.Random) -> List[str]:
+    return rng.choices(vocabulary, cum_weights=cum_weights, k=count)
+
+
+def write_corpus(directory: str, config: Dict[str, Any]) -> Tuple[int, List[List[str]]]:
+    """writes config["documents"] articles into config["files"] json files and returns the
+    bytes written and word sequences taken from the documents for phrase queries
+    """
+
+    rng = random.Random(config["seed"])
+    vocabulary = make_vocabulary(config["vocabulary"], rng)
+    cum_weights = get_zipf_weights(len(vocabulary), config["zipf"])
+
+    size = 0
+    phrases = []
+    per_file = -(-config["documents"] // config["files"])
+    for file_num in range(config["files"]):
+        articles = []
+        for doc_num in range(file_num * per_file, min((file_num + 1) * per_file, config["documents"])):
+            length = max(1, int(rng.gauss(
+                config["words"], config["words"] / 4)))
+            content = sample_words(vocabulary, cum_weights, length, rng)
+            title = sample_words(vocabulary, cum_weights, 8, rng)
+            if len(content) > 3 and len(phrases) < config["queries"]:
+                start = rng.randrange(len(content) - 3)
+                phrases.append(content[start:start + rng.randint(2, 3)])
+            articles.append({"id": "synthetic--{}".format(doc_num), "date": "2020-01-01", "source": "synthetic",
+                             "title": ' '.join(title), "content": ' '.join(content), "author": "benchmark",
+                             "url": "https://example.com/{}".format(doc_num), "published": "",
+                             "published_utc": 0, "collection_utc": 0})
+
+        data = json.dumps(articles)
+        with open(os.path.join(directory, "corpus_{}.json".format(file_num)), 'w') as corpus_file:
+            corpus_file.write(data)
+        size += len(data.encode())
+    return size, phrases
+
+
+def make_queries(config: Dict[str, Any], phrases: List[List[str]]) -> Dict[str, List[str]]:
+    """returns the queries of every workload, query words follow the same Zipf distribution as the corpus"""
+
+    vocabulary = make_vocabulary(
+        config["vocabulary"], random.Random(config["seed"]))
+    cum_weights = get_zipf_weights(len(vocabulary), config["zipf"])
+    rng = random.Random(config["seed"] + 1)
+    count = config["queries"]
+    return {"single": sample_words(vocabulary, cum_weights, count, rng),
+            "multi": [' '.join(sample_words(vocabulary, cum_weights, rng.randint(2, 4), rng)) for _ in range(count)],
+            "phrase": ['"{}"'.format(' '.join(phrase)) for phrase in phrases]}
+
+
+def get_peak_rss() -> int:
+    """returns the peak resident set size of this process and its finished children in bytes"""
+
+    # ru_maxrss is in kilobytes on linux and in bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * scale
+
+
+def get_directory_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, file_name))
+               for root, _, file_names in os.walk(path) for file_name in file_names)
+
+
+def get_index_size() -> int:
+    """returns bytes on disk of the committed index in current directory, segments
+    retired by merges are not counted
+    """
+
+    manifest = load_manifest()
+    files = ['lexicon.txt'] + [os.path.join(SEGMENTS_PATH, manifest[key])
+                               for key in (DOCUMENT_INDEX_KEY, STATS_KEY, DOCUMENT_KEYS_KEY, SURFACE_FORMS_KEY)
+                               if key in manifest] + \
+        [os.path.join(SEGMENTS_PATH, DUPLICATES_FILE)]
+    return sum(get_directory_size(os.path.join(SEGMENTS_PATH, info["name"])) for info in manifest["segments"]) + \
+        sum(os.path.getsize(file_name)
+            for file_name in files if os.path.isfile(file_name))
+
+
+def run_indexing(corpus_dir: str, corpus_size: int, config: Dict[str, Any]) -> Dict[str, Any]:
+    """indexes the corpus into the current directory and returns throughput and index size"""
+
+    os.mkdir("ForwardBarrels")
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        generate_forward_index(
+            corpus_dir, config["workers"], STEM_CACHE_FILE)
+        forward_time = time.perf_counter() - start
+        inverted_index_generator()
+        get_merger().wait()
+    elapsed = time.perf_counter() - start
+
+    return {"seconds": elapsed, "forward_index_seconds": forward_time,
+            "docs_per_second": config["documents"] / elapsed,
+            "mb_per_second": corpus_size / elapsed / 1e6,
+            "corpus_bytes": corpus_size, "index_bytes": get_index_size(),
+            "peak_rss_bytes": get_peak_rss()}
+
+
+def get_percentile(latencies: List[float], percentile: float) -> float:
+    """returns the nearest rank percentile of sorted latencies"""
+
+    rank = max(1, -(-len(latencies) * percentile // 100))
+    return latencies[int(rank) - 1]
+
+
+def run_queries(queries: List[str], k: int, ranking: str, warmup: int) -> Dict[str, Any]:
+    """searches every query once with empty caches and returns latency percentiles in milliseconds"""
+
+    # caches would turn repeated queries into lookups, every query is measured from disk
+    searcher = Searcher(ranking=ranking, result_cache_size=0,
+                        postings_cache_size=0)
+    latencies = []
+    result_count = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        for query in queries[:warmup]:
+            searcher.search_query(query, k)
+        for query in queries:
+            start = time.perf_counter()
+            result_count += len(searcher.search_query(query, k))
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    latencies.sort()
+    if not latencies:
+        return {"queries": 0}
+    return {"queries": len(latencies), "mean_ms": sum(latencies) / len(latencies),
+            "p50_ms": get_percentile(latencies, 50), "p95_ms": get_percentile(latencies, 95),
+            "p99_ms": get_percentile(latencies, 99), "max_ms": latencies[-1],
+            "queries_per_second": 1000 * len(latencies) / sum(latencies),
+            "mean_results": result_count / len(latencies)}
+
+
+def time_process(command: List[str]) -> float:
+    """returns milliseconds taken by running the command in the current directory"""
+
+    start = time.perf_counter()
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                   env=dict(os.environ, PYTHONPATH=CODE_DIR))
+    return (time.perf_counter() - start) * 1000
+
+
+def run_startup(query: str, config: Dict[str, Any]) -> Dict[str, Any]:
+    """returns the median milliseconds of starting an interpreter, importing the search and
+    the index modules and searching one query with cli.py, without and with the stems of
+    the indexing run. This is what a new search process pays before its first result.
+    """
+
+    search_command = [sys.executable, os.path.join(CODE_DIR, 'cli.py'), 'search', query,
+                      '-k', str(config["k"]), '--ranking', config["ranking"]]
+    commands = {"python_ms": [sys.executable, '-c', 'pass'],
+                "import_searcher_ms": [sys.executable, '-c', 'import searcher'],
+                "import_indexer_ms": [sys.executable, '-c', 'import indexer, sorter'],
+                "search_ms": search_command,
+                "cached_stems_search_ms": search_command + ['--stem-cache', STEM_CACHE_FILE]}
+    return {name: statistics.median(time_process(command) for _ in range(config["startup_runs"]))
+            for name, command in commands.items()}
+
+
+def get_git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(config: Dict[str, Any]) -> Dict[str, Any]:
+    cwd = os.getcwd()
+    temp_dir = tempfile.mkdtemp(prefix='benchmark_')
+    try:
+        corpus_dir = os.path.join(temp_dir, 'corpus')
+        index_dir = os.path.join(temp_dir, 'index')
+        os.mkdir(corpus_dir)
+        os.mkdir(index_dir)
+        corpus_size, phrases = write_corpus(corpus_dir, config)
+        queries = make_queries(config, phrases)
+
+        os.chdir(index_dir)
+        indexing = run_indexing(corpus_dir, corpus_size, config)
+        startup = run_startup(queries["multi"][0], config)
+        latency = {workload: run_queries(queries[workload], config["k"], config["ranking"], config["warmup"])
+                   for workload in WORKLOADS}
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(temp_dir)
+
+    return {"config": config, "commit": get_git_commit(), "python": platform.python_version(),
+            "platform": platform.platform(), "time": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            "indexing": indexing, "startup": startup, "queries": latency, "peak_rss_bytes": get_peak_rss()}
+
+
+def print_results(results: Dict[str, Any], baseline: Dict[str, Any] | None) -> None:
+    """prints the main numbers and their change from the baseline run"""
+
+    def line(name: str, section: Dict, key: str, base_section: Dict | None, unit: str) -> None:
+        value = section.get(key)
+        if value is None:
+            return
+        text = "{:<28} {:>12.3f} {}".format(name, value, unit)
+        if base_section and base_section.get(key):
+            text += "  ({:+.1f}% vs baseline)".format(
+                100 * (value / base_section[key] - 1))
+        print(text)
+
+    indexing = results["indexing"]
+    base_indexing = baseline["indexing"] if baseline else None
+    line("indexing docs/s", indexing, "docs_per_second", base_indexing, "")
+    line("indexing MB/s", indexing, "mb_per_second", base_indexing, "")
+    line("index size", {"index_mb": indexing["index_bytes"] / 1e6}, "index_mb",
+         {"index_mb": base_indexing["index_bytes"] / 1e6} if base_indexing else None, "MB")
+    startup = results.get("startup", {})
+    base_startup = baseline.get("startup") if baseline else None
+    for key in ("import_searcher_ms", "search_ms", "cached_stems_search_ms"):
+        line("startup {}".format(key[:-3].replace('_', ' ')),
+             startup, key, base_startup, "ms")
+    line("peak rss", {"rss_mb": results["peak_rss_bytes"] / 1e6}, "rss_mb",
+         {"rss_mb": baseline["peak_rss_bytes"] / 1e6} if baseline else None, "MB")
+    for workload in WORKLOADS:
+        section = results["queries"][workload]
+        base_section = baseline["queries"].get(
+            workload) if baseline else None
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            line("{} {}".format(workload, key[:3]),
+                 section, key, base_section, "ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Index a synthetic Zipf corpus and measure indexing throughput and query latency")
+    parser.add_argument("-n", "--documents", type=int, default=2000,
+                        help="number of synthetic articles")
+    parser.add_argument("--words", type=int, default=300,
+                        help="average number of content words of an article")
+    parser.add_argument("--vocabulary", type=int, default=20000,
+                        help="number of distinct words")
+    parser.add_argument("--zipf", type=float, default=1.0,
+                        help="exponent of the Zipf distribution of words")
+    parser.add_argument("--files", type=int, default=4,
+                        help="number of json files the corpus is split into")
+    parser.add_argument("-q", "--queries", type=int, default=200,
+                        help="number of queries of every workload")
+    parser.add_argument("-k", type=int, default=10,
+                        help="number of results of every query")
+    parser.add_argument("--ranking", default="bm25", choices=("bm25", "hits"))
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="number of processes tokenizing articles")
+    parser.add_argument("--warmup", type=int, default=10,
+                        help="queries run before measuring every workload")
+    parser.add_argument("--startup-runs", type=int, default=5,
+                        help="fresh interpreters started to time startup, the median is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", default="benchmark_results.json",
+                        help="file the json results are written to")
+    parser.add_argument("--baseline", default=None,
+                        help="json results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    config = {name: getattr(args, name) for name in ("documents", "words", "vocabulary", "zipf", "files", "queries",
+                                                      "k", "ranking", "workers", "warmup", "startup_runs", "seed")}
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+
+    results = run(config)
+    with open(args.output, 'w') as output_file:
+        output_file.write(json.dumps(results, indent=2))
+    print_results(results, baseline)
@@ -0,0 +1,45 @@
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import contextlib
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from indexer import generate_forward_index
+
+
+def index_in_temp_dir(path_to_data: str, workers: int) -> float:
+    """builds the forward index in an empty directory and returns seconds taken"""
+
+    cwd = os.getcwd()
+    temp_dir = tempfile.mkdtemp()
+    try:
+        os.chdir(temp_dir)
+        os.mkdir("ForwardBarrels")
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            generate_forward_index(path_to_data, workers)
+        return time.perf_counter() - start
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare serial and parallel forward index generation")
+    parser.add_argument("path", help="directory containing the json files")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(),
+                        help="number of processes used by the parallel run")
+    args = parser.parse_args()
+    path = os.path.abspath(args.path)
+
+    serial = index_in_temp_dir(path, 1)
+    parallel = index_in_temp_dir(path, args.workers)
+
+    print("serial:   {:.3f}s".format(serial))
+    print("parallel: {:.3f}s with {} workers".format(parallel, args.workers))
+    print("speedup:  {:.2f}x".format(serial / parallel))
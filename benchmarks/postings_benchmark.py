@@ -0,0 +1,73 @@
+import os
+import sys
+import json
+import time
+from typing import List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from postings import decode_postings, is_barrel_file, iter_term_blocks
+from segments import SEGMENTS_PATH, load_manifest
+
+
+def load_term_blocks() -> List[Tuple[int, int, bytes, List[str]]]:
+    """reads binary barrels of the segments in current directory and returns for every
+    term its binary block and the same postings serialized in the text barrel format
+    """
+
+    barrel_paths = [(os.path.join(SEGMENTS_PATH, info["name"], barrel), info.get("format", 1))
+                    for info in load_manifest()["segments"]
+                    for barrel in os.listdir(os.path.join(SEGMENTS_PATH, info["name"])) if is_barrel_file(barrel)]
+
+    blocks = []
+    for barrel_path, postings_format in barrel_paths:
+        for word_id, doc_count, payload in iter_term_blocks(barrel_path, postings_format):
+            postings = decode_postings(word_id, doc_count, payload)
+            blocks.append((word_id, doc_count, payload,
+                          [json.dumps(posting) + '\n' for posting in postings]))
+    return blocks
+
+
+def time_it(function, repeat: int) -> float:
+    """returns best wall clock time of function over repeat runs"""
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(repeat: int = 5) -> None:
+    blocks = load_term_blocks()
+    posting_count = sum(block[1] for block in blocks)
+
+    text_bytes = sum(len(line) for block in blocks for line in block[3])
+    binary_bytes = sum(len(block[2]) for block in blocks)
+
+    def decode_text():
+        for block in blocks:
+            for line in block[3]:
+                json.loads(line)
+
+    def decode_binary():
+        for word_id, doc_count, payload, _ in blocks:
+            decode_postings(word_id, doc_count, payload)
+
+    text_time = time_it(decode_text, repeat)
+    binary_time = time_it(decode_binary, repeat)
+
+    print("terms: {}, postings: {}".format(len(blocks), posting_count))
+    print("text format:   {:>12} bytes, decode {:.4f}s ({:.0f} postings/s)".format(
+        text_bytes, text_time, posting_count / text_time))
+    print("binary format: {:>12} bytes, decode {:.4f}s ({:.0f} postings/s)".format(
+        binary_bytes, binary_time, posting_count / binary_time))
+    print("size ratio: {:.2f}x smaller, decode speedup: {:.2f}x".format(
+        text_bytes / binary_bytes, text_time / binary_time))
+
+
+if __name__ == "__main__":
+    # run from the project directory after indexing some data
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,96 @@
+import os
+import sys
+import random
+import argparse
+from typing import List, Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from postings_benchmark import time_it
+from proximity import proximity_score
+from searcher import calculate_proximity
+
+
+def calculate_proximity_by_index(doc_id: str, documents: Dict, content_hits: int, content_hit_list: List) -> None:
+    """the proximity calculation replaced by the proximity module, it compares the
+    i-th position of one word with the i-th position of the other
+    """
+
+    if content_hits > 0:
+        if documents[doc_id][1] is not None:
+            for doc_idx in range(1, len(documents[doc_id])):
+                prev_word_hit_list = documents[doc_id][doc_idx]
+                idx_range = min(len(prev_word_hit_list), len(content_hit_list))
+                for location_idx in range(2, idx_range):
+                    proximity = abs(
+                        prev_word_hit_list[location_idx] - content_hit_list[location_idx])
+                    if proximity <= 1:
+                        documents[doc_id][0] += 10
+                    elif proximity <= 10:
+                        documents[doc_id][0] += 8
+                    elif proximity <= 100:
+                        documents[doc_id][0] += 4
+                    else:
+                        documents[doc_id][0] += 2
+        documents[doc_id].append(content_hit_list)
+
+
+def make_hit_lists(document_length: int, hits: int, words: int) -> List[List[int]]:
+    """returns content hit lists of words occurring hits times at random positions"""
+
+    hit_lists = []
+    for _ in range(words):
+        positions = sorted(random.sample(range(1, document_length + 1), hits))
+        hit_lists.append([0, hits] + positions)
+    return hit_lists
+
+
+def score_document(proximity_function, hit_lists: List[List[int]]) -> int:
+    """adds the hit lists to a document entry one word at a time as the searcher does"""
+
+    documents = {"0": [0, hit_lists[0]]}
+    for hit_list in hit_lists[1:]:
+        proximity_function("0", documents, hit_list[1], hit_list)
+    return documents["0"][0]
+
+
+def run(words: int, documents: int, repeat: int) -> None:
+    random.seed(0)
+    print("{:>8} {:>6} {:>12} {:>12} {:>12} {:>8}".format(
+        "length", "hits", "by index", "nearest", "batch", "speedup"))
+
+    for document_length, hits in [(100, 2), (1000, 10), (1000, 50), (10000, 200), (100000, 2000)]:
+        corpus = [make_hit_lists(document_length, hits, words)
+                  for _ in range(documents)]
+
+        def by_index():
+            for hit_lists in corpus:
+                score_document(calculate_proximity_by_index, hit_lists)
+
+        def nearest():
+            for hit_lists in corpus:
+                score_document(calculate_proximity, hit_lists)
+
+        def batch():
+            for hit_lists in corpus:
+                proximity_score(hit_lists)
+
+        by_index_time = time_it(by_index, repeat) / documents
+        nearest_time = time_it(nearest, repeat) / documents
+        batch_time = time_it(batch, repeat) / documents
+        print("{:>8} {:>6} {:>10.1f}us {:>10.1f}us {:>10.1f}us {:>7.2f}x".format(
+            document_length, hits, by_index_time * 1e6, nearest_time * 1e6, batch_time * 1e6,
+            by_index_time / nearest_time))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the index based and nearest occurrence proximity calculations")
+    parser.add_argument("-q", "--words", type=int, default=3,
+                        help="number of query words found in every document")
+    parser.add_argument("-n", "--documents", type=int, default=200,
+                        help="number of synthetic documents scored per run")
+    parser.add_argument("-r", "--repeat", type=int, default=5,
+                        help="number of runs, the best one is reported")
+    args = parser.parse_args()
+    run(args.words, args.documents, args.repeat)
@@ -0,0 +1,157 @@
+import sys
+import json
+import mmap
+import struct
+from typing import List, Dict, Iterator, Tuple
+
+from atomic_file import atomic_open
+
+# Layout of the binary lexicon file (all integers are little endian)
+#
+#   header         magic "TLX1", term count, word count (next free word id)
+#   term offsets   (term count + 1) x uint32, start of every term in the term table
+#   word ids       term count x uint32
+#   barrel offsets term count x uint64, offset of the term in its inverted barrel
+#   term table     utf-8 encoded terms, sorted by their bytes and concatenated
+#
+# Terms are sorted so a lookup is a binary search over the mmapped file and
+# nothing has to be deserialized before the first query is answered.
+
+MAGIC = b'TLX1'
+HEADER = struct.Struct('<4sII')
+UINT32 = struct.Struct('<I')
+UINT64 = struct.Struct('<Q')
+
+
+def write_binary_lexicon(lexicon: Dict[str, List[int]], path: str) -> None:
+    """writes lexicon dictionary to path in binary lexicon format"""
+
+    word_count = lexicon.get("word_count", [0, 0])[0]
+    terms = sorted((word.encode('utf-8'), value)
+                   for word, value in lexicon.items() if word != "word_count")
+
+    term_offsets = [0]
+    for term, _ in terms:
+        term_offsets.append(term_offsets[-1] + len(term))
+
+    # the file is replaced atomically, readers which have the old file mapped
+    # keep seeing consistent content
+    with atomic_open(path, 'wb') as lexicon_file:
+        lexicon_file.write(HEADER.pack(MAGIC, len(terms), word_count))
+        lexicon_file.write(struct.pack('<{}I'.format(len(term_offsets)), *term_offsets))
+        lexicon_file.write(struct.pack('<{}I'.format(len(terms)),
+                                       *[value[0] for _, value in terms]))
+        lexicon_file.write(struct.pack('<{}Q'.format(len(terms)),
+                                       *[value[1] for _, value in terms]))
+        for term, _ in terms:
+            lexicon_file.write(term)
+
+
+class BinaryLexicon:
+    """Read only lexicon backed by a memory mapped binary lexicon file.
+    Supports the same lookups as the lexicon dictionary i.e. `word in lexicon`
+    and `lexicon[word]` which returns [word_id, offset].
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, 'rb') as lexicon_file:
+            self._mm = mmap.mmap(lexicon_file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+
+        magic, self.term_count, self.word_count = HEADER.unpack_from(
+            self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError("{} is not a binary lexicon file".format(path))
+
+        self._term_offsets_start = HEADER.size
+        self._word_ids_start = self._term_offsets_start + \
+            (self.term_count + 1) * UINT32.size
+        self._barrel_offsets_start = self._word_ids_start + \
+            self.term_count * UINT32.size
+        self._terms_start = self._barrel_offsets_start + \
+            self.term_count * UINT64.size
+
+    def _term(self, idx: int) -> bytes:
+        """returns the encoded term stored at given index"""
+
+        start, end = struct.unpack_from(
+            '<2I', self._mm, self._term_offsets_start + idx * UINT32.size)
+        return self._mm[self._terms_start + start:self._terms_start + end]
+
+    def _find(self, word: str) -> int:
+        """binary searches the term table and returns index of word or -1"""
+
+        term = word.encode('utf-8')
+        low, high = 0, self.term_count
+        while low < high:
+            mid = (low + high) // 2
+            if self._term(mid) < term:
+                low = mid + 1
+            else:
+                high = mid
+        if low < self.term_count and self._term(low) == term:
+            return low
+        return -1
+
+    def _entry(self, idx: int) -> List[int]:
+        """returns [word_id, offset] of the term stored at given index"""
+
+        word_id = UINT32.unpack_from(
+            self._mm, self._word_ids_start + idx * UINT32.size)[0]
+        offset = UINT64.unpack_from(
+            self._mm, self._barrel_offsets_start + idx * UINT64.size)[0]
+        return [word_id, offset]
+
+    def get(self, word: str, default: List[int] | None = None) -> List[int] | None:
+        if word == "word_count":
+            return [self.word_count, 0]
+        idx = self._find(word)
+        if idx < 0:
+            return default
+        return self._entry(idx)
+
+    def __contains__(self, word: str) -> bool:
+        return word == "word_count" or self._find(word) >= 0
+
+    def __getitem__(self, word: str) -> List[int]:
+        entry = self.get(word)
+        if entry is None:
+            raise KeyError(word)
+        return entry
+
+    def __len__(self) -> int:
+        return self.term_count
+
+    def items(self) -> Iterator[Tuple[str, List[int]]]:
+        """iterates over (word, [word_id, offset]) in sorted order"""
+
+        for idx in range(self.term_count):
+            yield self._term(idx).decode('utf-8'), self._entry(idx)
+
+    def read_terms(self) -> Tuple[List[str], Tuple[int, ...]]:
+        """returns every term in sorted order and their word ids, the tables are read at once"""
+
+        term_offsets = struct.unpack_from('<{}I'.format(self.term_count + 1), self._mm, self._term_offsets_start)
+        word_ids = struct.unpack_from('<{}I'.format(self.term_count), self._mm, self._word_ids_start)
+        table = self._mm[self._terms_start:self._terms_start + term_offsets[-1]]
+        return [table[start:end].decode('utf-8') for start, end in zip(term_offsets, term_offsets[1:])], word_ids
+
+    def close(self) -> None:
+        self._mm.close()
+
+
+def convert_lexicon(lexicon_path: str = 'lexicon.txt', binary_path: str = 'lexicon.bin') -> int:
+    """converts json lexicon file to binary lexicon and returns number of terms"""
+
+    with open(lexicon_path, 'r') as lexicon_file:
+        lexicon = json.load(lexicon_file)
+    write_binary_lexicon(lexicon, binary_path)
+    return len(lexicon) - 1
+
+
+if __name__ == "__main__":
+    source = sys.argv[1] if len(sys.argv) > 1 else 'lexicon.txt'
+    destination = sys.argv[2] if len(sys.argv) > 2 else 'lexicon.bin'
+    print("Converted {} terms to {}".format(
+        convert_lexicon(source, destination), destination))
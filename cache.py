@@ -0,0 +1,124 @@
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable
+
+import tracing
+
+# number of results and bytes kept by the query result cache of a searcher
+RESULT_CACHE_SIZE = 1024
+RESULT_CACHE_BYTES = 32 * 1024 * 1024
+
+# number of posting lists and bytes kept by the decoded postings cache of a searcher
+POSTINGS_CACHE_SIZE = 256
+POSTINGS_CACHE_BYTES = 64 * 1024 * 1024
+
+# bytes of an int object, small ints are shared but counting them keeps the estimate an upper bound
+INT_SIZE = sys.getsizeof(1 << 20)
+
+
+def estimate_size(value: Any) -> int:
+    """returns a rough number of bytes used by nested lists and tuples of numbers and strings"""
+
+    if isinstance(value, (list, tuple)):
+        size = sys.getsizeof(value)
+        # hit lists are flat lists of ints, they are counted without visiting every item
+        if value and type(value[0]) is int:
+            return size + INT_SIZE * len(value)
+        return size + sum(estimate_size(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """Bounded mapping with least recently used eviction, limited both by the
+    number of entries and by their estimated size in bytes. Every value is
+    tagged with the index generation it was computed from: a lookup with a
+    newer generation empties the cache and values computed from an older one
+    are not stored, so nothing read before an index update is served after it.
+    """
+
+    def __init__(self, max_size: int, max_bytes: int, sizeof: Callable[[Any], int] = estimate_size,
+                 name: str = 'cache') -> None:
+        self.name = name
+        self._hit_counter = name + '_hits'
+        self._miss_counter = name + '_misses'
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _set_generation(self, generation: int) -> None:
+        if generation > self.generation:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self.bytes = 0
+            self.generation = generation
+
+    def get(self, key: Hashable, generation: int) -> Any:
+        """returns the value cached for key in this generation or None"""
+
+        with self._lock:
+            self._set_generation(generation)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+
+        if entry is None:
+            tracing.count(self._miss_counter)
+            return None
+        tracing.count(self._hit_counter)
+        return entry[0]
+
+    def put(self, key: Hashable, value: Any, generation: int) -> None:
+        """caches the value computed from the index generation, values larger
+        than the whole cache and values of an old generation are dropped
+        """
+
+        if self.max_size <= 0:
+            return
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            self._set_generation(generation)
+            if generation < self.generation:
+                return
+
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._entries[key] = (value, size)
+            self.bytes += size
+
+            while len(self._entries) > self.max_size or self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        """returns hit and miss counters of the cache"""
+
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries),
+                "bytes": self.bytes, "evictions": self.evictions, "invalidations": self.invalidations,
+                "generation": self.generation, "hit_rate": self.hits / lookups if lookups else 0.0}
@@ -0,0 +1,182 @@
+import sys
+import json
+import logging
+import argparse
+from itertools import islice
+from typing import Iterator, List, TextIO
+
+import tracing
+from docstore import DocumentIndex, DocumentStore
+from near_duplicates import DEFAULT_DUPLICATE_POLICY, DUPLICATE_POLICIES
+from query import parse_query
+from tokenizer import tokenizer
+from searcher import DEFAULT_RANKING, DEFAULT_RESULT_COUNT, RANKINGS, Searcher, format_results
+from suggest import SUGGESTION_COUNT
+
+# Command line tools over the index in the current directory
+#
+#   python cli.py index <dir>                 index the json files of a directory into a new segment
+#   python cli.py search <query>              print the ranked documents of one query
+#   python cli.py batch-search <queries.txt>  search every line of the file
+#   python cli.py suggest <text>              completions of the last word and a corrected query
+#
+# Searches print one JSON line per query {"query": ..., "results": [{"doc_id", "url", "title", "score"}]}
+# so evaluation runs can read the results back line by line, --snippets adds an html snippet
+# of the stored text to every result and --all-duplicates keeps the near duplicates which are
+# otherwise collapsed to the best ranked one. --trace logs the stage timings
+# and counters of every operation to standard error as json, --metrics writes their totals
+# in the Prometheus text format when the command finishes. Searching imports nothing
+# of the indexing side, and with --stem-cache the stems saved by an indexing run answer
+# query words without loading nltk, which takes most of the startup of a search.
+
+# queries searched together, the postings of their words are kept in memory until the batch is done
+BATCH_SIZE = 1000
+
+
+def positive_int(value: str) -> int:
+    """parses a count given on the command line, it must be at least 1"""
+
+    count = int(value)
+    if count < 1:
+        raise argparse.ArgumentTypeError("must be at least 1, not {}".format(count))
+    return count
+
+
+def iter_queries(queries_file: TextIO) -> Iterator[str]:
+    """yields the non empty lines of the queries file"""
+
+    for line in queries_file:
+        line = line.strip()
+        if line:
+            yield line
+
+
+def write_results(texts: List[str], results: List[List], documents: DocumentStore | DocumentIndex,
+                  output: TextIO, snippets: bool = False) -> None:
+    """writes the ranked documents of every query as a json line, documents must be
+    those of the snapshot the queries were searched in
+    """
+
+    for text, ranked_documents in zip(texts, results):
+        words = parse_query(text).words if snippets else None
+        output.write(json.dumps(
+            {"query": text, "results": format_results(ranked_documents, documents, words)}) + '\n')
+
+
+def index_command(args: argparse.Namespace) -> None:
+    from indexer import generate_forward_index
+    from sorter import inverted_index_generator
+    from segments import get_merger
+
+    if generate_forward_index(args.path, args.workers, args.stem_cache, duplicate_policy=args.duplicates)[0]:
+        inverted_index_generator(barrel_count=args.barrel_count)
+        # let a background merge started by the new segment finish before exiting
+        get_merger().wait()
+
+
+def search_command(args: argparse.Namespace) -> None:
+    searcher = Searcher(ranking=args.ranking,
+                        collapse_duplicates=not args.all_duplicates)
+    snapshot = searcher.snapshot()
+    write_results([args.query], searcher.search_batch(
+        [args.query], args.k, snapshot=snapshot), snapshot[2], sys.stdout, args.snippets)
+
+
+def batch_search_command(args: argparse.Namespace) -> None:
+    searcher = Searcher(ranking=args.ranking,
+                        collapse_duplicates=not args.all_duplicates)
+    output = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        with open(args.queries, 'r') as queries_file:
+            queries = iter_queries(queries_file)
+            while True:
+                texts = list(islice(queries, args.batch_size))
+                if not texts:
+                    break
+                snapshot = searcher.snapshot()
+                write_results(texts, searcher.search_batch(
+                    texts, args.k, snapshot=snapshot), snapshot[2], output, args.snippets)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+def suggest_command(args: argparse.Namespace) -> None:
+    searcher = Searcher()
+    print(json.dumps({"query": args.text, "did_you_mean": searcher.suggest_query(args.text, partial=True),
+                      "completions": [{"term": term, "documents": count}
+                                      for term, count in searcher.complete(args.text, args.k)]}))
+
+
+def main(argv: List[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Index and search from the command line, the index is in the current directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    index_parser = commands.add_parser(
+        "index", help="index the json files of a directory")
+    index_parser.add_argument("path", help="directory containing the json files")
+    index_parser.add_argument("-w", "--workers", type=int, default=1,
+                              help="number of processes used to tokenize and stem articles")
+    index_parser.add_argument("--barrel-count", type=int, default=None,
+                              help="most inverted barrels of the new segment, defaults to the manifest setting")
+    index_parser.add_argument("--duplicates", choices=DUPLICATE_POLICIES, default=DEFAULT_DUPLICATE_POLICY,
+                              help="index near duplicates of indexed articles in their cluster or skip them")
+    index_parser.set_defaults(run=index_command)
+
+    for name, help_text in (("search", "search one query"), ("batch-search", "search every line of a file")):
+        search_parser = commands.add_parser(name, help=help_text)
+        if name == "search":
+            search_parser.add_argument("query")
+            search_parser.set_defaults(run=search_command)
+        else:
+            search_parser.add_argument("queries", help="file with one query per line")
+            search_parser.add_argument("-o", "--output", default=None,
+                                       help="file the json lines are written to instead of standard output")
+            search_parser.add_argument("--batch-size", type=positive_int, default=BATCH_SIZE,
+                                       help="queries whose postings are read together")
+            search_parser.set_defaults(run=batch_search_command)
+        search_parser.add_argument("-k", type=positive_int, default=DEFAULT_RESULT_COUNT,
+                                   help="number of results of every query")
+        search_parser.add_argument("--ranking", choices=RANKINGS, default=DEFAULT_RANKING,
+                                   help="bm25 or weighted hit counts with proximity")
+        search_parser.add_argument("--snippets", action="store_true",
+                                   help="add html snippets of the stored text with the query words in bold")
+        search_parser.add_argument("--all-duplicates", action="store_true",
+                                   help="list every near duplicate instead of the best ranked one of each cluster")
+
+    suggest_parser = commands.add_parser(
+        "suggest", help="complete the last word of a text and correct words missing from the index")
+    suggest_parser.add_argument("text")
+    suggest_parser.add_argument("-k", type=positive_int, default=SUGGESTION_COUNT,
+                                help="number of completions")
+    suggest_parser.set_defaults(run=suggest_command)
+
+    for command_parser in commands.choices.values():
+        command_parser.add_argument("--stem-cache", default=None,
+                                    help="file of stems kept between runs, indexing saves it and searches read it")
+        command_parser.add_argument("--trace", action="store_true",
+                                    help="log stage timings and counters of every operation to standard error")
+        command_parser.add_argument("--metrics", default=None,
+                                    help="file the totals of the traced operations are written to")
+
+    args = parser.parse_args(argv)
+    if args.trace or args.metrics:
+        tracing.enable()
+    if args.trace:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        tracing.logger.addHandler(handler)
+        tracing.logger.setLevel(logging.INFO)
+
+    if args.stem_cache and args.command != "index":
+        tokenizer.stem_cache.load(args.stem_cache)
+    args.run(args)
+
+    if args.metrics:
+        with open(args.metrics, 'w') as metrics_file:
+            metrics_file.write(tracing.metrics_text())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import os
+import sys
+import struct
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, Tuple
+
+from atomic_file import atomic_open
+
+# Layout of the collection statistics file (integers in machine byte order, as written by array)
+#
+#   header          magic "CST1", document count, word count,
+#                   total title length, total content length
+#   doc ids         document count x uint32, sorted
+#   title lengths   document count x uint32, number of title words of every document
+#   content lengths document count x uint32, number of content words of every document
+#   frequencies     word count x uint32, number of documents containing every word id
+#
+# Lengths count the words left after removing stop words, like the hits of the
+# postings. Everything is read into arrays, so ranking a posting costs a binary
+# search for the document and an index for the word.
+
+STATS_FILE = 'collection_stats.bin'
+MAGIC = b'CST1'
+HEADER = struct.Struct('<4sIIQQ')
+
+
+class CollectionStats:
+    """Field lengths of every document and document frequencies of every word
+    used by BM25 ranking. The indexer adds the documents it parses and saves
+    the statistics next to the document store keys, the searcher loads them.
+    """
+
+    def __init__(self) -> None:
+        self.doc_ids = array('I')
+        self.title_lengths = array('I')
+        self.content_lengths = array('I')
+        self.document_frequencies = array('I')
+        self.total_title_length = 0
+        self.total_content_length = 0
+        self._sorted = True
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    @property
+    def avg_title_length(self) -> float:
+        return self.total_title_length / len(self.doc_ids) if self.doc_ids else 0.0
+
+    @property
+    def avg_content_length(self) -> float:
+        return self.total_content_length / len(self.doc_ids) if self.doc_ids else 0.0
+
+    def add_document(self, doc_id: int, title_length: int, content_length: int, word_ids: Iterable[int]) -> None:
+        """adds the field lengths of a new document and counts it for each distinct word id it contains"""
+
+        if self.doc_ids and doc_id < self.doc_ids[-1]:
+            self._sorted = False
+        self.doc_ids.append(doc_id)
+        self.title_lengths.append(title_length)
+        self.content_lengths.append(content_length)
+        self.total_title_length += title_length
+        self.total_content_length += content_length
+
+        frequencies = self.document_frequencies
+        for word_id in word_ids:
+            if word_id >= len(frequencies):
+                frequencies.extend([0] * (word_id + 1 - len(frequencies)))
+            frequencies[word_id] += 1
+
+    def _sort(self) -> None:
+        """sorts the documents by doc id so their lengths can be binary searched"""
+
+        if self._sorted:
+            return
+        order = sorted(range(len(self.doc_ids)), key=self.doc_ids.__getitem__)
+        self.doc_ids = array('I', (self.doc_ids[i] for i in order))
+        self.title_lengths = array('I', (self.title_lengths[i] for i in order))
+        self.content_lengths = array(
+            'I', (self.content_lengths[i] for i in order))
+        self._sorted = True
+
+    def get_lengths(self, doc_id: int) -> Tuple[int, int] | None:
+        """returns title and content length of the document or None if it is unknown"""
+
+        self._sort()
+        # doc ids are dense, so a document is usually found at its own index
+        if doc_id < len(self.doc_ids) and self.doc_ids[doc_id] == doc_id:
+            return self.title_lengths[doc_id], self.content_lengths[doc_id]
+        idx = bisect_left(self.doc_ids, doc_id)
+        if idx < len(self.doc_ids) and self.doc_ids[idx] == doc_id:
+            return self.title_lengths[idx], self.content_lengths[idx]
+        return None
+
+    def get_document_frequency(self, word_id: int) -> int:
+        """returns number of documents containing the word"""
+
+        if word_id < len(self.document_frequencies):
+            return self.document_frequencies[word_id]
+        return 0
+
+    def renumber(self, doc_ids: Dict[int, int]) -> 'CollectionStats':
+        """returns the statistics with every doc id replaced by doc_ids[doc_id],
+        documents missing from doc_ids are dropped
+        """
+
+        stats = CollectionStats()
+        for doc_id, title_length, content_length in zip(self.doc_ids, self.title_lengths, self.content_lengths):
+            if doc_id in doc_ids:
+                stats.add_document(
+                    doc_ids[doc_id], title_length, content_length, [])
+        stats.document_frequencies = array('I', self.document_frequencies)
+        return stats
+
+    def save(self, path: str = STATS_FILE) -> None:
+        """writes the statistics to a temporary file and renames it over path"""
+
+        self._sort()
+        with atomic_open(path, 'wb') as stats_file:
+            stats_file.write(HEADER.pack(MAGIC, len(self.doc_ids), len(self.document_frequencies),
+                                         self.total_title_length, self.total_content_length))
+            for values in (self.doc_ids, self.title_lengths, self.content_lengths, self.document_frequencies):
+                stats_file.write(values.tobytes())
+
+    @classmethod
+    def load(cls, path: str = STATS_FILE) -> 'CollectionStats':
+        """reads statistics saved by save, or returns empty statistics if the file does not exist"""
+
+        stats = cls()
+        if not os.path.isfile(path):
+            return stats
+
+        with open(path, 'rb') as stats_file:
+            header = stats_file.read(HEADER.size)
+            if len(header) < HEADER.size or header[:len(MAGIC)] != MAGIC:
+                raise ValueError(
+                    "{} is not a collection statistics file".format(path))
+            _, doc_count, word_count, stats.total_title_length, stats.total_content_length = \
+                HEADER.unpack(header)
+            for values, count in ((stats.doc_ids, doc_count), (stats.title_lengths, doc_count),
+                                  (stats.content_lengths, doc_count), (stats.document_frequencies, word_count)):
+                data = stats_file.read(count * values.itemsize)
+                if len(data) < count * values.itemsize:
+                    raise ValueError("{} is truncated".format(path))
+                values.frombytes(data)
+        return stats
+
+
+def rebuild_collection_stats() -> CollectionStats:
+    """computes the statistics of an index built before they were saved from the
+    postings of its segments, the hits of a document add up to its field lengths.
+    They are published in a new manifest generation.
+    """
+
+    from segments import SEGMENTS_PATH, STATS_KEY, commit_segments, load_manifest, iter_segment_postings
+
+    lengths = {}
+    document_frequencies = {}
+    for info in load_manifest()["segments"]:
+        segment_path = os.path.join(SEGMENTS_PATH, info["name"])
+        for posting in iter_segment_postings(segment_path, info.get("format", 1)):
+            (doc_id, word_id), (title_hit_list, content_hit_list) = posting
+            title_length, content_length = lengths.get(doc_id, (0, 0))
+            lengths[doc_id] = (title_length + title_hit_list[1],
+                               content_length + content_hit_list[1])
+            document_frequencies[word_id] = document_frequencies.get(
+                word_id, 0) + 1
+
+    stats = CollectionStats()
+    for doc_id in sorted(lengths):
+        stats.add_document(doc_id, *lengths[doc_id], [])
+    stats.document_frequencies = array(
+        'I', [0] * (max(document_frequencies, default=-1) + 1))
+    for word_id, frequency in document_frequencies.items():
+        stats.document_frequencies[word_id] = frequency
+
+    path = os.path.join(SEGMENTS_PATH, STATS_FILE)
+    stats.save(path)
+    commit_segments([], [], files={STATS_KEY: path})
+    return stats
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'rebuild':
+        # add the statistics to an index built without them
+        stats = rebuild_collection_stats()
+        print("documents: {}, words: {}, average title length: {:.1f}, average content length: {:.1f}".format(
+            len(stats), len(stats.document_frequencies), stats.avg_title_length, stats.avg_content_length))
+    else:
+        print("usage: python collection_stats.py rebuild")
@@ -0,0 +1,115 @@
+import io
+import gzip
+import json
+from itertools import islice
+from typing import List, Dict, Iterator, Iterable, TextIO
+
+# number of characters read from a corpus file at once
+READ_SIZE = 1 << 20
+
+CORPUS_EXTENSIONS = ('.json', '.jsonl', '.json.gz', '.jsonl.gz')
+
+
+def is_corpus_file(file_name: str) -> bool:
+    """returns True if the file name has one of the supported corpus extensions"""
+
+    return file_name.endswith(CORPUS_EXTENSIONS)
+
+
+def open_corpus_file(path: str) -> TextIO:
+    """opens the corpus file as text, decompressing it if it is gzipped"""
+
+    if path.endswith('.gz'):
+        return io.TextIOWrapper(gzip.open(path, 'rb'), encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+
+def iter_json_array(corpus_file: TextIO, read_size: int = READ_SIZE) -> Iterator[Dict]:
+    """yields the elements of a top level json array one at a time, only the
+    element being decoded and one read buffer are kept in memory
+    """
+
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
+    started = False
+
+    while True:
+        # skip whitespace and the array punctuation between elements
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+            pos += 1
+        if pos < len(buffer) and not started:
+            if buffer[pos] != '[':
+                raise ValueError("corpus file does not contain a json array")
+            started = True
+            pos += 1
+            continue
+        if pos < len(buffer) and buffer[pos] == ']':
+            return
+
+        if pos < len(buffer):
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # the element continues in the part of the file not read yet
+                if eof:
+                    raise
+            else:
+                # an element ending exactly at the buffer end may still be incomplete
+                if end < len(buffer) or eof:
+                    pos = end
+                    yield element
+                    continue
+        elif eof:
+            if started:
+                raise ValueError("corpus file ended inside the json array")
+            return
+
+        chunk = corpus_file.read(read_size)
+        eof = not chunk
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+
+def iter_json_lines(corpus_file: TextIO) -> Iterator[Dict]:
+    """yields one article for every non empty line of a json lines file"""
+
+    for line in corpus_file:
+        if line.strip():
+            yield json.loads(line)
+
+
+def iter_articles(path: str) -> Iterator[Dict]:
+    """yields articles of a corpus file which can be a json array or json lines,
+    optionally gzip compressed
+    """
+
+    with open_corpus_file(path) as corpus_file:
+        if path.endswith(('.jsonl', '.jsonl.gz')):
+            yield from iter_json_lines(corpus_file)
+            return
+
+        # .json files holding one article per line are accepted as well
+        first_char = ''
+        while first_char.isspace() or first_char == '':
+            first_char = corpus_file.read(1)
+            if first_char == '':
+                return
+        corpus_file.seek(0)
+
+        if first_char == '[':
+            yield from iter_json_array(corpus_file)
+        else:
+            yield from iter_json_lines(corpus_file)
+
+
+def iter_batches(articles: Iterable[Dict], batch_size: int) -> Iterator[List[Dict]]:
+    """groups articles into lists of at most batch_size articles"""
+
+    articles = iter(articles)
+    while True:
+        batch = list(islice(articles, batch_size))
+        if not batch:
+            return
+        yield batch
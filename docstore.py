@@ -0,0 +1,342 @@
+import os
+import re
+import json
+import mmap
+import zlib
+import html
+import struct
+from bisect import bisect_left, bisect_right
+from itertools import islice
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+from atomic_file import atomic_open
+from tokenizer import tokenizer
+
+# Layout of the document store (all integers are little endian)
+#
+#   documents.dat       records appended one after another, every record is a zlib
+#                       compressed utf-8 json array [id, url, title, text] of an article
+#   documents.off       uint64 end offset in documents.dat of every record
+#   document_keys.bin   header magic "TDK1", record count, then record count x uint32
+#                       keys sorted and record count x uint32 record numbers
+#
+# Record numbers are dense and given in indexing order, they are the doc ids of the
+# postings. The keys file is a hash index from the crc32 of the article ids to them,
+# used to skip articles which are already indexed. Different ids can share a key, so
+# a key only gives candidates and the id stored in their records decides. The data and
+# offsets files only grow: the keys file of every commit is published by the manifest
+# and its record count tells how much of them is committed, a writer first cuts off
+# whatever an unfinished batch appended. All three files are memory mapped, so the
+# documents of the top results are read with one slice each.
+
+DATA_FILE = 'documents.dat'
+OFFSETS_FILE = 'documents.off'
+KEYS_FILE = 'document_keys.bin'
+MAGIC = b'TDK1'
+HEADER = struct.Struct('<4sI')
+UINT32 = struct.Struct('<I')
+UINT64 = struct.Struct('<Q')
+
+# zlib level of the records, articles are written once and read at every search
+COMPRESSION_LEVEL = 6
+
+# words shown in a snippet, stop words between them are not counted
+SNIPPET_WORDS = 30
+
+# words shown before the first query word of a snippet
+SNIPPET_LEAD = 5
+
+# words of the text as the tokenizer splits them
+WORD = re.compile('[a-zA-Z]+')
+
+
+def document_key(article_id: str) -> int:
+    """returns the key of an article id in the keys file"""
+
+    return zlib.crc32(article_id.encode('utf-8'))
+
+
+def read_document_count(keys_path: str | None) -> int:
+    """returns the number of committed records of a keys file, 0 if there is none"""
+
+    if keys_path is None or not os.path.isfile(keys_path):
+        return 0
+    with open(keys_path, 'rb') as keys_file:
+        magic, count = HEADER.unpack(keys_file.read(HEADER.size))
+    if magic != MAGIC:
+        raise ValueError("{} is not a document keys file".format(keys_path))
+    return count
+
+
+def map_file(path: str) -> mmap.mmap | None:
+    """maps the file read only, empty files can not be mapped and give None"""
+
+    with open(path, 'rb') as mapped_file:
+        if os.fstat(mapped_file.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(mapped_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class DocumentStore:
+    """Read only view of the documents of one commit, the files are memory mapped.
+    The doc ids of the postings are record numbers if dense_ids is set, indexes
+    whose postings still use the keys are read with it unset.
+    """
+
+    def __init__(self, directory: str, keys_path: str, dense_ids: bool = True) -> None:
+        self.directory = directory
+        self.dense_ids = dense_ids
+        self._keys = map_file(keys_path)
+        magic, self.count = HEADER.unpack_from(self._keys, 0)
+        if magic != MAGIC:
+            raise ValueError("{} is not a document keys file".format(keys_path))
+        self._record_nums_start = HEADER.size + self.count * UINT32.size
+        self._data = map_file(os.path.join(directory, DATA_FILE))
+        self._offsets = map_file(os.path.join(directory, OFFSETS_FILE))
+
+    def _key(self, idx: int) -> int:
+        return UINT32.unpack_from(self._keys, HEADER.size + idx * UINT32.size)[0]
+
+    def iter_records(self, key: int) -> Iterator[int]:
+        """binary searches the keys and yields the record numbers stored under the key"""
+
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            if self._key(mid) < key:
+                low = mid + 1
+            else:
+                high = mid
+        while low < self.count and self._key(low) == key:
+            yield UINT32.unpack_from(self._keys, self._record_nums_start + low * UINT32.size)[0]
+            low += 1
+
+    def find_article(self, article_id: str) -> int:
+        """returns record number of the article with the id or -1, records copied from an
+        index built before the store have no id and are matched by their key
+        """
+
+        for record_num in self.iter_records(document_key(article_id)):
+            stored_id = self.get_record(record_num)["id"]
+            if stored_id is None or stored_id == article_id:
+                return record_num
+        return -1
+
+    def find(self, doc_id: int | str) -> int:
+        """returns record number of the document with the doc id of a posting or -1"""
+
+        doc_id = int(doc_id)
+        if self.dense_ids:
+            return doc_id if 0 <= doc_id < self.count else -1
+        return next(self.iter_records(doc_id), -1)
+
+    def get_record(self, record_num: int) -> Dict[str, Any]:
+        """returns id, url, title and text of the article stored as given record"""
+
+        start = UINT64.unpack_from(self._offsets, (record_num - 1) * UINT64.size)[0] if record_num else 0
+        end = UINT64.unpack_from(self._offsets, record_num * UINT64.size)[0]
+        article_id, url, title, text = json.loads(
+            zlib.decompress(self._data[start:end]))
+        return {"id": article_id, "url": url, "title": title, "text": text}
+
+    def get(self, doc_id: int | str) -> Dict[str, Any] | None:
+        """returns the stored article of the doc id or None"""
+
+        record_num = self.find(doc_id)
+        if record_num < 0:
+            return None
+        return self.get_record(record_num)
+
+    def iter_keys(self) -> List[Tuple[int, int]]:
+        """returns (key, record number) of every document sorted by key"""
+
+        keys = struct.unpack_from('<{}I'.format(2 * self.count), self._keys, HEADER.size)
+        return list(zip(keys[:self.count], keys[self.count:]))
+
+    def __contains__(self, doc_id: int | str) -> bool:
+        return self.find(doc_id) >= 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def close(self) -> None:
+        for mapped in (self._keys, self._data, self._offsets):
+            if mapped is not None:
+                mapped.close()
+
+
+class DocumentIndex:
+    """Documents of an index built before the document store, only their urls are known"""
+
+    def __init__(self, document_index: Dict[str, str]) -> None:
+        self.document_index = document_index
+
+    def get(self, doc_id: int | str) -> Dict[str, Any] | None:
+        url = self.document_index.get(str(doc_id))
+        if url is None:
+            return None
+        return {"id": None, "url": url, "title": None, "text": None}
+
+    def __contains__(self, doc_id: int | str) -> bool:
+        return str(doc_id) in self.document_index
+
+    def __len__(self) -> int:
+        return len(self.document_index)
+
+
+class DocumentStoreWriter:
+    """Appends the articles of an indexing batch to the document store and writes
+    the keys file which commits them. The record number of an article is its doc id.
+    """
+
+    def __init__(self, directory: str, keys_path: str | None = None) -> None:
+        self.directory = directory
+        count = read_document_count(keys_path)
+
+        # drop records which an unfinished batch appended after the last commit
+        os.makedirs(directory, exist_ok=True)
+        offsets_path = os.path.join(directory, OFFSETS_FILE)
+        data_path = os.path.join(directory, DATA_FILE)
+        self.size = 0
+        with open(offsets_path, 'ab+') as offsets_file:
+            if count:
+                offsets_file.seek((count - 1) * UINT64.size)
+                self.size = UINT64.unpack(offsets_file.read(UINT64.size))[0]
+            offsets_file.truncate(count * UINT64.size)
+        with open(data_path, 'ab+') as data_file:
+            data_file.truncate(self.size)
+
+        # the committed documents are looked up in the mapped files, the new ones by their ids
+        self.committed = DocumentStore(directory, keys_path) if count else None
+        self.keys = self.committed.iter_keys() if count else []
+        self.count = count
+        self.new_keys = []
+        self.new_ids = {}
+        self._data_file = open(data_path, 'ab')
+        self._offsets_file = open(offsets_path, 'ab')
+
+    def find(self, article_id: str) -> int:
+        """returns record number of the article with the id or -1 if it is not stored"""
+
+        record_num = self.new_ids.get(article_id)
+        if record_num is not None:
+            return record_num
+        if self.committed is not None:
+            return self.committed.find_article(article_id)
+        return -1
+
+    def add(self, article: Dict[str, Any], key: int | None = None) -> int:
+        """appends the article and returns its record number, the key is computed from
+        the article id unless given
+        """
+
+        record = zlib.compress(json.dumps([article.get('id'), article.get('url'), article.get('title'),
+                                           article.get('content')]).encode('utf-8'), COMPRESSION_LEVEL)
+        self._data_file.write(record)
+        self.size += len(record)
+        self._offsets_file.write(UINT64.pack(self.size))
+        if key is None:
+            key = document_key(article['id'])
+        if article.get('id') is not None:
+            self.new_ids[article['id']] = self.count
+        self.new_keys.append((key, self.count))
+        self.count += 1
+        return self.count - 1
+
+    def __len__(self) -> int:
+        return self.count
+
+    def close(self) -> None:
+        """flushes the appended records to disk"""
+
+        for output_file in (self._data_file, self._offsets_file):
+            output_file.flush()
+            os.fsync(output_file.fileno())
+            output_file.close()
+        if self.committed is not None:
+            self.committed.close()
+
+    def commit(self, keys_path: str) -> None:
+        """writes the keys file of all documents to keys_path once the writer is closed,
+        the new documents are committed when the manifest names it
+        """
+
+        keys = self.keys
+        if self.new_keys:
+            keys = sorted(keys + self.new_keys)
+        with atomic_open(keys_path, 'wb') as keys_file:
+            keys_file.write(HEADER.pack(MAGIC, len(keys)))
+            keys_file.write(struct.pack('<{}I'.format(len(keys)), *[key for key, _ in keys]))
+            keys_file.write(struct.pack('<{}I'.format(len(keys)), *[record_num for _, record_num in keys]))
+
+
+def get_snippet(text: str, words: List[str], length: int = SNIPPET_WORDS) -> Tuple[str, List[Tuple[int, int]]]:
+    """returns the part of the text with most of the stemmed query words and the
+    character spans of the query words in it. The text is split like the tokenizer
+    splits documents, so the word positions are the positions of the hit lists.
+    """
+
+    stems = set(words)
+    stop_words = tokenizer.stop_words
+    stem = tokenizer.stem_cache.stem
+
+    # positions are counted over the words left after removing stop words, like the hit lists
+    all_words = WORD.findall(text.lower())
+    if len(all_words) != len(WORD.findall(text)):
+        # lowercasing changed what the pattern finds, lowercase word by word instead
+        all_words = [word.lower() for word in WORD.findall(text)]
+    kept = [index for index, word in enumerate(all_words) if word not in stop_words]
+    if not kept:
+        return '', []
+
+    # every distinct word is stemmed once, the positions of query words are found by their stems.
+    # The stemmer only rewrites the ends of words, so words starting with another letter than
+    # every query word are not stemmed at all
+    initials = {word_stem[:1] for word_stem in stems}
+    match_stems = {word: word_stem for word, word_stem in
+                   ((word, stem(word)) for word in set(all_words) - stop_words if word[:1] in initials)
+                   if word_stem in stems}
+    matches = [position for position, index in enumerate(kept) if all_words[index] in match_stems]
+
+    # the window starting a little before a query word with most distinct query words, then most query words
+    first = 0
+    if matches:
+        best = None
+        for position in matches:
+            start = max(0, position - SNIPPET_LEAD)
+            window = matches[bisect_left(matches, start):bisect_left(matches, start + length)]
+            distinct = len({match_stems[all_words[kept[i]]] for i in window})
+            if best is None or (distinct, len(window)) > best:
+                best = (distinct, len(window))
+                first = start
+    last = min(len(kept), first + length) - 1
+
+    # character spans are only found for the words up to the end of the window
+    spans = [match.span() for match in islice(WORD.finditer(text), kept[last] + 1)]
+    offset = spans[kept[first]][0]
+    snippet = text[offset:spans[kept[last]][1]]
+    highlights = [(spans[kept[i]][0] - offset, spans[kept[i]][1] - offset)
+                  for i in matches[bisect_left(matches, first):bisect_right(matches, last)]]
+    return snippet, highlights
+
+
+def highlight(snippet: str, highlights: List[Tuple[int, int]], before: str = '<b>', after: str = '</b>',
+              escape: Callable[[str], str] = html.escape) -> str:
+    """returns the snippet with the highlighted spans marked, the rest is escaped"""
+
+    parts = []
+    position = 0
+    for start, end in highlights:
+        parts.append(escape(snippet[position:start]))
+        parts.append(before + escape(snippet[start:end]) + after)
+        position = end
+    parts.append(escape(snippet[position:]))
+    return ''.join(parts)
+
+
+def make_snippet(text: str | None, words: List[str], length: int = SNIPPET_WORDS) -> str:
+    """returns an html snippet of the text with the stemmed query words in bold"""
+
+    if not text:
+        return ''
+    return highlight(*get_snippet(text, words, length))
@@ -1,17 +1,30 @@
 import os
-import re
 import json
-import zlib
+import argparse
+import multiprocessing
+from collections import Counter, defaultdict
+from itertools import chain
 from datetime import datetime
 from typing import List, Dict, Any, Tuple
 
-import nltk
-from nltk.corpus import stopwords
-from nltk.stem.snowball import SnowballStemmer
-nltk.download('stopwords')
+import tracing
+from atomic_file import atomic_write
+from tokenizer import SurfaceForms, tokenizer
+from corpus_reader import is_corpus_file, iter_articles, iter_batches
+from collection_stats import STATS_FILE, CollectionStats
+from docstore import DocumentStoreWriter
+from near_duplicates import DEFAULT_DUPLICATE_POLICY, DUPLICATE_POLICIES, NearDuplicateIndex, minhash
+from segments import (BATCH_FILES, DOCUMENT_KEYS_KEY, SEGMENTS_PATH, STATS_KEY, SURFACE_FORMS_KEY, get_index_file,
+                      get_merger)
 
-stop_words = set(stopwords.words('english'))
-snow_stemmer = SnowballStemmer(language='english')
+# number of articles sent to a worker process at once during parallel indexing
+TOKENIZE_CHUNK_SIZE = 16
+
+# number of articles read and parsed before the forward dictionaries are flushed to barrels
+FLUSH_INTERVAL = 1000
+
+# consecutive word ids collected in one forward barrel, barrels are added as the vocabulary grows
+FORWARD_BARREL_WORDS = 533
 
 
 def get_lexicon() -> Dict[str, List[int]]:
@@ -28,60 +41,55 @@ def get_lexicon() -> Dict[str, List[int]]:
     return lexicon
 
 
-def get_document_index() -> Any:
-    """load the previous document index if the file exists and load the data"""
+def get_forward_barrel_location(word_id: int) -> int:
+    """returns index of the forward barrel which collects postings of the word"""
 
-    document_index = {}
-    if os.path.isfile('./document_index.txt'):
-        with open('./document_index.txt') as doc_idx:
-            document_index = json.load(doc_idx)
-    return document_index
+    return int(word_id / FORWARD_BARREL_WORDS)
 
 
-def get_forward_barrels() -> List:
-    """creates forward barrels files and return list of pointers"""
+def get_forward_barrels() -> Dict[int, Any]:
+    """removes forward barrel files and uncommitted batch files of the previous run and
+    returns the dictionary of open forward barrel files, files are created when they
+    receive a posting
+    """
 
-    # create a list of forward barrels and we use 300 barrels
-    forward_barrels = []
-    for barrel_count in range(1, 301):
-        forward_barrels.append(
-            open('./ForwardBarrels/forward_barrel_{}.txt'.format(barrel_count), 'w'))
-    return forward_barrels
+    for file_name in os.listdir('./ForwardBarrels'):
+        if file_name.startswith('forward_barrel_'):
+            os.remove('./ForwardBarrels/{}'.format(file_name))
+    for path in BATCH_FILES.values():
+        if os.path.isfile(path):
+            os.remove(path)
+    return {}
 
 
-def get_forward_dicts() -> List[Dict]:
-    """initializes forward dictionaries"""
+def get_forward_dicts() -> Dict[int, Dict]:
+    """initializes forward dictionaries, one per forward barrel"""
 
-    # created a list of 300 forward dictionaries
-    forward_dicts = []
-    for barrelCount in range(1, 301):
-        forward_dicts.append({})
-    return forward_dicts
+    # a forward dictionary is created for every barrel the vocabulary reaches
+    return defaultdict(dict)
 
 
-def write_forward_barrels(forward_dicts: List, forward_barrels: List) -> None:
+def write_forward_barrels(forward_dicts: Dict[int, Dict], forward_barrels: Dict[int, Any]) -> None:
     """writes forward dictionaries to forward barrel files"""
 
-    id = 0
-    while id < 300:  # here 300 is barrel count
+    for id, forward_dict in forward_dicts.items():
+        if id not in forward_barrels:
+            forward_barrels[id] = open(
+                './ForwardBarrels/forward_barrel_{}.txt'.format(id + 1), 'w')
+
         # write content of forward dictionary to corresponding forward barrels
-        for object_ in forward_dicts[id].items():
+        for object_ in forward_dict.items():
             forward_barrels[id].write(json.dumps(object_))
             forward_barrels[id].write("\n")
-        id += 1
 
 
 def parse_content(content: Any) -> List:
     """split content, lowercase it and remove stop words and do stemming"""
 
-    content = (re.sub('[^a-zA-Z]', ' ',
-                      content)).lower().split()
-    stemmed_words = ([snow_stemmer.stem(word)
-                      for word in content if not word in stop_words])
-    return stemmed_words
+    return tokenizer.parse_content(content)
 
 
-def process_article_title(stemmed_title: Any, forward_dicts: List[Dict], lexicon: Dict[str, List[int]], hashed_id: int, word_count: int) -> int:
+def process_article_title(stemmed_title: Any, forward_dicts: List[Dict], lexicon: Dict[str, List[int]], doc_id: int, word_count: int) -> int:
     """reads words in title and updates forwards dictionaries and lexicon"""
 
     position = 1  # position of word in the title
@@ -95,28 +103,28 @@ def process_article_title(stemmed_title: Any, forward_dicts: List[Dict], lexicon
             word_count += 1
 
         # through word_id calculate which barrel it belongs to and then add hitlist for title
-        barrel_location = int(lexicon[word][0] / 533)
+        barrel_location = get_forward_barrel_location(lexicon[word][0])
 
-        if (hashed_id, lexicon[word][0]) not in forward_dicts[barrel_location]:
+        if (doc_id, lexicon[word][0]) not in forward_dicts[barrel_location]:
             # here hitlist consist of two sub lists, first list for title and second for content
             # in title hitlist, first element is always 1 and second element is hit count
             forward_dicts[barrel_location][(
-                hashed_id, lexicon[word][0])] = []
+                doc_id, lexicon[word][0])] = []
             forward_dicts[barrel_location][(
-                hashed_id, lexicon[word][0])].insert(0, [1, 1])
+                doc_id, lexicon[word][0])].insert(0, [1, 1])
             forward_dicts[barrel_location][(
-                hashed_id, lexicon[word][0])].insert(1, [0, 0])
+                doc_id, lexicon[word][0])].insert(1, [0, 0])
         else:
             # if hit list is present we just increase hit count for title hits
             forward_dicts[barrel_location][(
-                hashed_id, lexicon[word][0])][0][1] += 1
+                doc_id, lexicon[word][0])][0][1] += 1
 
         position += 1
 
     return word_count
 
 
-def process_article_content(stemmed_words: Any, forward_dicts: List[Dict], lexicon: Dict[str, List[int]], hashed_id: int, word_count: int) -> int:
+def process_article_content(stemmed_words: Any, forward_dicts: List[Dict], lexicon: Dict[str, List[int]], doc_id: int, word_count: int) -> int:
     """reads words in content and updates forwards dictionaries and lexicon"""
 
     position = 1  # position of word in the document
@@ -127,109 +135,240 @@ def process_article_content(stemmed_words: Any, forward_dicts: List[Dict], lexic
             lexicon[word] = [word_count, 0]
             word_count += 1
 
-        barrel_location = int(lexicon[word][0] / 533)
+        barrel_location = get_forward_barrel_location(lexicon[word][0])
 
-        if (hashed_id, lexicon[word][0]) not in forward_dicts[barrel_location]:
+        if (doc_id, lexicon[word][0]) not in forward_dicts[barrel_location]:
             # in content hitlist, first element is always 0 and second element is hit count
             # and then hit position are appended
             forward_dicts[barrel_location][(
-                hashed_id, lexicon[word][0])] = []
+                doc_id, lexicon[word][0])] = []
             forward_dicts[barrel_location][(
-                hashed_id, lexicon[word][0])].insert(0, [1, 0])
-            forward_dicts[barrel_location][(hashed_id, lexicon[word][0])].insert(
+                doc_id, lexicon[word][0])].insert(0, [1, 0])
+            forward_dicts[barrel_location][(doc_id, lexicon[word][0])].insert(
                 1, [0, 1, position])
         else:
             # if hit list is present we just increase hit count for content hits
             forward_dicts[barrel_location][(
-                hashed_id, lexicon[word][0])][1][1] += 1
+                doc_id, lexicon[word][0])][1][1] += 1
             forward_dicts[barrel_location][(
-                hashed_id, lexicon[word][0])][1].append(position)
+                doc_id, lexicon[word][0])][1].append(position)
 
         position += 1
 
     return word_count
 
 
-def process_loaded_data(loaded_data: Any, forward_dicts: List[Dict], lexicon: Dict[str, List[int]], document_index: Dict, doc_count: int, word_count: int) -> Tuple[int, int]:
-    """Parses loaded data and adds to forward dictionaries"""
+def tokenize_article(article: Dict) -> Tuple[List[str], List[str], Counter]:
+    """parses title and content of an article and counts their words before stemming,
+    it is run by the worker processes
+    """
+
+    title_words = tokenizer.split_words(article['title'])
+    content_words = tokenizer.split_words(article['content'])
+    stem = tokenizer.stem_cache.stem
+    return ([stem(word) for word in title_words], [stem(word) for word in content_words],
+            Counter(chain(title_words, content_words)))
+
+
+def process_loaded_data(loaded_data: Any, forward_dicts: List[Dict], lexicon: Dict[str, List[int]], store: DocumentStoreWriter, doc_count: int, word_count: int, pool: Any = None,
+                        stats: CollectionStats | None = None, duplicates: NearDuplicateIndex | None = None,
+                        duplicate_policy: str = DEFAULT_DUPLICATE_POLICY, word_counts: Counter | None = None) -> Tuple[int, int]:
+    """Parses loaded data and adds to forward dictionaries, the new articles are
+    appended to the document store and their record numbers are their doc ids.
+    Field lengths and word document frequencies of the new articles are added to
+    stats if given. Near duplicates of indexed documents found by duplicates are
+    indexed in their cluster or skipped, as duplicate_policy says. The words of the
+    new articles before stemming are counted in word_counts if given.
+    """
+
+    new_articles = []
+    article_ids = set()
 
     # read articles in loaded datas
     for article in loaded_data:
 
-        # hash the doc id
-        doc_id = bytes(article['id'], 'utf-8')
-        hashed_id = zlib.crc32(doc_id)
-
-        # If the article is already indexed then continue else add doc id to document index
-        if str(hashed_id) in document_index:
+        # If the article is already indexed then continue
+        if article['id'] in article_ids or store.find(article['id']) >= 0:
             continue
-        else:
-            document_index[str(hashed_id)] = article['url']
-            doc_count += 1
+        article_ids.add(article['id'])
+        new_articles.append(article)
+
+    # parse the articles' title and content, in worker processes if a pool is given
+    if pool is None:
+        parsed_articles = map(tokenize_article, new_articles)
+    else:
+        parsed_articles = pool.imap(
+            tokenize_article, new_articles, chunksize=TOKENIZE_CHUNK_SIZE)
+
+    # results come back in document order so doc ids and word ids are assigned deterministically
+    for article, (stemmed_title, stemmed_words, article_words) in zip(new_articles, parsed_articles):
 
-        # parse the article's content
-        stemmed_words = parse_content(article['content'])
+        # the stemmed content tells whether the article copies an indexed one
+        if duplicates is not None:
+            signature = minhash(stemmed_words)
+            cluster = duplicates.find(signature)
+            if cluster >= 0 and duplicate_policy == 'skip':
+                continue
 
-        # parse the article's title
-        stemmed_title = parse_content(article['title'])
+        # the article is stored under the next doc id
+        doc_id = store.add(article)
+        doc_count += 1
+        if duplicates is not None:
+            duplicates.add(doc_id, signature, cluster if cluster >= 0 else doc_id)
 
         word_count = process_article_title(stemmed_title, forward_dicts,
-                                           lexicon, hashed_id, word_count)
+                                           lexicon, doc_id, word_count)
         word_count = process_article_content(
-            stemmed_words, forward_dicts, lexicon, hashed_id, word_count)
+            stemmed_words, forward_dicts, lexicon, doc_id, word_count)
+
+        if word_counts is not None:
+            word_counts.update(article_words)
+
+        if stats is not None:
+            stats.add_document(doc_id, len(stemmed_title), len(stemmed_words),
+                               {lexicon[word][0] for word in chain(stemmed_title, stemmed_words)})
 
     return doc_count, word_count
 
 
-def generate_forward_index(path_to_data: str) -> List:
-    """This parses json files and creates lexicon and forward index"""
+@tracing.traced('index')
+def generate_forward_index(path_to_data: str, workers: int = 1, stem_cache_path: str | None = None,
+                           flush_interval: int = FLUSH_INTERVAL,
+                           duplicate_policy: str = DEFAULT_DUPLICATE_POLICY) -> List:
+    """This parses json files and creates lexicon and forward index, if workers
+    is more than 1 the articles are tokenized and stemmed by a process pool.
+    Stems cached by a previous run are loaded from stem_cache_path if given.
+    Corpus files are streamed and the forward dictionaries are written to the
+    barrels every flush_interval articles, so memory does not grow with file size.
+    Near duplicates of indexed articles are clustered or skipped by duplicate_policy.
+    The statistics, document store keys and surface forms including the new articles
+    are left next to the forward barrels, searches see them once the sorter commits
+    the batch. Errors are raised after the pool and barrels are closed and leave the
+    committed index as it was.
+    """
+
+    if duplicate_policy not in DUPLICATE_POLICIES:
+        raise ValueError("unknown duplicate policy {}".format(duplicate_policy))
 
     start = datetime.now()
+    if stem_cache_path:
+        tokenizer.stem_cache.load(stem_cache_path)
+    stem_hits, stem_misses = tokenizer.stem_cache.hits, tokenizer.stem_cache.misses
+
     doc_count = 0
     lexicon = get_lexicon()
     word_count = lexicon["word_count"][0]
 
+    # indexes whose postings use crc32 hashes of the article ids are switched to dense doc ids first
+    get_merger().renumber_documents()
+
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    forward_barrels = {}
+    stats = CollectionStats.load(get_index_file(STATS_KEY, STATS_FILE))
+    store = DocumentStoreWriter(
+        SEGMENTS_PATH, get_index_file(DOCUMENT_KEYS_KEY, None))
+    word_counts = Counter()
+    duplicates = None
+
     try:
 
-        # check the directory for files of json format
+        # documents stored before near duplicates were detected get their signatures from their text
+        with tracing.stage('duplicates_load'):
+            duplicates = NearDuplicateIndex(SEGMENTS_PATH, len(store),
+                                            store.committed.get_record if store.committed else None,
+                                            parse_content)
+
+        # check the directory for json, json lines and gzipped corpus files
         file_names = [pos_json for pos_json in os.listdir(
-            path_to_data) if pos_json.endswith('.json')]
+            path_to_data) if is_corpus_file(pos_json)]
 
-        # create a temporary document index to store record of documents being indexed
-        document_index = get_document_index()
         forward_barrels = get_forward_barrels()
 
         for file_name in file_names:
-            forward_dicts = get_forward_dicts()
-
-            # open file and load data to be processed
-            with open("{}/{}".format(path_to_data, file_name)) as f:
-                loaded_data = json.load(f)
 
-            doc_count, word_count = process_loaded_data(loaded_data, forward_dicts,
-                                                        lexicon, document_index, doc_count, word_count)
-
-            write_forward_barrels(forward_dicts, forward_barrels)
-
-    except Exception as error:
-        print(error)
-
-    # dump lexicon program which updates previous lexicon to create new lexicon
-    lexicon["word_count"][0] = word_count
-    with open('lexicon.txt', "w") as new_lexicon:
-        new_lexicon.write(json.dumps(lexicon))
-
-    # document index is written to document index file
-    with open('./document_index.txt', 'w') as new_document_index:
-        new_document_index.write(json.dumps(document_index))
+            # stream the articles of the file and process them batch by batch
+            articles = iter_articles("{}/{}".format(path_to_data, file_name))
+            for loaded_data in tracing.iter_stage('read', iter_batches(articles, flush_interval)):
+                forward_dicts = get_forward_dicts()
+
+                # tokenizing and stemming, in the worker processes if there is a pool
+                with tracing.stage('parse'):
+                    doc_count, word_count = process_loaded_data(loaded_data, forward_dicts,
+                                                                lexicon, store, doc_count, word_count, pool, stats,
+                                                                duplicates, duplicate_policy, word_counts)
+
+                with tracing.stage('barrel_write'):
+                    write_forward_barrels(forward_dicts, forward_barrels)
+
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        for forward_barrel in forward_barrels.values():
+            forward_barrel.close()
+        store.close()
+        if duplicates is not None:
+            duplicates.close()
+
+    if stem_cache_path:
+        tokenizer.stem_cache.save(stem_cache_path)
+
+    with tracing.stage('lexicon_write'):
+        # dump lexicon program which updates previous lexicon to create new lexicon,
+        # word ids of a batch which is never committed are simply left unused
+        lexicon["word_count"][0] = word_count
+        atomic_write('lexicon.txt', json.dumps(lexicon))
+
+        # document lengths and word frequencies used by BM25 ranking, the keys of the
+        # stored articles and the spellings shown by suggestions are published with
+        # the segment of the batch
+        if doc_count:
+            stats.save(BATCH_FILES[STATS_KEY])
+            store.commit(BATCH_FILES[DOCUMENT_KEYS_KEY])
+            surface_forms = SurfaceForms.load(get_index_file(SURFACE_FORMS_KEY, None))
+            surface_forms.add_words(word_counts, tokenizer.stem_cache.stem)
+            surface_forms.save(BATCH_FILES[SURFACE_FORMS_KEY])
+
+    tracing.count('documents', doc_count)
+    tracing.count('near_duplicates', duplicates.found)
+    tracing.count('stem_cache_hits', tokenizer.stem_cache.hits - stem_hits)
+    tracing.count('stem_cache_misses',
+                  tokenizer.stem_cache.misses - stem_misses)
 
     end = datetime.now()
     time_taken = str(end - start)
     print("The time of execution to create forward index and lexicon is:", time_taken)
     print('doc_count = ', doc_count)
     print('word_count = ', word_count)
+    print('near duplicates = ', duplicates.found)
+    print('stem cache = ', tokenizer.stem_cache.stats())
 
     if doc_count:  # if it is more than 0
         return [1, doc_count, time_taken]
     else:
         return [0, doc_count, time_taken]
+
+
+if __name__ == "__main__":
+    from sorter import inverted_index_generator
+
+    parser = argparse.ArgumentParser(
+        description="Index the json files of a directory")
+    parser.add_argument("path", help="directory containing the json files")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="number of processes used to tokenize and stem articles")
+    parser.add_argument("--stem-cache", default=None,
+                        help="file used to keep the stem cache between runs")
+    parser.add_argument("--flush-interval", type=int, default=FLUSH_INTERVAL,
+                        help="number of articles processed before writing to the forward barrels")
+    parser.add_argument("--barrel-count", type=int, default=None,
+                        help="most inverted barrels of the new segment, defaults to the manifest setting")
+    parser.add_argument("--duplicates", choices=DUPLICATE_POLICIES, default=DEFAULT_DUPLICATE_POLICY,
+                        help="index near duplicates of indexed articles in their cluster or skip them")
+    args = parser.parse_args()
+
+    if generate_forward_index(args.path, args.workers, args.stem_cache, args.flush_interval, args.duplicates)[0]:
+        inverted_index_generator(barrel_count=args.barrel_count)
+
+        # let a background merge started by the new segment finish before exiting
+        get_merger().wait()
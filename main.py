@@ -1,5 +1,3 @@
-import re
-import json
 import webbrowser
 from datetime import datetime
 from functools import partial
@@ -11,16 +9,9 @@ from tkinter.font import ITALIC, Font
 from tkinter import filedialog
 from tkHyperLinkManager import HyperlinkManager
 
-from nltk import stem
-from nltk.corpus import stopwords
-from nltk.stem.snowball import SnowballStemmer
-
-from searcher import search_words
-from indexer import generate_forward_index
-from sorter import inverted_index_generator
-
-stop_words = set(stopwords.words('english'))
-snow_stemmer = SnowballStemmer(language='english')
+from searcher import get_searcher
+from query import parse_query
+from docstore import get_snippet
 
 
 def click_search_button(event: Event, result: Text, search_text: Entry, window: Tk) -> None:
@@ -31,7 +22,6 @@ def click_search_button(event: Event, result: Text, search_text: Entry, window:
     start = datetime.now()
 
     search_text = search_text.get()
-    search_query = (re.sub('[^a-zA-Z]', ' ', search_text)).lower().split()
 
     # if the user didnt enter anything then return
     if len(search_text) == 0:
@@ -39,16 +29,15 @@ def click_search_button(event: Event, result: Text, search_text: Entry, window:
         result.insert(END, "You didn't enter anything!")
         return
 
-    # stem the input words
-    stemmed_words = [snow_stemmer.stem(
-        word) for word in search_query if not word in stop_words]
-
-    # open the file containing the URLs of each indexed document
-    url_file = open('document_index.txt', 'r')
-    doc_index = json.load(url_file)
+    # the shared searcher keeps the document store of the indexed documents open,
+    # the results are looked up in the documents of the commit they were ranked in
+    searcher = get_searcher()
+    snapshot = searcher.snapshot()
+    documents = snapshot[2]
 
-    # perform the search and get ranked documents
-    ranked_documents = search_words(stemmed_words)
+    # perform the search and get ranked documents, the query words are stemmed
+    # the same way documents are parsed and may contain phrases and NEAR operators
+    ranked_documents = searcher.search_query(search_text, snapshot=snapshot)
 
     end = datetime.now()
     time_taken = str((end - start).total_seconds())
@@ -67,14 +56,32 @@ def click_search_button(event: Event, result: Text, search_text: Entry, window:
     frame3.place(relx=0.5, rely=0.8, anchor=CENTER)
     result.delete(0.0, END)
 
-    # this displays the result
+    # this displays the result, the title, link and a snippet with the query words in bold
+    result.tag_config("match", font=("Helvetica", 14, "bold"))
+    words = parse_query(search_text).words
+
+    # words missing from the index are replaced by their closest terms
+    suggestion = searcher.suggest_query(search_text)
+    if suggestion is not None:
+        result.insert(END, "Did you mean: ")
+        result.insert(END, suggestion + "\n\n", "match")
     if len(ranked_documents):
         result.insert(END, "Search Results: \n\n")
         for document in ranked_documents:
-            url = doc_index[document[0]]
+            stored = documents.get(document[0]) or {}
+            url = stored.get("url") or ""
+            if stored.get("title"):
+                result.insert(END, stored["title"] + "\n")
             result.insert(END,  url, hyperLink.add(
                 partial(webbrowser.open, url)))
-            result.insert(END, "\n\n")
+            result.insert(END, "\n")
+            snippet, highlights = get_snippet(stored.get("text") or "", words)
+            position = 0
+            for start, end in highlights:
+                result.insert(END, snippet[position:start])
+                result.insert(END, snippet[start:end], "match")
+                position = end
+            result.insert(END, snippet[position:] + "\n\n")
     else:
         result.insert(END, "Sorry, no results found!")
 
@@ -90,6 +97,10 @@ def click_insert_data_button(result: Text) -> None:
     if folder_selected == "":
         return
 
+    # the indexing modules are only imported when data is inserted, searching starts without them
+    from indexer import generate_forward_index
+    from sorter import inverted_index_generator
+
     try:
         # if the index_info[0] contains a flag, it is 1 that means more documents
         # were added to the forward index else they weren't
@@ -138,6 +149,9 @@ def create_search_window() -> None:
 
     window.configure(background="black")
 
+    # the term indexes of the suggestions are made while the window opens
+    get_searcher().start_term_thread()
+
     logo = PhotoImage(file="./assets/talash_png_2.png")
     Label(window, image=logo, background="black").place(
         relx=0.5, rely=0.15, anchor=CENTER)
@@ -0,0 +1,243 @@
+import os
+import zlib
+import random
+import struct
+from typing import Any, Callable, Dict, List, Tuple
+
+from docstore import map_file
+
+# Near duplicate detection of articles at indexing time. The stemmed content words of
+# an article are cut into shingles of SHINGLE_SIZE words and the set of shingles is
+# summarized by a MinHash signature: for each of NUM_PERMUTATIONS hash functions the
+# smallest hash of any shingle. Two signatures agree at a position with probability
+# equal to the Jaccard similarity of the shingle sets. The signature is split into
+# LSH_BANDS bands, documents sharing all values of a band land in the same bucket, so
+# a new article is only compared to the documents of its buckets and counts as a near
+# duplicate if their signatures agree at SIMILARITY_THRESHOLD of the positions.
+#
+# Layout of "duplicates.bin" in the segments directory (little endian), one record per
+# record number of the document store:
+#
+#   cluster     uint32 doc id of the first indexed document of the near duplicate cluster
+#   signature   NUM_PERMUTATIONS x uint32 minhash values, EMPTY_HASH for documents without text
+#
+# The file is append only like the document store and the record count of the committed
+# document keys tells how much of it is committed. Searches keep the best ranked document
+# of every cluster. numpy is imported when the first signature is computed.
+
+DUPLICATES_FILE = 'duplicates.bin'
+
+# consecutive words of a shingle
+SHINGLE_SIZE = 3
+
+# hash functions of a signature
+NUM_PERMUTATIONS = 128
+
+# bands of the signature used as LSH bucket keys, NUM_PERMUTATIONS / LSH_BANDS values each
+LSH_BANDS = 32
+
+# share of equal signature values from which an article is a near duplicate of a document
+SIMILARITY_THRESHOLD = 0.8
+
+# 'cluster' indexes near duplicates under the cluster of the document they copy, 'skip' drops them
+DUPLICATE_POLICIES = ('cluster', 'skip')
+DEFAULT_DUPLICATE_POLICY = 'cluster'
+
+# value of every position of the signature of a document without shingles
+EMPTY_HASH = 0xffffffff
+
+# seed of the hash function coefficients, signatures of every run must be comparable
+SEED = 1
+
+# crc32 of every stemmed word seen, the stems of a corpus repeat in most of its articles
+WORD_HASHES = {}
+
+RECORD = struct.Struct('<{}I'.format(NUM_PERMUTATIONS + 1))
+CLUSTER = struct.Struct('<I')
+
+# the numpy module, the multipliers combining the word hashes of a shingle and the
+# coefficients a * x + b of the hash functions, set by load_numpy
+np = None
+SHINGLE_MULTIPLIERS = None
+COEFFICIENTS = None
+
+
+def load_numpy() -> None:
+    """imports numpy and makes the hash function coefficients on first use"""
+
+    global np, SHINGLE_MULTIPLIERS, COEFFICIENTS
+    if np is None:
+        import numpy
+        rng = random.Random(SEED)
+        SHINGLE_MULTIPLIERS = [numpy.uint64(rng.getrandbits(64) | 1) for _ in range(SHINGLE_SIZE)]
+        COEFFICIENTS = numpy.array([[rng.getrandbits(64) | 1 for _ in range(NUM_PERMUTATIONS)],
+                                    [rng.getrandbits(64) for _ in range(NUM_PERMUTATIONS)]], dtype=numpy.uint64)
+        np = numpy
+
+
+def minhash(words: List[str]) -> Any:
+    """returns the MinHash signature of the shingles of the stemmed words as an array,
+    or None if there are no words
+    """
+
+    if not words:
+        return None
+    load_numpy()
+    try:
+        word_hashes = np.fromiter(map(WORD_HASHES.__getitem__, words), dtype=np.uint64, count=len(words))
+    except KeyError:
+        for word in words:
+            if word not in WORD_HASHES:
+                WORD_HASHES[word] = zlib.crc32(word.encode('utf-8'))
+        word_hashes = np.fromiter(map(WORD_HASHES.__getitem__, words), dtype=np.uint64, count=len(words))
+
+    # the hash of a shingle combines the hashes of its words, shorter texts are one shingle.
+    # Repeated shingles are kept, they do not change the smallest hash
+    size = min(SHINGLE_SIZE, len(words))
+    count = len(words) - size + 1
+    shingles = word_hashes[:count] * SHINGLE_MULTIPLIERS[0]
+    for offset in range(1, size):
+        shingles += word_hashes[offset:offset + count] * SHINGLE_MULTIPLIERS[offset]
+
+    # multiply shift hashing, the products wrap around at 64 bits and the high half is
+    # the hash, the shift keeps the order so it is applied to the smallest values only
+    values = shingles[:, None] * COEFFICIENTS[0]
+    values += COEFFICIENTS[1]
+    return (values.min(axis=0) >> np.uint64(32)).astype(np.uint32)
+
+
+def get_band_keys(signature: Any) -> List[bytes]:
+    """returns the LSH bucket keys of the bands of a signature, bands of equal values
+    at different positions share a bucket, which only adds a candidate
+    """
+
+    size = NUM_PERMUTATIONS // LSH_BANDS * 4
+    data = signature.tobytes()
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+
+class NearDuplicateIndex:
+    """Signatures and clusters of the stored documents and the LSH buckets of the
+    first document of every cluster, used by the indexer to find the cluster of a
+    new article. Records are appended in doc id order, after count committed ones.
+    Documents indexed before their signatures were kept get them from get_record,
+    which returns a stored article, and are clustered among themselves.
+    """
+
+    def __init__(self, directory: str, count: int, get_record: Callable[[int], Dict[str, Any]] | None = None,
+                 parse: Callable[[str], List[str]] | None = None) -> None:
+        load_numpy()
+        self.path = os.path.join(directory, DUPLICATES_FILE)
+        self.clusters = []
+        self.signatures = []
+        self.buckets = {}
+        self.found = 0
+
+        # drop records which an unfinished batch appended after the last commit
+        os.makedirs(directory, exist_ok=True)
+        with open(self.path, 'ab+') as duplicates_file:
+            duplicates_file.truncate(
+                min(os.path.getsize(self.path), count * RECORD.size) // RECORD.size * RECORD.size)
+        records = np.fromfile(self.path, dtype='<u4').reshape(-1, NUM_PERMUTATIONS + 1)
+        self._file = open(self.path, 'ab')
+
+        for doc_id, record in enumerate(records):
+            self._insert(doc_id, record[1:] if record[1] != EMPTY_HASH else None, int(record[0]))
+
+        for doc_id in range(len(records), count):
+            article = get_record(doc_id) if get_record is not None else {}
+            signature = minhash(parse(article["text"])) if parse is not None and article.get("text") else None
+            cluster = self.find(signature)
+            self.add(doc_id, signature, cluster if cluster >= 0 else doc_id)
+        # found counts the near duplicates among new articles
+        self.found = 0
+
+    def _insert(self, doc_id: int, signature: Any, cluster: int) -> None:
+        self.clusters.append(cluster)
+        self.signatures.append(signature)
+        # only the first document of a cluster is bucketed, its copies are found through it.
+        # Most buckets hold one document, which is kept as a plain int: a list for each of
+        # them would be tracked by the garbage collector and slow down all of indexing
+        if signature is not None and cluster == doc_id:
+            for key in get_band_keys(signature):
+                bucket = self.buckets.get(key)
+                if bucket is None:
+                    self.buckets[key] = doc_id
+                elif isinstance(bucket, list):
+                    bucket.append(doc_id)
+                else:
+                    self.buckets[key] = [bucket, doc_id]
+
+    def find(self, signature: Any) -> int:
+        """returns the cluster of the most similar document if it is a near duplicate, otherwise -1"""
+
+        if signature is None:
+            return -1
+        candidates = set()
+        for key in get_band_keys(signature):
+            bucket = self.buckets.get(key)
+            if isinstance(bucket, list):
+                candidates.update(bucket)
+            elif bucket is not None:
+                candidates.add(bucket)
+
+        best, best_similarity = -1, SIMILARITY_THRESHOLD
+        for doc_id in candidates:
+            similarity = np.count_nonzero(
+                self.signatures[doc_id] == signature) / NUM_PERMUTATIONS
+            if similarity >= best_similarity:
+                best, best_similarity = doc_id, similarity
+        if best < 0:
+            return -1
+        self.found += 1
+        return self.clusters[best]
+
+    def add(self, doc_id: int, signature: Any, cluster: int) -> None:
+        """appends the record of the next stored document"""
+
+        if doc_id != len(self.clusters):
+            raise ValueError("document {} is not the next record {}".format(doc_id, len(self.clusters)))
+        values = signature if signature is not None else np.full(NUM_PERMUTATIONS, EMPTY_HASH, dtype=np.uint32)
+        self._file.write(CLUSTER.pack(cluster) + values.astype('<u4').tobytes())
+        self._insert(doc_id, signature, cluster)
+
+    def close(self) -> None:
+        """flushes the appended records to disk, they are committed with the document keys"""
+
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+
+class DuplicateClusters:
+    """Read only view of the clusters of the first count documents, the file is memory mapped"""
+
+    def __init__(self, directory: str, count: int) -> None:
+        path = os.path.join(directory, DUPLICATES_FILE)
+        self._records = map_file(path) if os.path.isfile(path) else None
+        self.count = min(count, len(self._records) // RECORD.size) if self._records is not None else 0
+
+    def get_cluster(self, doc_id: int) -> int:
+        """returns the doc id of the first document of the cluster, documents without a
+        record are their own cluster
+        """
+
+        if doc_id < self.count:
+            return CLUSTER.unpack_from(self._records, doc_id * RECORD.size)[0]
+        return doc_id
+
+    def collapse(self, ranked_documents: List[Tuple]) -> List[Tuple]:
+        """keeps the best ranked document of every cluster"""
+
+        seen = set()
+        collapsed = []
+        for ranked_document in ranked_documents:
+            cluster = self.get_cluster(int(ranked_document[0]))
+            if cluster not in seen:
+                seen.add(cluster)
+                collapsed.append(ranked_document)
+        return collapsed
+
+    def close(self) -> None:
+        if self._records is not None:
+            self._records.close()
@@ -0,0 +1,511 @@
+import os
+import json
+import heapq
+from bisect import bisect_left
+from itertools import accumulate, groupby
+from typing import List, Dict, Set, Tuple, Iterator, Iterable, BinaryIO, Any
+
+import tracing
+from atomic_file import atomic_open
+
+# Layout of a binary inverted barrel: the postings of every word are stored as
+# one contiguous term block, the lexicon offset of the word points to its header.
+#
+#   term header  word_id, document frequency, byte length of the postings (varints)
+#   postings     for every document, sorted by doc id:
+#                doc id delta, title hit count, content hit count,
+#                content hit positions as deltas (all varints)
+#
+# Decoded postings have the same shape as the lines of the old text barrels:
+# [[doc_id, word_id], [[1, title_hits], [0, content_hits, p1, p2, ...]]]
+#
+# Format 2, written for every new segment, adds a fourth header varint with the
+# byte length of a skip table stored between the header and the postings. Words
+# with more than BLOCK_SIZE documents have their postings split in blocks of
+# BLOCK_SIZE documents, the table holds the last doc id and the byte length of
+# every block (as deltas), so a cursor can jump to the block holding a doc id and
+# decode only that block. The postings bytes are the same in both formats.
+
+BARREL_EXTENSION = '.bin'
+MAX_HEADER_SIZE = 40  # four varints of at most 10 bytes each
+
+# format of the term blocks written by write_merged_barrel
+POSTINGS_FORMAT = 2
+
+# number of documents in a block of postings addressed by the skip table
+BLOCK_SIZE = 128
+
+# doc id of a posting cursor which has passed the last posting, larger than any doc id
+END_OF_POSTINGS = 1 << 64
+
+# consecutive word ids stored in one barrel
+WORDS_PER_BARREL = 533
+
+
+def get_barrel_num(word_id: int) -> int:
+    """returns number of the barrel which stores the word"""
+
+    return int(word_id / WORDS_PER_BARREL) + 1
+
+
+def get_barrel_file_name(barrel_num: int | str) -> str:
+    """returns file name of the binary inverted barrel with given number"""
+
+    return "inverted_barrel_" + str(barrel_num) + BARREL_EXTENSION
+
+
+def is_barrel_file(file_name: str) -> bool:
+    """returns True if the file name is the name of a binary inverted barrel"""
+
+    return file_name.startswith("inverted_barrel_") and file_name.endswith(BARREL_EXTENSION)
+
+
+def get_inverted_barrel_path(barrel_num: int | str) -> str:
+    """returns path of the binary inverted barrel with given number"""
+
+    return "./InvertedBarrels/" + get_barrel_file_name(barrel_num)
+
+
+def posting_key(posting: List) -> List[int]:
+    """returns (word_id, doc_id) by which inverted barrels are sorted"""
+
+    return [posting[0][1], posting[0][0]]
+
+
+def encode_varint(value: int, out: bytearray) -> None:
+    """appends value to out as a little endian base 128 varint"""
+
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    """decodes varint starting at pos and returns value and next position"""
+
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def encode_postings(word_postings: List, prev_doc_id: int = 0) -> bytes:
+    """encodes postings of a single word, they must be sorted by doc id, the first
+    doc id is stored as delta of prev_doc_id
+    """
+
+    out = bytearray()
+    for posting in word_postings:
+        doc_id = posting[0][0]
+        title_hit_list, content_hit_list = posting[1]
+
+        encode_varint(doc_id - prev_doc_id, out)
+        encode_varint(title_hit_list[1], out)
+        encode_varint(content_hit_list[1], out)
+
+        prev_position = 0
+        for position in content_hit_list[2:]:
+            encode_varint(position - prev_position, out)
+            prev_position = position
+
+        prev_doc_id = doc_id
+    return bytes(out)
+
+
+def decode_varints(data: bytes) -> List[int]:
+    """decodes a sequence of varints into a list of integers"""
+
+    # most values in a term block fit in a single byte, then there is nothing to decode
+    if not data or max(data) < 0x80:
+        return list(data)
+
+    values = []
+    value = 0
+    shift = 0
+    for byte in data:
+        if byte < 0x80:
+            values.append(value | (byte << shift))
+            value = 0
+            shift = 0
+        else:
+            value |= (byte & 0x7f) << shift
+            shift += 7
+    return values
+
+
+def encode_blocks(word_postings: List) -> Tuple[bytes, bytes]:
+    """encodes postings of a single word sorted by doc id in blocks of BLOCK_SIZE
+    documents and returns the postings and the skip table of the blocks
+    """
+
+    payload = bytearray()
+    skip_table = bytearray()
+    prev_doc_id = 0
+    for start in range(0, len(word_postings), BLOCK_SIZE):
+        block = word_postings[start:start + BLOCK_SIZE]
+        data = encode_postings(block, prev_doc_id)
+        payload += data
+
+        last_doc_id = block[-1][0][0]
+        encode_varint(last_doc_id - prev_doc_id, skip_table)
+        encode_varint(len(data), skip_table)
+        prev_doc_id = last_doc_id
+    return bytes(payload), bytes(skip_table)
+
+
+def decode_postings(word_id: int, doc_count: int, data: bytes, doc_id: int = 0) -> List:
+    """decodes the postings of a term block into text barrel shaped lists, doc_id
+    is the doc id the first delta is added to
+    """
+
+    values = decode_varints(data)
+
+    postings = []
+    pos = 0
+    for _ in range(doc_count):
+        # doc id delta, title hits and content hits followed by position deltas
+        doc_id += values[pos]
+        title_hits = values[pos + 1]
+        content_hits = values[pos + 2]
+        pos += 3
+
+        content_hit_list = [0, content_hits]
+        content_hit_list.extend(accumulate(values[pos:pos + content_hits]))
+        pos += content_hits
+
+        postings.append([[doc_id, word_id], [[1, title_hits], content_hit_list]])
+    return postings
+
+
+def write_term_postings(barrel_file: BinaryIO, word_postings: List, postings_format: int = 1) -> int:
+    """writes postings of a single word as a term block and returns its offset"""
+
+    word_postings = sorted(word_postings, key=lambda posting: posting[0][0])
+    skip_table = b''
+    if postings_format >= 2 and len(word_postings) > BLOCK_SIZE:
+        payload, skip_table = encode_blocks(word_postings)
+    else:
+        payload = encode_postings(word_postings)
+
+    header = bytearray()
+    encode_varint(word_postings[0][0][1], header)
+    encode_varint(len(word_postings), header)
+    encode_varint(len(payload), header)
+    if postings_format >= 2:
+        encode_varint(len(skip_table), header)
+
+    offset = barrel_file.tell()
+    barrel_file.write(header)
+    barrel_file.write(skip_table)
+    barrel_file.write(payload)
+    return offset
+
+
+def read_term_header(data: bytes, pos: int = 0) -> Tuple[int, int, int, int]:
+    """returns word id, document frequency, byte length and start of postings"""
+
+    word_id, pos = decode_varint(data, pos)
+    doc_count, pos = decode_varint(data, pos)
+    length, pos = decode_varint(data, pos)
+    return word_id, doc_count, length, pos
+
+
+def read_term_postings(barrel_file: BinaryIO, offset: int) -> List:
+    """reads the term block at offset with a single slice and decodes it"""
+
+    barrel_file.seek(offset)
+    header = barrel_file.read(MAX_HEADER_SIZE)
+    word_id, doc_count, length, pos = read_term_header(header)
+
+    data = header[pos:pos + length]
+    if len(data) < length:
+        data += barrel_file.read(length - len(data))
+
+    return decode_postings(word_id, doc_count, data)
+
+
+def read_skip_length(data: bytes, pos: int, postings_format: int) -> Tuple[int, int]:
+    """returns byte length of the skip table of a term block and the start of the
+    table, blocks of format 1 have no table
+    """
+
+    if postings_format >= 2:
+        return decode_varint(data, pos)
+    return 0, pos
+
+
+def read_term_block(fd: int, offset: int, postings_format: int = 1) -> Tuple[int, int, bytes, bytes]:
+    """reads the term block at offset of an open barrel file descriptor with pread,
+    returns word id, document frequency, encoded postings and skip table
+    """
+
+    header = os.pread(fd, MAX_HEADER_SIZE, offset)
+    word_id, doc_count, length, pos = read_term_header(header)
+    skip_length, pos = read_skip_length(header, pos, postings_format)
+
+    end = pos + skip_length + length
+    data = header[pos:end]
+    if len(header) < end:
+        data += os.pread(fd, end - len(header), offset + len(header))
+
+    return word_id, doc_count, data[skip_length:], data[:skip_length]
+
+
+def iter_term_blocks(path: str, postings_format: int = 1) -> Iterator[Tuple[int, int, bytes]]:
+    """yields word id, document frequency and encoded postings of every term block
+    in the binary barrel at path, reading one block at a time
+    """
+
+    with open(path, 'rb') as barrel_file:
+        offset = 0
+        while True:
+            barrel_file.seek(offset)
+            header = barrel_file.read(MAX_HEADER_SIZE)
+            if not header:
+                return
+            word_id, doc_count, length, pos = read_term_header(header)
+            skip_length, pos = read_skip_length(header, pos, postings_format)
+
+            end = pos + skip_length + length
+            data = header[pos:end]
+            if len(header) < end:
+                data += barrel_file.read(end - len(header))
+
+            yield word_id, doc_count, data[skip_length:]
+            offset += end
+
+
+def iter_barrel_postings(path: str, postings_format: int = 1) -> Iterator[List]:
+    """yields every posting stored in the binary barrel at path, sorted by word id and doc id"""
+
+    for word_id, doc_count, data in iter_term_blocks(path, postings_format):
+        yield from decode_postings(word_id, doc_count, data)
+
+
+def write_merged_barrel(sources: Iterable[Iterator[List]], path: str, doc_ids: Set[int] | None = None) -> Dict[int, int]:
+    """k-way merges posting streams sorted by word id and doc id into a binary
+    barrel of POSTINGS_FORMAT at path and returns the offset of every word, only
+    one word's postings are held in memory at a time. Doc ids seen are added to
+    doc_ids if given.
+    """
+
+    offsets = {}
+    with open(path, 'wb') as barrel_file:
+        merged = heapq.merge(*sources, key=posting_key)
+        for word_id, word_postings in groupby(merged, key=lambda posting: posting[0][1]):
+            word_postings = list(word_postings)
+            if doc_ids is not None:
+                doc_ids.update(posting[0][0] for posting in word_postings)
+            offsets[word_id] = write_term_postings(
+                barrel_file, word_postings, POSTINGS_FORMAT)
+    return offsets
+
+
+def gallop(values: List[int], target: int, pos: int, end: int | None = None) -> int:
+    """returns the first index from pos on whose value is >= target, or end if there
+    is none. The step is doubled until the target is passed and the last step is
+    binary searched, so short jumps cost few comparisons and long ones are logarithmic.
+    """
+
+    if end is None:
+        end = len(values)
+    if pos >= end or values[pos] >= target:
+        return pos
+
+    step = 1
+    while pos + step < end and values[pos + step] < target:
+        pos += step
+        step *= 2
+    return bisect_left(values, target, pos + 1, min(pos + step, end))
+
+
+class PostingCursor:
+    """Walks over the decoded postings of a word in doc id order and can jump
+    forward to a target doc id with galloping search. doc_id is the doc id under
+    the cursor or END_OF_POSTINGS once the postings are exhausted.
+    """
+
+    def __init__(self, postings: List) -> None:
+        self.postings = postings
+        self.doc_ids = [posting[0][0] for posting in postings]
+        self.doc_ids.append(END_OF_POSTINGS)
+        self.pos = 0
+        self.doc_id = self.doc_ids[0]
+
+    @property
+    def posting(self) -> List:
+        return self.postings[self.pos]
+
+    def __len__(self) -> int:
+        return len(self.postings)
+
+    def next(self) -> int:
+        """moves to the next posting and returns its doc id"""
+
+        if self.doc_id != END_OF_POSTINGS:
+            self.pos += 1
+            self.doc_id = self.doc_ids[self.pos]
+        return self.doc_id
+
+    def next_geq(self, target: int) -> int:
+        """moves to the first posting with doc id >= target and returns its doc id"""
+
+        if self.doc_id >= target:
+            return self.doc_id
+
+        # the END_OF_POSTINGS sentinel stops the search at the end of the list
+        self.pos = gallop(self.doc_ids, target, self.pos, len(self.doc_ids) - 1)
+        self.doc_id = self.doc_ids[self.pos]
+        return self.doc_id
+
+
+class BlockPostingCursor:
+    """Posting cursor over a term block with a skip table. Only the block under the
+    cursor is decoded, next_geq gallops over the last doc ids of the blocks and
+    decodes just the block which can hold the target, so intersecting with a short
+    list decodes a few blocks of a long one.
+    """
+
+    def __init__(self, word_id: int, doc_count: int, data: bytes, skip_table: bytes) -> None:
+        values = decode_varints(skip_table)
+        self.word_id = word_id
+        self.doc_count = doc_count
+        self.data = data
+        # last doc id and end offset of every block
+        self.block_doc_ids = list(accumulate(values[0::2]))
+        self.block_ends = list(accumulate(values[1::2]))
+        self.block = -1
+        self.postings = []
+        self.doc_ids = []
+        self.pos = 0
+        self.doc_id = -1
+        self._load_block(0)
+
+    def _load_block(self, block: int) -> None:
+        """decodes a block and moves the cursor to its first posting"""
+
+        self.block = block
+        if block == len(self.block_ends):
+            self.postings = []
+            self.doc_ids = []
+            self.doc_id = END_OF_POSTINGS
+            return
+
+        start = self.block_ends[block - 1] if block else 0
+        base = self.block_doc_ids[block - 1] if block else 0
+        count = min(BLOCK_SIZE, self.doc_count - block * BLOCK_SIZE)
+        tracing.count('postings_decoded', count)
+        self.postings = decode_postings(
+            self.word_id, count, self.data[start:self.block_ends[block]], base)
+        self.doc_ids = [posting[0][0] for posting in self.postings]
+        self.pos = 0
+        self.doc_id = self.doc_ids[0]
+
+    @property
+    def posting(self) -> List:
+        return self.postings[self.pos]
+
+    def __len__(self) -> int:
+        return self.doc_count
+
+    def next(self) -> int:
+        """moves to the next posting and returns its doc id"""
+
+        if self.doc_id != END_OF_POSTINGS:
+            self.pos += 1
+            if self.pos == len(self.doc_ids):
+                self._load_block(self.block + 1)
+            else:
+                self.doc_id = self.doc_ids[self.pos]
+        return self.doc_id
+
+    def next_geq(self, target: int) -> int:
+        """moves to the first posting with doc id >= target and returns its doc id"""
+
+        if self.doc_id >= target:
+            return self.doc_id
+
+        # blocks ending before the target are skipped without decoding them
+        if self.block_doc_ids[self.block] < target:
+            self._load_block(gallop(self.block_doc_ids, target, self.block + 1))
+            if self.doc_id >= target:
+                return self.doc_id
+
+        self.pos = gallop(self.doc_ids, target, self.pos)
+        self.doc_id = self.doc_ids[self.pos]
+        return self.doc_id
+
+
+class UnionCursor:
+    """Posting cursor over the postings of a word in several segments, every
+    document is indexed in exactly one segment so the lists never share a doc id
+    """
+
+    def __init__(self, cursors: List[Any]) -> None:
+        self.cursors = cursors
+        self._update()
+
+    def _update(self) -> None:
+        self.current = min(self.cursors, key=lambda cursor: cursor.doc_id)
+        self.doc_id = self.current.doc_id
+
+    @property
+    def posting(self) -> List:
+        return self.current.posting
+
+    def __len__(self) -> int:
+        return sum(len(cursor) for cursor in self.cursors)
+
+    def next(self) -> int:
+        """moves to the next posting and returns its doc id"""
+
+        if self.doc_id != END_OF_POSTINGS:
+            self.current.next()
+            self._update()
+        return self.doc_id
+
+    def next_geq(self, target: int) -> int:
+        """moves to the first posting with doc id >= target and returns its doc id"""
+
+        if self.doc_id < target:
+            for cursor in self.cursors:
+                cursor.next_geq(target)
+            self._update()
+        return self.doc_id
+
+
+def is_text_barrel_file(file_name: str) -> bool:
+    """returns True if the file name is the name of a json per line inverted barrel"""
+
+    return file_name.startswith("inverted_barrel_") and file_name.endswith('.txt')
+
+
+def convert_text_barrel(text_path: str, barrel_path: str, lexicon: Dict[str, List[int]],
+                        words: Dict[int, str]) -> None:
+    """writes the postings of a json per line inverted barrel to a binary barrel and
+    sets the offsets of their words in lexicon, words maps word ids to words. The
+    binary barrel replaces barrel_path atomically and the text barrel is left in place.
+    """
+
+    # group postings of the text barrel by word id, they are already sorted by word id
+    grouped = {}
+    with open(text_path, 'r') as text_file:
+        for line in text_file:
+            posting = json.loads(line)
+            grouped.setdefault(posting[0][1], []).append(posting)
+
+    offsets = {}
+    with atomic_open(barrel_path, 'wb') as barrel_file:
+        for word_id, word_postings in grouped.items():
+            offsets[words[word_id]] = write_term_postings(
+                barrel_file, word_postings)
+
+    # the offsets are only used once the barrel is complete
+    for word, offset in offsets.items():
+        lexicon[word] = [lexicon[word][0], offset]
@@ -0,0 +1,134 @@
+from bisect import bisect_left
+from typing import Any, List
+
+# The hit positions of a word in a document are sorted, so for every pair of query
+# words each occurrence of the word with fewer hits is matched to the nearest
+# occurrence of the other word by binary search. Long hit lists are matched with
+# one vectorized searchsorted over integer arrays and the distances are weighted
+# in batch, short ones are matched with bisect since numpy calls cost more than the
+# search itself. A pair adds at most 10 * min(content hits) to the score, which the
+# top k bounds rely on. numpy is imported when the first long hit list is matched,
+# processes ranking with BM25 never load it.
+
+# fewer hits than this are matched without numpy
+VECTORIZE_MIN_HITS = 32
+
+# position before and after every possible position, the position arrays are padded with them
+# so the nearest occurrence on both sides always exists
+SENTINEL = 1 << 40
+
+# weight of every distance up to 101, larger distances weigh the same as 101
+DISTANCE_WEIGHTS = [10] * 2 + [8] * 9 + [4] * 90 + [2]
+
+# the numpy module and DISTANCE_WEIGHTS as an array, set by load_numpy
+np = None
+WEIGHTS = None
+
+
+def load_numpy() -> None:
+    """imports numpy and makes the weights array on first use"""
+
+    global np, WEIGHTS
+    if np is None:
+        import numpy
+        WEIGHTS = numpy.array(DISTANCE_WEIGHTS)
+        np = numpy
+
+
+def get_positions(content_hit_list: List[int]) -> Any:
+    """returns the positions of a content hit list [0, hits, p1, p2, ...] as an array
+    padded with a sentinel at both ends
+    """
+
+    load_numpy()
+    positions = np.empty(content_hit_list[1] + 2, dtype=np.int64)
+    positions[0] = -SENTINEL
+    positions[1:-1] = content_hit_list[2:]
+    positions[-1] = SENTINEL
+    return positions
+
+
+def nearest_distances(positions: Any, other_positions: Any) -> Any:
+    """returns for every position the distance to the nearest of other_positions,
+    both are padded arrays made by get_positions
+    """
+
+    # the nearest occurrence is either the first one at or after the position or the one before it
+    positions = positions[1:-1]
+    right = np.searchsorted(other_positions, positions)
+    return np.minimum(other_positions[right] - positions, positions - other_positions[right - 1])
+
+
+def proximity_weights(distances: Any) -> int:
+    """returns the summed weights of the distances"""
+
+    load_numpy()
+    return int(WEIGHTS[np.minimum(distances, len(WEIGHTS) - 1)].sum())
+
+
+def nearest_weights(hit_list: List[int], other_hit_list: List[int]) -> int:
+    """returns the summed weights of the nearest distances of the hits of hit_list,
+    searching other_hit_list in place with bisect
+    """
+
+    weight = 0
+    first = 2
+    last = len(other_hit_list) - 1
+    for position in hit_list[2:]:
+        right = bisect_left(other_hit_list, position, first)
+        if right > last:
+            distance = position - other_hit_list[last]
+        elif right == first:
+            distance = other_hit_list[first] - position
+        else:
+            distance = min(other_hit_list[right] - position,
+                           position - other_hit_list[right - 1])
+
+        # the same weights as DISTANCE_WEIGHTS, comparisons are cheaper than indexing here
+        if distance <= 1:
+            weight += 10
+        elif distance <= 10:
+            weight += 8
+        elif distance <= 100:
+            weight += 4
+        else:
+            weight += 2
+    return weight
+
+
+def pair_proximity(hit_list: List[int], other_hit_list: List[int],
+                   positions: Any = None, other_positions: Any = None) -> int:
+    """returns the proximity weight of two words from their content hit lists in a
+    document, the occurrences of the word with fewer hits are matched to the other
+    word. Position arrays already made from the hit lists can be passed to reuse them.
+    """
+
+    if hit_list[1] > other_hit_list[1]:
+        hit_list, other_hit_list = other_hit_list, hit_list
+        positions, other_positions = other_positions, positions
+    if hit_list[1] == 0:
+        return 0
+    if hit_list[1] < VECTORIZE_MIN_HITS:
+        return nearest_weights(hit_list, other_hit_list)
+
+    if positions is None:
+        positions = get_positions(hit_list)
+    if other_positions is None:
+        other_positions = get_positions(other_hit_list)
+    return proximity_weights(nearest_distances(positions, other_positions))
+
+
+def proximity_score(hit_lists: List[List[int]]) -> int:
+    """returns the proximity weight of all pairs of words in query order, the
+    position arrays of long hit lists are made only once
+    """
+
+    positions = [get_positions(hit_list) if hit_list[1] >= VECTORIZE_MIN_HITS else None
+                 for hit_list in hit_lists]
+
+    score = 0
+    for i in range(1, len(hit_lists)):
+        for j in range(i):
+            score += pair_proximity(hit_lists[j], hit_lists[i],
+                                    positions[j], positions[i])
+    return score
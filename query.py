@@ -0,0 +1,464 @@
+import re
+from typing import List, Any, Callable, Tuple
+
+from postings import END_OF_POSTINGS, gallop
+from tokenizer import parse_content
+
+# A query is made of words, "quoted phrases", NEAR/n operators between two words and
+# the boolean operators AND, OR, NOT with parentheses for grouping:
+#
+#   corona "stay at home" (lockdown NEAR/5 protest OR curfew) NOT vaccine
+#
+# NOT binds tightest, then AND, then OR. Items written next to each other are
+# alternatives as in a plain search, except that phrases and NEAR pairs must be
+# satisfied and NOT items are excluded. NOT only removes documents from what the
+# other items of its group match, a query made only of NOT items matches nothing.
+# Every word which is not negated ranks the matched documents as in a plain search.
+#
+# The query is evaluated document at a time by a tree of matchers. Conjunctions
+# intersect their children rarest first with galloping next_geq, posting cursors
+# skip whole blocks of long lists, and phrases and NEAR pairs check the content
+# positions of a candidate with the same galloping search.
+
+QUERY_TOKEN = re.compile(r'"([^"]*)"?|NEAR/(\d+)|([()])|([^\s()"]+)')
+
+OPERATORS = ('AND', 'OR', 'NOT')
+
+# nodes of a parsed query are tuples starting with their kind:
+#   ('word', word)  ('phrase', [words])  ('near', word, word, distance)
+#   ('and', [nodes])  ('or', [nodes])  ('not', node)  ('seq', [nodes])
+# a NEAR operator becomes ('and', [left, right, ('near', ...)]) of its operands
+CONSTRAINTS = ('phrase', 'near')
+
+
+def phrase_occurs(hit_lists: List[List[int]], offsets: List[int]) -> bool:
+    """returns True if every word occurs at its offset from a common start, the
+    content hit lists must be ordered rarest first
+    """
+
+    first_hit_list = hit_lists[0]
+    positions = [2] * len(hit_lists)
+
+    # every occurrence of the rarest word gives a start which the other words must follow
+    for position in first_hit_list[2:]:
+        start = position - offsets[0]
+        for i in range(1, len(hit_lists)):
+            hit_list = hit_lists[i]
+            target = start + offsets[i]
+            pos = positions[i] = gallop(hit_list, target, positions[i])
+            if pos == len(hit_list):
+                # the word does not occur after this start so no later start matches either
+                return False
+            if hit_list[pos] != target:
+                break
+        else:
+            return True
+    return False
+
+
+def near_occurs(hit_list: List[int], other_hit_list: List[int], distance: int) -> bool:
+    """returns True if an occurrence of one word is at most distance positions away
+    from an occurrence of the other, hit_list should be the rarer word
+    """
+
+    pos = 2
+    for position in hit_list[2:]:
+        pos = gallop(other_hit_list, position - distance, pos)
+        if pos == len(other_hit_list):
+            return False
+        if other_hit_list[pos] <= position + distance:
+            return True
+    return False
+
+
+def intersect(matchers: List[Any], target: int) -> int:
+    """moves the matchers to the first doc id >= target they all match and returns
+    it, the first matcher drives the search so it should be the most selective
+    """
+
+    candidate = matchers[0].next_geq(target)
+    i = 1
+    while i < len(matchers) and candidate != END_OF_POSTINGS:
+        doc_id = matchers[i].next_geq(candidate)
+        if doc_id == candidate:
+            i += 1
+        else:
+            # the candidate is missing from this matcher, restart from the rarest one
+            candidate = matchers[0].next_geq(doc_id)
+            i = 1
+    return candidate
+
+
+class TermMatcher:
+    """Matches the documents containing a word. Like the other matchers it exposes
+    the doc id it is positioned on and can jump forward with next_geq, cost is the
+    most documents it can match and orders matchers in intersections.
+    """
+
+    def __init__(self, cursor: Any) -> None:
+        self.cursor = cursor
+        self.cost = len(cursor)
+        self.doc_id = -1
+
+    def next_geq(self, target: int) -> int:
+        """moves to the first matching doc id >= target and returns it"""
+
+        self.doc_id = self.cursor.next_geq(target)
+        return self.doc_id
+
+
+class PositionalMatcher:
+    """Matches the documents containing all words whose content positions satisfy
+    occurs, which is called with the content hit lists ordered rarest first and the
+    index every word has in the query. Phrase and NEAR matchers only differ by it.
+    """
+
+    def __init__(self, cursors: List[Any], occurs: Callable[[List[List[int]], List[int]], bool]) -> None:
+        self.order = sorted(range(len(cursors)),
+                            key=lambda i: len(cursors[i]))
+        self.cursors = [cursors[i] for i in self.order]
+        self.occurs = occurs
+        self.cost = len(self.cursors[0])
+        self.doc_id = -1
+
+    def next_geq(self, target: int) -> int:
+        """moves to the first matching doc id >= target and returns it"""
+
+        if self.doc_id >= target:
+            return self.doc_id
+
+        doc_id = intersect(self.cursors, target)
+        while doc_id != END_OF_POSTINGS and not self.occurs(
+                [cursor.posting[1][1] for cursor in self.cursors], self.order):
+            doc_id = intersect(self.cursors, doc_id + 1)
+        self.doc_id = doc_id
+        return doc_id
+
+
+def get_phrase_matcher(cursors: List[Any]) -> PositionalMatcher:
+    """returns a matcher of the documents whose content contains the words one after another"""
+
+    # the index of a word in the phrase is its offset from the start of the phrase
+    return PositionalMatcher(cursors, phrase_occurs)
+
+
+def get_near_matcher(cursors: List[Any], distance: int) -> PositionalMatcher:
+    """returns a matcher of the documents whose content has the two words at most distance positions apart"""
+
+    return PositionalMatcher(cursors, lambda hit_lists, _: near_occurs(hit_lists[0], hit_lists[1], distance))
+
+
+class ConjunctionMatcher:
+    """Matches the documents matched by all of the matchers, the cheapest one
+    drives the intersection so its cost bounds the work
+    """
+
+    def __init__(self, matchers: List[Any]) -> None:
+        self.matchers = sorted(matchers, key=lambda matcher: matcher.cost)
+        self.cost = self.matchers[0].cost
+        self.doc_id = -1
+
+    def next_geq(self, target: int) -> int:
+        """moves to the first matching doc id >= target and returns it"""
+
+        if self.doc_id < target:
+            self.doc_id = intersect(self.matchers, target)
+        return self.doc_id
+
+
+class DisjunctionMatcher:
+    """Matches the documents matched by any of the matchers"""
+
+    def __init__(self, matchers: List[Any]) -> None:
+        self.matchers = matchers
+        self.cost = sum(matcher.cost for matcher in matchers)
+        self.doc_id = -1
+
+    def next_geq(self, target: int) -> int:
+        """moves to the first matching doc id >= target and returns it"""
+
+        if self.doc_id < target:
+            self.doc_id = min(matcher.next_geq(target)
+                              for matcher in self.matchers)
+        return self.doc_id
+
+
+class ExclusionMatcher:
+    """Matches the documents matched by a matcher but not by the excluded one"""
+
+    def __init__(self, matcher: Any, excluded: Any) -> None:
+        self.matcher = matcher
+        self.excluded = excluded
+        self.cost = matcher.cost
+        self.doc_id = -1
+
+    def next_geq(self, target: int) -> int:
+        """moves to the first matching doc id >= target and returns it"""
+
+        if self.doc_id >= target:
+            return self.doc_id
+
+        doc_id = self.matcher.next_geq(target)
+        while doc_id != END_OF_POSTINGS and self.excluded.next_geq(doc_id) == doc_id:
+            doc_id = self.matcher.next_geq(doc_id + 1)
+        self.doc_id = doc_id
+        return doc_id
+
+
+def combine(matchers: List[Any], combinator: Callable[[List[Any]], Any]) -> Any:
+    """returns the only matcher or the matchers combined"""
+
+    return matchers[0] if len(matchers) == 1 else combinator(matchers)
+
+
+class QueryParser:
+    """Recursive descent parser of the query grammar
+
+        sequence := or_expr*
+        or_expr  := and_expr (OR and_expr)*
+        and_expr := not_expr (AND not_expr)*
+        not_expr := NOT not_expr | near
+        near     := primary (NEAR/n primary)*
+        primary  := word | "phrase" | ( sequence )
+
+    Misplaced operators and parentheses are skipped, words which are stop words
+    disappear from the query.
+    """
+
+    def __init__(self, text: str) -> None:
+        self.tokens = []
+        for phrase, distance, parenthesis, word in QUERY_TOKEN.findall(text):
+            if distance:
+                self.tokens.append(('near', int(distance)))
+            elif parenthesis:
+                self.tokens.append((parenthesis, None))
+            elif word in OPERATORS:
+                self.tokens.append((word, None))
+            elif word:
+                self.tokens.append(('text', parse_content(word)))
+            else:
+                self.tokens.append(('phrase', parse_content(phrase)))
+        self.pos = 0
+
+    def peek(self) -> str | None:
+        return self.tokens[self.pos][0] if self.pos < len(self.tokens) else None
+
+    def parse(self) -> Tuple | None:
+        node = self.parse_sequence()
+        while self.pos < len(self.tokens):
+            # a closing parenthesis without an opening one
+            self.pos += 1
+            node = make_node('seq', [node, self.parse_sequence()])
+        return node
+
+    def parse_sequence(self) -> Tuple | None:
+        nodes = []
+        while self.peek() not in (None, ')'):
+            start = self.pos
+            nodes.append(self.parse_or())
+            if self.pos == start:
+                # an operator without operands
+                self.pos += 1
+        return make_node('seq', nodes)
+
+    def parse_or(self) -> Tuple | None:
+        nodes = [self.parse_and()]
+        while self.peek() == 'OR':
+            self.pos += 1
+            nodes.append(self.parse_and())
+        return make_node('or', nodes)
+
+    def parse_and(self) -> Tuple | None:
+        nodes = [self.parse_not()]
+        while self.peek() == 'AND':
+            self.pos += 1
+            nodes.append(self.parse_not())
+        return make_node('and', nodes)
+
+    def parse_not(self) -> Tuple | None:
+        if self.peek() == 'NOT':
+            self.pos += 1
+            node = self.parse_not()
+            return ('not', node) if node is not None else None
+        return self.parse_near()
+
+    def parse_near(self) -> Tuple | None:
+        node = self.parse_primary()
+        while self.peek() == 'near':
+            distance = self.tokens[self.pos][1]
+            self.pos += 1
+            node = make_near(node, self.parse_primary(), distance)
+        return node
+
+    def parse_primary(self) -> Tuple | None:
+        kind = self.peek()
+        if kind == '(':
+            self.pos += 1
+            node = self.parse_sequence()
+            if self.peek() == ')':
+                self.pos += 1
+            return node
+        if kind not in ('text', 'phrase'):
+            return None
+
+        words = self.tokens[self.pos][1]
+        self.pos += 1
+        if kind == 'phrase':
+            return ('phrase', words) if words else None
+        # a word can be split in several stems, like a plain search they are alternatives
+        return make_node('seq', [('word', word) for word in words])
+
+
+def make_node(kind: str, nodes: List[Tuple | None]) -> Tuple | None:
+    """returns a node of given kind without the empty children, or the only child"""
+
+    nodes = [node for node in nodes if node is not None]
+    if not nodes:
+        return None
+    if len(nodes) == 1:
+        return nodes[0]
+    return (kind, nodes)
+
+
+def get_edge_word(node: Tuple | None, last: bool) -> str | None:
+    """returns the last or first word of a word, phrase or NEAR node"""
+
+    if node is None:
+        return None
+    if node[0] == 'word':
+        return node[1]
+    if node[0] == 'phrase':
+        return node[1][-1 if last else 0]
+    if node[0] == 'and' and node[1][-1][0] == 'near':
+        # made by make_near from its left and right operands
+        return get_edge_word(node[1][1 if last else 0], last)
+    return None
+
+
+def make_near(left: Tuple | None, right: Tuple | None, distance: int) -> Tuple | None:
+    """joins the last word of left and the first word of right with NEAR, the
+    operands must match as well. Operands which are not words, phrases or NEAR
+    pairs are just required together.
+    """
+
+    left_word = get_edge_word(left, True)
+    right_word = get_edge_word(right, False)
+    if left_word is None or right_word is None:
+        return make_node('and', [left, right])
+    return ('and', [left, right, ('near', left_word, right_word, distance)])
+
+
+def is_constraint(node: Tuple) -> bool:
+    """returns True for phrases, NEAR pairs and conjunctions containing them,
+    which are required when they are written next to other items
+    """
+
+    if node[0] == 'and':
+        return any(is_constraint(child) for child in node[1])
+    return node[0] in CONSTRAINTS
+
+
+def get_words(node: Tuple | None, negated: bool = False) -> List[Tuple[str, bool]]:
+    """returns the words of the node in query order, with True for negated words"""
+
+    if node is None:
+        return []
+    kind = node[0]
+    if kind == 'word':
+        return [(node[1], negated)]
+    if kind == 'phrase':
+        return [(word, negated) for word in node[1]]
+    if kind == 'near':
+        # the words of a NEAR pair are already words of its operands
+        return []
+    if kind == 'not':
+        return get_words(node[1], not negated)
+    return [word for child in node[1] for word in get_words(child, negated)]
+
+
+class Query:
+    """Parsed search query. words are the words which rank the results in query
+    order, root is the tree of nodes deciding which documents match.
+    """
+
+    def __init__(self, root: Tuple | None) -> None:
+        self.root = root
+        words = get_words(root)
+        self.words = [word for word, negated in words if not negated]
+        self.all_words = list(dict.fromkeys(word for word, _ in words))
+
+    def is_plain(self) -> bool:
+        """returns True if the query is only words, so it is a plain ranked search"""
+
+        return self.root is None or self.root[0] == 'word' or (
+            self.root[0] == 'seq' and all(node[0] == 'word' for node in self.root[1]))
+
+    def get_matcher(self, get_cursor: Callable[[str], Any]) -> Any:
+        """returns the matcher of the documents matching the query, get_cursor gives
+        a new posting cursor of a word or None if the word has no postings. None is
+        returned if no document can match.
+        """
+
+        return build_matcher(self.root, get_cursor)
+
+
+def build_matcher(node: Tuple | None, get_cursor: Callable[[str], Any]) -> Any:
+    """returns the matcher of a query node or None if it cannot match any document"""
+
+    if node is None:
+        return None
+    kind = node[0]
+
+    if kind in ('word', 'phrase', 'near'):
+        words = [node[1]] if kind == 'word' else node[1] if kind == 'phrase' else node[1:3]
+        cursors = [get_cursor(word) for word in words]
+        if any(cursor is None for cursor in cursors):
+            return None
+        if kind == 'word' or len(cursors) == 1:
+            return TermMatcher(cursors[0])
+        if kind == 'phrase':
+            return get_phrase_matcher(cursors)
+        return get_near_matcher(cursors, node[3])
+
+    if kind == 'not':
+        # negations are only evaluated against the other items of their group
+        return None
+
+    children = [child for child in node[1] if child[0] != 'not']
+    excluded = [build_matcher(child[1], get_cursor)
+                for child in node[1] if child[0] == 'not']
+
+    if kind == 'and':
+        required = children
+        optional = []
+    elif kind == 'or':
+        required = []
+        optional = children
+    else:
+        # in a sequence phrases and NEAR pairs are required and the other items alternatives
+        required = [child for child in children if is_constraint(child)]
+        optional = [] if required else children
+
+    if required:
+        matchers = [build_matcher(child, get_cursor) for child in required]
+        if any(matcher is None for matcher in matchers):
+            return None
+        matcher = combine(matchers, ConjunctionMatcher)
+    else:
+        matchers = [build_matcher(child, get_cursor) for child in optional]
+        matchers = [matcher for matcher in matchers if matcher is not None]
+        if not matchers:
+            return None
+        matcher = combine(matchers, DisjunctionMatcher)
+
+    excluded = [matcher for matcher in excluded if matcher is not None]
+    if excluded:
+        matcher = ExclusionMatcher(
+            matcher, combine(excluded, DisjunctionMatcher))
+    return matcher
+
+
+def parse_query(text: str) -> Query:
+    """parses the query text, words are stemmed like the documents"""
+
+    return Query(QueryParser(text).parse())
@@ -0,0 +1,91 @@
+import math
+from typing import List, Dict
+
+from collection_stats import CollectionStats
+
+# BM25F combines the title and content hits of a posting into one term frequency,
+# each field weighted and normalized by its length relative to the average length
+# of the field, and saturates it with k1:
+#
+#   tf    = sum over fields of weight * hits / (1 - b + b * length / average length)
+#   score = idf * tf * (k1 + 1) / (k1 + tf)
+#   idf   = log(1 + (N - df + 0.5) / (df + 0.5))
+#
+# A posting never scores more than idf * (k1 + 1), which bounds a word in MaxScore.
+
+K1 = 1.2
+TITLE_WEIGHT = 5.0
+CONTENT_WEIGHT = 1.0
+TITLE_B = 0.75
+CONTENT_B = 0.75
+
+
+class BM25FScorer:
+    """Ranks documents with BM25F over the title and content fields using the
+    document lengths and document frequencies precomputed by the indexer.
+    Scores of all postings are exact, so they are their own upper bounds.
+    """
+
+    def __init__(self, stats: CollectionStats) -> None:
+        self.stats = stats
+        self.doc_count = len(stats)
+        # empty fields would make every length infinitely longer than the average
+        self.avg_title_length = max(stats.avg_title_length, 1.0)
+        self.avg_content_length = max(stats.avg_content_length, 1.0)
+        self._idf = {}
+
+    def get_idf(self, word_id: int) -> float:
+        """returns inverse document frequency of the word"""
+
+        idf = self._idf.get(word_id)
+        if idf is None:
+            # the postings may hold documents indexed after the statistics were loaded
+            document_frequency = min(self.stats.get_document_frequency(word_id), self.doc_count)
+            idf = self._idf[word_id] = math.log(
+                1 + (self.doc_count - document_frequency + 0.5) / (document_frequency + 0.5))
+        return idf
+
+    def score_posting(self, line: List) -> float:
+        """returns the BM25F score of a single posting"""
+
+        doc_id, word_id = line[0]
+        lengths = self.stats.get_lengths(doc_id)
+        if lengths is None:
+            title_norm = content_norm = 1.0
+        else:
+            title_norm = 1 - TITLE_B + TITLE_B * \
+                lengths[0] / self.avg_title_length
+            content_norm = 1 - CONTENT_B + CONTENT_B * \
+                lengths[1] / self.avg_content_length
+
+        tf = TITLE_WEIGHT * line[1][0][1] / title_norm + \
+            CONTENT_WEIGHT * line[1][1][1] / content_norm
+        return self.get_idf(word_id) * tf * (K1 + 1) / (K1 + tf)
+
+    def get_upper_bounds(self, postings_lists: List[List]) -> List[float]:
+        """returns the most a posting of every word can score"""
+
+        return [self.get_idf(postings[0][0][1]) * (K1 + 1) if postings else 0.0
+                for postings in postings_lists]
+
+    def posting_upper_bound(self, word: int, line: List) -> float:
+        return self.score_posting(line)
+
+    def document_upper_bound(self, lines: List[List]) -> float:
+        return sum(self.score_posting(line) for line in lines)
+
+    def score_document(self, doc_id: int, lines: List[List]) -> List:
+        """scores a document from the postings of the query words it contains, in query order"""
+
+        return [sum(self.score_posting(line) for line in lines)]
+
+    def add_postings(self, postings: List, documents: Dict) -> None:
+        """adds the scores of the postings of a word to the scores of their documents"""
+
+        for line in postings:
+            doc_id = str(line[0][0])
+            score = self.score_posting(line)
+            if doc_id in documents:
+                documents[doc_id][0] += score
+            else:
+                documents[doc_id] = [score]
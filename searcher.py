@@ -1,28 +1,698 @@
+import os
+import re
 import json
-from typing import List, Tuple, Dict, Any
-
-
-def search_lexicon(word: str) -> str | None:
-    """searches the word in the lexicon and returns its offset"""
-
-    with open('lexicon.txt', "r") as f:
-        lexicon = json.load(f)
-        if word not in lexicon:
-            print("Word not found in lexicon!\n")
-            return None
+import heapq
+import threading
+from functools import partial
+from itertools import accumulate
+from typing import List, Tuple, Dict, Any, Callable
+
+from cache import LRUCache, RESULT_CACHE_SIZE, RESULT_CACHE_BYTES, POSTINGS_CACHE_SIZE, POSTINGS_CACHE_BYTES
+from collection_stats import STATS_FILE, CollectionStats
+from postings import END_OF_POSTINGS, PostingCursor, UnionCursor
+from proximity import pair_proximity, proximity_score
+from query import OPERATORS, Query, parse_query
+from ranking import BM25FScorer
+import tracing
+from docstore import DocumentIndex, DocumentStore, make_snippet
+from near_duplicates import DuplicateClusters
+from segments import (DENSE_DOC_IDS_KEY, DOCUMENT_INDEX_KEY, DOCUMENT_KEYS_KEY, SEGMENTS_PATH, STATS_KEY,
+                      SURFACE_FORMS_KEY, Segment, get_index_file, get_manifest_path)
+from suggest import SUGGESTION_COUNT, TermIndex, complete_term, correct_term, get_last_word
+from tokenizer import SurfaceForms, tokenizer
+
+# number of results returned by a search unless asked otherwise
+DEFAULT_RESULT_COUNT = 30
+
+# 'bm25' ranks with BM25F over title and content, 'hits' with weighted hit counts and proximity
+RANKINGS = ('bm25', 'hits')
+DEFAULT_RANKING = 'bm25'
+
+# words of a query text which are looked up in the lexicon, like the tokenizer splits documents
+QUERY_WORD = re.compile('[a-zA-Z]+')
+
+
+def get_file_signature(path: str) -> Tuple[int, int, int] | None:
+    """returns (inode, mtime, size) of the file or None if it does not exist"""
+
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def load_json(path: str) -> Any:
+    """parses the json file at given path"""
+
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def load_document_index(path: str) -> DocumentIndex:
+    """loads the urls of an index built before the document store"""
+
+    return DocumentIndex(load_json(path))
+
+
+class Searcher:
+    """Long lived searcher which loads the segments manifest and opens the document
+    store once and shares them across queries. The files are reloaded only when their
+    inode, mtime or size changes on disk. Every committed segment is opened once,
+    its binary lexicon is memory mapped and its barrel files are kept open.
+
+    Results of recent queries and decoded postings of recently searched words are
+    cached. Every reload of changed files starts a new index generation, which
+    empties both caches, so results are never older than the committed index.
+    Near duplicates clustered by the indexer are collapsed to their best ranked
+    document unless collapse_duplicates is False. The term indexes used for
+    autocomplete and spelling correction are made by load_term_indexes, once they
+    exist the indexes of new segments are made in a background thread on refresh.
+    Suggested terms are shown by their most frequent spelling in the documents.
+    """
+
+    def __init__(self, segments_path: str = SEGMENTS_PATH, document_index_path: str = 'document_index.txt',
+                 stats_path: str = STATS_FILE, ranking: str = DEFAULT_RANKING,
+                 result_cache_size: int = RESULT_CACHE_SIZE, postings_cache_size: int = POSTINGS_CACHE_SIZE,
+                 collapse_duplicates: bool = True) -> None:
+        if ranking not in RANKINGS:
+            raise ValueError("unknown ranking {}".format(ranking))
+        self.segments_path = segments_path
+        self.document_index_path = document_index_path
+        self.stats_path = stats_path
+        self.ranking = ranking
+        self.collapse_duplicates = collapse_duplicates
+        self.generation = 0
+        self.result_cache = LRUCache(
+            result_cache_size, RESULT_CACHE_BYTES, name='result_cache')
+        self.postings_cache = LRUCache(
+            postings_cache_size, POSTINGS_CACHE_BYTES, name='postings_cache')
+        self._manifest = {}
+        self._segments = []
+        self._documents = DocumentIndex({})
+        self._clusters = None
+        self._stats = CollectionStats()
+        self._surface_forms = SurfaceForms()
+        self._signatures = {}
+        self._term_indexes = {}
+        self._term_thread = None
+        self._lock = threading.Lock()
+        self._term_lock = threading.Lock()
+
+    def _load_if_changed(self, path: str, current: Any, loader: Callable[[str], Any] = None) -> Any:
+        """returns the freshly loaded file if it changed on disk, otherwise current content"""
+
+        signature = get_file_signature(path)
+        if signature == self._signatures.get(path):
+            return current
+
+        if signature is None:
+            content = {}
         else:
-            return lexicon[word]
-
-
-def get_word_ids(words_list: List[str]) -> List[Tuple[int, int]]:
-    """receives list of words and returns their ids using lexicon"""
-
-    word_ids = []
-    for word in words_list:
-        word_id = search_lexicon(word)
-        if word_id is not None:
-            word_ids.append(word_id)
-    return word_ids
+            try:
+                with tracing.stage('index_load'):
+                    content = loader(path) if loader else load_json(path)
+            except ValueError:
+                # the file is being rewritten by the indexer, keep the old copy and retry later
+                return current
+
+        self._signatures[path] = signature
+        return content
+
+    def _open_segments(self, manifest: Dict[str, Any]) -> List[Segment]:
+        """opens the segments listed in the manifest, reusing those already open"""
+
+        opened = {segment.name: segment for segment in self._segments}
+        return [opened.get(info["name"]) or Segment(info, self.segments_path)
+                for info in manifest["segments"]]
+
+    def _open_document_store(self, keys_path: str, dense_ids: bool) -> DocumentStore:
+        return DocumentStore(self.segments_path, keys_path, dense_ids)
+
+    def refresh(self) -> None:
+        """reloads the segments, documents and collection statistics if the
+        manifest or the files it names changed on disk. All three are swapped
+        together, so a query never sees segments of one commit with the documents
+        of another.
+        """
+
+        with self._lock:
+            signatures = dict(self._signatures)
+            manifest_path = get_manifest_path(self.segments_path)
+            manifest = self._load_if_changed(manifest_path, self._manifest)
+            # the manifest names the document store keys and statistics of its generation,
+            # indexes committed before it did keep them at the paths of the searcher and
+            # indexes built before the document store only have the urls in the document index.
+            # Postings of indexes which were not renumbered yet use the keys of the store as doc ids
+            documents_path = get_index_file(
+                DOCUMENT_KEYS_KEY, None, self.segments_path, manifest)
+            open_documents = partial(self._open_document_store,
+                                     dense_ids=bool(manifest.get(DENSE_DOC_IDS_KEY)))
+            if documents_path is None:
+                documents_path = get_index_file(
+                    DOCUMENT_INDEX_KEY, self.document_index_path, self.segments_path, manifest)
+                open_documents = load_document_index
+            stats_path = get_index_file(
+                STATS_KEY, self.stats_path, self.segments_path, manifest)
+            surface_forms_path = get_index_file(
+                SURFACE_FORMS_KEY, None, self.segments_path, manifest)
+            segments = self._segments
+            if manifest is not self._manifest:
+                try:
+                    segments = self._open_segments(
+                        manifest) if manifest else []
+                except FileNotFoundError:
+                    # the segments were retired before they could be opened, keep the
+                    # current version and read the newer manifest on the next refresh
+                    self._signatures = signatures
+                    return
+            documents = self._load_if_changed(
+                documents_path, self._documents, open_documents)
+            if not isinstance(documents, (DocumentStore, DocumentIndex)):
+                # the document index file was removed
+                documents = DocumentIndex({})
+            clusters = self._clusters
+            if documents is not self._documents:
+                # clusters are kept for the documents of the store, postings must use their record numbers
+                clusters = None
+                if isinstance(documents, DocumentStore) and documents.dense_ids:
+                    clusters = DuplicateClusters(
+                        self.segments_path, len(documents))
+            stats = self._load_if_changed(
+                stats_path, self._stats, CollectionStats.load)
+            if not isinstance(stats, CollectionStats):
+                # the statistics file was removed
+                stats = CollectionStats()
+            # indexes committed before surface forms were kept suggest stems
+            surface_forms = SurfaceForms()
+            if surface_forms_path is not None:
+                surface_forms = self._load_if_changed(
+                    surface_forms_path, self._surface_forms, SurfaceForms.load)
+                if not isinstance(surface_forms, SurfaceForms):
+                    surface_forms = SurfaceForms()
+
+            # suggestions are in use, the term indexes of new segments are made before they are needed
+            if segments is not self._segments and self._term_indexes:
+                self.start_term_thread()
+
+            self._manifest = manifest
+            self._segments = segments
+            self._documents = documents
+            self._clusters = clusters
+            self._stats = stats
+            self._surface_forms = surface_forms
+            self._signatures = {path: self._signatures.get(path) for path in
+                                (manifest_path, documents_path, stats_path, surface_forms_path)
+                                if path is not None}
+
+            # the indexer committed new documents, segments or statistics
+            if signatures != self._signatures:
+                self.generation += 1
+
+    def snapshot(self) -> Tuple[List[Segment], int, DocumentStore | DocumentIndex]:
+        """returns the current segments, the index generation they belong to and the
+        documents of the same commit, a query uses the same segments for every word
+        and its results are looked up in the documents of its snapshot
+        """
+
+        self.refresh()
+        with self._lock:
+            return self._segments, self.generation, self._documents
+
+    @property
+    def segments(self) -> List[Segment]:
+        self.refresh()
+        return self._segments
+
+    @property
+    def documents(self) -> DocumentStore | DocumentIndex:
+        self.refresh()
+        return self._documents
+
+    @property
+    def stats(self) -> CollectionStats:
+        self.refresh()
+        return self._stats
+
+    def get_scorer(self, ranking: str | None = None) -> Any:
+        """returns a new scorer for one query, indexes built without collection
+        statistics are ranked by hits since BM25 needs the document lengths
+        """
+
+        ranking = ranking or self.ranking
+        if ranking not in RANKINGS:
+            raise ValueError("unknown ranking {}".format(ranking))
+
+        stats = self.stats
+        if ranking == 'bm25' and len(stats) > 0:
+            return BM25FScorer(stats)
+        return HitCountScorer()
+
+    def search_lexicon(self, word: str, segments: List[Segment] | None = None) -> List[Tuple[Segment, List[int]]]:
+        """searches the word in the lexicon of every segment and returns the
+        segments containing it with the word's id and offset
+        """
+
+        if segments is None:
+            segments = self.segments
+
+        entries = []
+        with tracing.stage('lexicon'):
+            for segment in segments:
+                entry = segment.search_lexicon(word)
+                if entry is not None:
+                    entries.append((segment, entry))
+
+        if not entries:
+            tracing.count('lexicon_misses')
+        return entries
+
+    def read_word_postings(self, word: str, segments: List[Segment] | None = None,
+                           generation: int | None = None) -> List | None:
+        """reads the postings of the word from all segments merged in doc id order,
+        returns None if no segment contains the word. The postings are cached for
+        the index generation of the segments if it is given.
+        """
+
+        if generation is not None:
+            postings = self.postings_cache.get(word, generation)
+            if postings is not None:
+                return postings
+
+        entries = self.search_lexicon(word, segments)
+        with tracing.stage('postings_read'):
+            segment_postings = [segment.read_postings(entry)
+                                for segment, entry in entries]
+            segment_postings = [
+                postings for postings in segment_postings if postings]
+            if not segment_postings:
+                return None
+            if len(segment_postings) == 1:
+                postings = segment_postings[0]
+            else:
+                # a document is indexed in exactly one segment so this is a plain union
+                postings = list(heapq.merge(
+                    *segment_postings, key=lambda posting: posting[0][0]))
+
+        if generation is not None:
+            self.postings_cache.put(word, postings, generation)
+        return postings
+
+    def read_batch_postings(self, words: List[str], segments: List[Segment], generation: int) -> Dict[str, List | None]:
+        """reads the postings of all words of a batch of queries, grouped by the barrels
+        storing them so every barrel is read once from front to back and the postings of
+        every word are decoded once. Returns None for words which no segment contains.
+        """
+
+        postings = {}
+        barrel_terms = {}
+        with tracing.stage('lexicon'):
+            for word in words:
+                cached = self.postings_cache.get(word, generation)
+                if cached is not None:
+                    postings[word] = cached
+                    continue
+                for segment_num, segment in enumerate(segments):
+                    entry = segment.search_lexicon(word)
+                    if entry is not None:
+                        barrel_terms.setdefault((segment_num, segment.get_barrel_num(entry[0])), []).append(
+                            (entry[1], word, entry))
+
+        # segments are visited in order, so the postings of a word are collected in segment order
+        segment_postings = {}
+        with tracing.stage('postings_read'):
+            for (segment_num, _), terms in sorted(barrel_terms.items()):
+                tracing.count('barrels_read')
+                for _, word, entry in sorted(terms):
+                    decoded = segments[segment_num].read_postings(entry)
+                    if decoded:
+                        segment_postings.setdefault(word, []).append(decoded)
+
+        for word in words:
+            if word in postings:
+                continue
+            word_postings = segment_postings.get(word)
+            if not word_postings:
+                postings[word] = None
+                continue
+            if len(word_postings) == 1:
+                postings[word] = word_postings[0]
+            else:
+                postings[word] = list(heapq.merge(
+                    *word_postings, key=lambda posting: posting[0][0]))
+            self.postings_cache.put(word, postings[word], generation)
+        return postings
+
+    @tracing.traced('search')
+    def search_words(self, words_list: List[str], k: int | None = DEFAULT_RESULT_COUNT,
+                     ranking: str | None = None) -> List[Tuple]:
+        """receives a list of words to search and returns the k best ranked documents,
+        all matching documents are returned if k is None
+        """
+
+        # refresh once per query and use the same segments for every word
+        segments, generation, _ = self.snapshot()
+        return self.collapse(lambda count: self.rank_words(words_list, count, ranking, segments, generation), k)
+
+    def collapse(self, rank: Callable[[int | None], List[Tuple]], k: int | None) -> List[Tuple]:
+        """returns the k best documents ranked by rank(count) with only the best ranked
+        document of every near duplicate cluster. If copies leave fewer than k documents
+        the ranking is repeated for twice as many until k are left or none is missing.
+        """
+
+        clusters = self._clusters
+        if not self.collapse_duplicates or clusters is None or not clusters.count:
+            return rank(k)
+
+        count = k
+        while True:
+            ranked_documents = rank(count)
+            with tracing.stage('collapse'):
+                collapsed = clusters.collapse(ranked_documents)
+            if k is None or len(collapsed) >= k or len(ranked_documents) < count:
+                tracing.count('duplicates_collapsed',
+                              len(ranked_documents) - len(collapsed))
+                return collapsed[:k]
+            count *= 2
+
+    def rank_words(self, words_list: List[str], k: int | None, ranking: str | None, segments: List[Segment],
+                   generation: int, postings: Dict[str, List | None] | None = None) -> List[Tuple]:
+        """ranks the documents containing any of the words in the segments of the
+        generation, postings already read for a batch of queries are used if given
+        """
+
+        ranking = ranking or self.ranking
+        key = ('words', tuple(words_list), k, ranking)
+        ranked_documents = self.result_cache.get(key, generation)
+        if ranked_documents is not None:
+            return list(ranked_documents)
+
+        scorer = self.get_scorer(ranking)
+        postings_lists = []
+        for word in words_list:
+            if postings is not None and word in postings:
+                word_postings = postings[word]
+            else:
+                word_postings = self.read_word_postings(
+                    word, segments, generation)
+            if word_postings is not None:
+                postings_lists.append(word_postings)
+
+        if k is not None:
+            with tracing.stage('scoring'):
+                ranked_documents = top_k_documents(postings_lists, k, scorer)
+            self.result_cache.put(key, ranked_documents, generation)
+            return list(ranked_documents)
+
+        # a dictionary containing information about the documents, is used in rank calculation of the documents
+        documents = {}
+
+        with tracing.stage('scoring'):
+            for word_postings in postings_lists:
+                scorer.add_postings(word_postings, documents)
+
+        # convert the documents dictionary into a list and sort in descending order based on
+        # the score | higher the score the higher the rank of the document
+        with tracing.stage('sort'):
+            ranked_documents = sorted(list(documents.items()),
+                                      key=lambda x: x[1][0], reverse=True)
+
+        self.result_cache.put(key, ranked_documents, generation)
+        return list(ranked_documents)
+
+    def read_word_cursor(self, word: str, entries: List[Tuple[Segment, List[int]]], generation: int) -> Any:
+        """returns a posting cursor over the postings of a word in all segments given
+        its lexicon entries, or None if no segment has postings of the word. Cached
+        postings are read from memory, otherwise blocks are decoded as they are reached.
+        """
+
+        postings = self.postings_cache.get(word, generation)
+        if postings is not None:
+            return PostingCursor(postings)
+
+        with tracing.stage('postings_read'):
+            cursors = [segment.read_cursor(entry)
+                       for segment, entry in entries]
+        cursors = [cursor for cursor in cursors if cursor is not None]
+        if not cursors:
+            return None
+        if len(cursors) == 1:
+            return cursors[0]
+        return UnionCursor(cursors)
+
+    @tracing.traced('search')
+    def search_query(self, text: str, k: int | None = DEFAULT_RESULT_COUNT,
+                     ranking: str | None = None, snapshot: Tuple | None = None) -> List[Tuple]:
+        """parses the query text and returns the k best ranked documents, all matching
+        documents if k is None. Queries with phrases, NEAR or boolean operators only
+        score the documents they match, other queries are plain word searches. The
+        segments of snapshot are searched if it is given, so callers can look up the
+        results in its documents.
+        """
+
+        segments, generation, _ = snapshot or self.snapshot()
+        with tracing.stage('parse'):
+            query = parse_query(text)
+        return self.search_parsed(query, k, ranking, segments, generation)
+
+    def search_parsed(self, query: Query, k: int | None, ranking: str | None, segments: List[Segment],
+                      generation: int, postings: Dict[str, List | None] | None = None) -> List[Tuple]:
+        """returns the k best documents matching the parsed query in the segments of
+        the generation with near duplicates collapsed, postings already read for a
+        batch of queries are used if given
+        """
+
+        return self.collapse(lambda count: self.rank_parsed(query, count, ranking, segments, generation, postings), k)
+
+    def rank_parsed(self, query: Query, k: int | None, ranking: str | None, segments: List[Segment],
+                    generation: int, postings: Dict[str, List | None] | None = None) -> List[Tuple]:
+        """ranks the documents matching the parsed query in the segments of the
+        generation, postings already read for a batch of queries are used if given
+        """
+
+        if query.is_plain():
+            return self.rank_words(query.words, k, ranking, segments, generation, postings)
+        if k is not None and k <= 0:
+            return []
+
+        # the parsed tree is the normalized query, it holds the stemmed words
+        ranking = ranking or self.ranking
+        key = ('query', repr(query.root), k, ranking)
+        ranked_documents = self.result_cache.get(key, generation)
+        if ranked_documents is not None:
+            return list(ranked_documents)
+
+        # the lexicon is searched once per word, every matcher gets its own cursor
+        if postings is None:
+            postings = {}
+        entries = {word: self.search_lexicon(word, segments)
+                   for word in query.all_words if word not in postings}
+
+        def get_cursor(word: str) -> Any:
+            if word in postings:
+                return PostingCursor(postings[word]) if postings[word] else None
+            return self.read_word_cursor(word, entries[word], generation)
+
+        matcher = query.get_matcher(get_cursor)
+        if matcher is None:
+            return []
+
+        # every word of the query which is not negated ranks the matched documents
+        cursors = [get_cursor(word) for word in query.words]
+        cursors = [cursor for cursor in cursors if cursor is not None]
+        scorer = self.get_scorer(ranking)
+
+        # blocks of the cursors are decoded while matching, so reading is part of scoring here
+        heap = []
+        scored = 0
+        with tracing.stage('scoring'):
+            doc_id = matcher.next_geq(0)
+            while doc_id != END_OF_POSTINGS:
+                scored += 1
+                lines = [cursor.posting for cursor in cursors
+                         if cursor.next_geq(doc_id) == doc_id]
+                entry = scorer.score_document(doc_id, lines)
+                if k is None or len(heap) < k:
+                    heapq.heappush(heap, (entry[0], doc_id, entry))
+                elif entry[0] > heap[0][0]:
+                    heapq.heapreplace(heap, (entry[0], doc_id, entry))
+                doc_id = matcher.next_geq(doc_id + 1)
+        tracing.count('documents_scored', scored)
+
+        with tracing.stage('sort'):
+            ranked_documents = sorted(((str(doc_id), entry) for _, doc_id, entry in heap),
+                                      key=lambda x: x[1][0], reverse=True)
+        self.result_cache.put(key, ranked_documents, generation)
+        return list(ranked_documents)
+
+    @tracing.traced('batch_search')
+    def search_batch(self, texts: List[str], k: int | None = DEFAULT_RESULT_COUNT,
+                     ranking: str | None = None, snapshot: Tuple | None = None) -> List[List[Tuple]]:
+        """searches a batch of queries against the same segments and returns the ranked
+        documents of every query. The postings of all words of the batch are read
+        barrel by barrel first, so a word shared by many queries is decoded once.
+        The segments of snapshot are searched if it is given, like in search_query.
+        """
+
+        segments, generation, _ = snapshot or self.snapshot()
+        with tracing.stage('parse'):
+            queries = [parse_query(text) for text in texts]
+        words = list(dict.fromkeys(
+            word for query in queries for word in query.all_words))
+        postings = self.read_batch_postings(words, segments, generation)
+        tracing.count('queries', len(queries))
+        return [self.search_parsed(query, k, ranking, segments, generation, postings)
+                for query in queries]
+
+    def start_term_thread(self) -> None:
+        """makes the missing term indexes in a background thread unless one is running"""
+
+        with self._term_lock:
+            if self._term_thread is None or not self._term_thread.is_alive():
+                self._term_thread = threading.Thread(
+                    target=self.load_term_indexes, name='term_indexes', daemon=True)
+                self._term_thread.start()
+
+    def load_term_indexes(self) -> None:
+        """makes the term index of every live segment which has none, until the live
+        segments stop changing. Making them takes a moment for large lexicons, so the
+        search service calls it on startup and refresh runs it in a background thread.
+        """
+
+        while True:
+            segments, _, _ = self.snapshot()
+            with self._term_lock:
+                term_indexes = dict(self._term_indexes)
+            with tracing.stage('suggest_load'):
+                for segment in segments:
+                    if segment.name not in term_indexes:
+                        term_indexes[segment.name] = TermIndex(segment.lexicon)
+            with self._term_lock:
+                # the indexes of segments retired by merges are dropped
+                self._term_indexes = {segment.name: term_indexes[segment.name]
+                                      for segment in segments}
+            if segments is self.segments:
+                return
+
+    def get_term_indexes(self, segments: List[Segment]) -> List[TermIndex]:
+        """returns the term index of every segment. While the background thread makes
+        the indexes of new segments the current ones are used, the segments retired
+        by a merge hold the terms of the merged segment until its index is ready.
+        Without a background thread missing indexes are made right away.
+        """
+
+        with self._term_lock:
+            term_indexes = self._term_indexes
+            loading = self._term_thread is not None and self._term_thread.is_alive()
+        if all(segment.name in term_indexes for segment in segments):
+            return [term_indexes[segment.name] for segment in segments]
+        if loading:
+            return list(term_indexes.values())
+        self.load_term_indexes()
+        with self._term_lock:
+            term_indexes = self._term_indexes
+        return [term_indexes[segment.name] for segment in segments if segment.name in term_indexes]
+
+    @tracing.traced('complete')
+    def complete(self, text: str, k: int = SUGGESTION_COUNT) -> List[Tuple[str, int]]:
+        """returns the k most frequent terms completing the last word of the text with
+        their document frequencies. The stem of the word is completed as well, a whole
+        word is usually longer than its stem. Terms are given by their surface forms.
+        """
+
+        prefix = get_last_word(text)
+        if not prefix:
+            return []
+        segments, _, _ = self.snapshot()
+        prefixes = list(dict.fromkeys([prefix, tokenizer.stem_cache.stem(prefix)]))
+        surface_forms = self._surface_forms
+        return [(surface_forms.get(term), count) for term, count in
+                complete_term(self.get_term_indexes(segments), prefixes, self.stats, k)]
+
+    def correct(self, word: str, k: int = SUGGESTION_COUNT, segments: List[Segment] | None = None) -> List[Tuple[str, int, int]]:
+        """returns up to k terms of the index close to the stem of a word which no
+        segment contains, with their edit distance and document frequency, the
+        closest and then most frequent first. Known words have no corrections.
+        Terms are given by their surface forms.
+        """
+
+        if segments is None:
+            segments = self.segments
+        stem = tokenizer.stem_cache.stem(word.lower())
+        if any(segment.search_lexicon(stem) is not None for segment in segments):
+            return []
+        surface_forms = self._surface_forms
+        return [(surface_forms.get(term), distance, count) for term, distance, count in
+                correct_term(self.get_term_indexes(segments), stem, self.stats, k)]
+
+    @tracing.traced('suggest')
+    def suggest_query(self, text: str, partial: bool = False) -> str | None:
+        """returns the query text with every word missing from the index replaced by
+        its best correction, or None if no word was replaced. If partial is True the
+        last word is still being typed and kept as long as some term starts with it.
+        """
+
+        segments, _, _ = self.snapshot()
+        replaced = []
+
+        def replace(match: re.Match) -> str:
+            word = match.group(0)
+            # operators and stop words are never searched
+            if word in OPERATORS or word == 'NEAR' or word.lower() in tokenizer.stop_words:
+                return word
+            if partial and match.end() == len(text) and self.complete(word, 1):
+                return word
+            corrections = self.correct(word, 1, segments)
+            if not corrections:
+                return word
+            replaced.append(word)
+            return corrections[0][0]
+
+        suggestion = QUERY_WORD.sub(replace, text)
+        tracing.count('words_corrected', len(replaced))
+        return suggestion if replaced else None
+
+    def cache_stats(self) -> Dict[str, Dict[str, Any]]:
+        """returns hit rates and sizes of the result and postings caches"""
+
+        return {"results": self.result_cache.stats(), "postings": self.postings_cache.stats()}
+
+
+_searcher = None
+_searcher_lock = threading.Lock()
+
+
+def get_searcher() -> Searcher:
+    """returns the searcher shared by the whole process"""
+
+    global _searcher
+    with _searcher_lock:
+        if _searcher is None:
+            _searcher = Searcher()
+    return _searcher
+
+
+def format_results(ranked_documents: List[Tuple], documents: DocumentStore | DocumentIndex,
+                   words: List[str] | None = None) -> List[Dict[str, Any]]:
+    """returns the ranked documents as json objects with their urls, titles and scores,
+    and html snippets highlighting the stemmed query words if words are given
+    """
+
+    results = []
+    for doc_id, entry in ranked_documents:
+        document = documents.get(doc_id) or {}
+        result = {"doc_id": doc_id, "url": document.get("url"), "title": document.get("title"),
+                  "score": entry[0]}
+        if words is not None:
+            result["snippet"] = make_snippet(document.get("text"), words)
+        results.append(result)
+    return results
+
+
+def search_lexicon(word: str) -> List[Tuple[Segment, List[int]]]:
+    """searches the word in the lexicon of every segment and returns its offsets"""
+
+    return get_searcher().search_lexicon(word)
 
 
 def add_new_document_to_results(doc_id: str, documents: Dict, content_hits: Any, content_hit_list: List, title_hits: Any) -> None:
@@ -38,97 +708,221 @@ def add_new_document_to_results(doc_id: str, documents: Dict, content_hits: Any,
 
 
 def calculate_proximity(doc_id: str, documents: Dict, content_hits: Any, content_hit_list: Any) -> None:
-    """calculates proximity of each word with other words in query and computes weight"""
+    """calculates proximity of the word with every previous word of the query in the
+    document from the distances to their nearest occurrences and adds the weight
+    """
 
-    # calculate proximity and add weight
     if content_hits > 0:
-        if documents[doc_id][1] is not None:
-
-            # calculate proximity of each occurance
-            for doc_idx in range(1, len(documents[doc_id])):
-
-                prev_word_hit_list = documents[doc_id][doc_idx]
-                idx_range = min(len(prev_word_hit_list),
-                                len(content_hit_list))
-
-                for location_idx in range(2, idx_range):
-                    proximity = abs(
-                        prev_word_hit_list[location_idx] - content_hit_list[location_idx])
-                    if proximity <= 1:
-                        documents[doc_id][0] += 10
-                    elif proximity <= 10:
-                        documents[doc_id][0] += 8
-                    elif proximity <= 100:
-                        documents[doc_id][0] += 4
-                    else:
-                        documents[doc_id][0] += 2
+
+        # the entry holds the score followed by the content hit lists of the previous words
+        for prev_word_hit_list in documents[doc_id][1:]:
+            if prev_word_hit_list is not None:
+                documents[doc_id][0] += pair_proximity(
+                    prev_word_hit_list, content_hit_list)
 
         # add the hitlist of the current word for next word's proximity calculation
         documents[doc_id].append(content_hit_list)
 
 
-def search_single_word_results(word_id: Tuple[int, int], documents: Dict) -> None:
-    """computes results for a single word in search query"""
+def add_posting_to_results(line: List, documents: Dict) -> None:
+    """adds the hits of a single posting to the score of its document"""
 
-    barrel_num = int(word_id[0] / 533) + 1
+    # destructuring the data
+    doc_id = str(line[0][0])
 
-    inverted_index_file_path = "./InvertedBarrels/inverted_barrel_"
-    with open(inverted_index_file_path + str(barrel_num) + ".txt", 'r') as inverted_index:
+    title_hit_list = line[1][0]
+    # title hits are scaled by 5 to increase relevance
+    title_hits = title_hit_list[1] * 5
 
-        result_count = 1
+    content_hit_list = line[1][1]
+    content_hits = content_hit_list[1]
 
-        # jump to the location of the corresponding word
-        inverted_index.seek(word_id[1])
+    # if the document has already been added before then calculate the proximity
+    # between the words
+    if doc_id in documents:
 
-        line = json.loads(inverted_index.readline())
+        # add the new hits to the score
+        documents[doc_id][0] += title_hits + content_hits
 
-        # load the results of the corresponding word and result_count < 31
-        while line[0][1] == word_id[0] and result_count < 31:
+        calculate_proximity(doc_id, documents,
+                            content_hits, content_hit_list)
 
-            # destructuring the data
-            doc_id = str(line[0][0])
+    # if it hasnt been added then add the data
+    else:
+        add_new_document_to_results(
+            doc_id, documents, content_hits, content_hit_list, title_hits)
 
-            title_hit_list = line[1][0]
-            # title hits are scaled by 5 to increase relevance
-            title_hits = title_hit_list[1] * 5
 
-            content_hit_list = line[1][1]
-            content_hits = content_hit_list[1]
+def search_single_word_results(postings: List, documents: Dict) -> None:
+    """computes results for a single word in search query"""
 
-            # if the document has already been added before then calculate the proximity
-            # between the words
-            if doc_id in documents:
+    for line in postings:
+        add_posting_to_results(line, documents)
 
-                # add the new hits to the score
-                documents[doc_id][0] += title_hits + content_hits
 
-                calculate_proximity(doc_id, documents,
-                                    content_hits, content_hit_list)
+def posting_upper_bound(line: List, other_content_hits: List[int]) -> int:
+    """returns the most a posting can add to the score of its document. Every pair of
+    words gets at most 10 for each of min(content hits) proximity comparisons, half of
+    it is charged to each word using the most content hits the other word has anywhere.
+    """
 
-            # if it hasnt been added then add the data
-            else:
-                add_new_document_to_results(
-                    doc_id, documents, content_hits, content_hit_list, title_hits)
+    content_hits = line[1][1][1]
+    proximity = sum(min(content_hits, other) for other in other_content_hits)
+    return line[1][0][1] * 5 + content_hits + 5 * proximity
 
-            line = json.loads(inverted_index.readline())
-            result_count += 1
 
+def document_upper_bound(lines: List[List]) -> int:
+    """returns the most a document can score given the postings of the words it contains"""
 
-def search_words(words_list: List[str]) -> List[Tuple]:
-    """receives a list of words to search and returns ranked documents"""
+    content_hits = [line[1][1][1] for line in lines]
+    bound = sum(line[1][0][1] * 5 for line in lines) + sum(content_hits)
+    for i in range(len(content_hits)):
+        for j in range(i + 1, len(content_hits)):
+            bound += 10 * min(content_hits[i], content_hits[j])
+    return bound
 
-    # get the wordIDs
-    word_ids = get_word_ids(words_list)
 
-    # a dictionary containing information about the documents, is used in rank calculation of the documents
-    documents = {}
+def score_document(doc_id: int, lines: List[List]) -> List:
+    """scores a document from the postings of the query words it contains, in query
+    order, giving the same entry as adding the postings one by one to the results
+    """
+
+    score = sum(line[1][0][1] * 5 + line[1][1][1] for line in lines)
+    hit_lists = [line[1][1] for line in lines if line[1][1][1] > 0]
+    score += proximity_score(hit_lists)
+
+    # the first word keeps its place in the entry even if it only occurs in the title
+    if lines[0][1][1][1] > 0:
+        return [score] + hit_lists
+    return [score, None] + hit_lists
+
+
+class HitCountScorer:
+    """Ranks documents by their title hits scaled by 5, content hits and the proximity
+    of the query words. Upper bounds of a query's words depend on the most content
+    hits of the other words, so a scorer is made for every query.
+    """
+
+    def __init__(self) -> None:
+        self.other_content_hits = []
+
+    def get_upper_bounds(self, postings_lists: List[List]) -> List[int]:
+        """returns the most a posting of every word can score"""
+
+        query_length = len(postings_lists)
+        max_content_hits = [max((line[1][1][1] for line in postings), default=0)
+                            for postings in postings_lists]
+        self.other_content_hits = [max_content_hits[:i] + max_content_hits[i + 1:]
+                                   for i in range(query_length)]
+        max_title_hits = [max((line[1][0][1] for line in postings), default=0)
+                          for postings in postings_lists]
+
+        # the bound grows with title and content hits, so the largest counts bound every posting of the word
+        return [posting_upper_bound([None, [[1, max_title_hits[i]], [0, max_content_hits[i]]]],
+                                    self.other_content_hits[i]) for i in range(query_length)]
+
+    def posting_upper_bound(self, word: int, line: List) -> int:
+        return posting_upper_bound(line, self.other_content_hits[word])
+
+    def document_upper_bound(self, lines: List[List]) -> int:
+        return document_upper_bound(lines)
+
+    def score_document(self, doc_id: int, lines: List[List]) -> List:
+        return score_document(doc_id, lines)
+
+    def add_postings(self, postings: List, documents: Dict) -> None:
+        search_single_word_results(postings, documents)
+
+
+def top_k_documents(postings_lists: List[List], k: int, scorer: Any = None) -> List[Tuple]:
+    """returns the k highest scoring documents using MaxScore dynamic pruning.
+    Query words are ordered by the upper bound of their postings. Words whose
+    bounds together cannot beat the current k-th score are non essential, they
+    are only probed for documents found in the essential words' postings and
+    documents whose bound cannot enter the top k are never scored.
+    """
+
+    if k <= 0:
+        return []
+    if scorer is None:
+        scorer = HitCountScorer()
+
+    query_length = len(postings_lists)
+    cursors = [PostingCursor(postings) for postings in postings_lists]
+    max_bounds = scorer.get_upper_bounds(postings_lists)
+
+    # order words by increasing upper bound, prefix_bounds[i] is the bound of the first i + 1 words
+    order = sorted(range(query_length), key=lambda i: max_bounds[i])
+    prefix_bounds = list(accumulate(max_bounds[i] for i in order))
+
+    heap = []
+    threshold = 0
+    first_essential = 0
+    essential = [cursors[i] for i in order]
+
+    while first_essential < query_length:
+
+        # the next candidate is the smallest doc id in the essential postings
+        candidate = min(cursor.doc_id for cursor in essential)
+        if candidate == END_OF_POSTINGS:
+            break
+
+        lines = [None] * query_length
+        bound = 0
+        for i in range(first_essential, query_length):
+            cursor = cursors[order[i]]
+            if cursor.doc_id == candidate:
+                lines[order[i]] = cursor.posting
+                bound += scorer.posting_upper_bound(order[i], cursor.posting)
+                cursor.next()
+
+        # probe non essential words from the highest bound down while the document can still enter the top k
+        for i in range(first_essential - 1, -1, -1):
+            if len(heap) == k and bound + prefix_bounds[i] <= threshold:
+                break
+            cursor = cursors[order[i]]
+            if cursor.next_geq(candidate) == candidate:
+                lines[order[i]] = cursor.posting
+                bound += scorer.posting_upper_bound(order[i], cursor.posting)
+
+        lines = [line for line in lines if line is not None]
+        if len(heap) == k and (bound <= threshold or scorer.document_upper_bound(lines) <= threshold):
+            continue
+
+        # only now the exact score is computed, words are added in query order
+        entry = scorer.score_document(candidate, lines)
+        if len(heap) < k:
+            heapq.heappush(heap, (entry[0], candidate, entry))
+        elif entry[0] > threshold:
+            heapq.heapreplace(heap, (entry[0], candidate, entry))
+        else:
+            continue
 
-    for word_id in word_ids:
-        search_single_word_results(word_id, documents)
+        if len(heap) == k:
+            threshold = heap[0][0]
+            while first_essential < query_length and prefix_bounds[first_essential] <= threshold:
+                first_essential += 1
+            essential = [cursors[order[i]]
+                         for i in range(first_essential, query_length)]
 
-    # convert the documents dictionary into a list and sort in descending order based on
-    # the score | higher the score the higher the rank of the document
-    ranked_documents = sorted(list(documents.items()),
+    ranked_documents = sorted(((str(doc_id), entry) for _, doc_id, entry in heap),
                               key=lambda x: x[1][0], reverse=True)
-
     return ranked_documents
+
+
+def search_words(words_list: List[str], k: int | None = DEFAULT_RESULT_COUNT,
+                 ranking: str | None = None) -> List[Tuple]:
+    """receives a list of words to search and returns the k best ranked documents,
+    all matching documents are returned if k is None
+    """
+
+    return get_searcher().search_words(words_list, k, ranking)
+
+
+def search_query(text: str, k: int | None = DEFAULT_RESULT_COUNT, ranking: str | None = None) -> List[Tuple]:
+    """parses the query text and returns the k best ranked documents, all matching
+    documents are returned if k is None. ranking is one of RANKINGS, the searcher's
+    default is used if it is None
+    """
+
+    return get_searcher().search_query(text, k, ranking)
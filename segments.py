@@ -0,0 +1,668 @@
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import threading
+from bisect import bisect_right
+from itertools import groupby
+from typing import List, Dict, Any, Callable, Iterator
+
+import tracing
+from atomic_file import atomic_write, fsync_directory, fsync_files
+from binary_lexicon import BinaryLexicon, write_binary_lexicon
+from collection_stats import STATS_FILE, CollectionStats
+from docstore import KEYS_FILE, DocumentStoreWriter
+from postings import (BARREL_EXTENSION, POSTINGS_FORMAT, BlockPostingCursor, PostingCursor, convert_text_barrel,
+                      get_barrel_file_name, get_barrel_num, is_barrel_file, is_text_barrel_file, iter_barrel_postings,
+                      read_term_block, decode_postings, write_merged_barrel)
+
+# Every ingestion batch becomes an immutable segment directory holding its own
+# inverted barrels and a binary lexicon of the words it contains. The manifest
+# segments.json lists the live segments with the first word id of each of their
+# barrels and the barrel count used for new segments. Searches fan out over all
+# segments and a tiered merge policy compacts small segments in a background thread.
+#
+# Apart from the append only document store, the manifest is the only file which is
+# ever replaced, always atomically, so it is the commit point of the index. Besides the
+# segments it names the collection statistics, document store keys and surface forms of
+# its generation (and the document index of indexes built before the store), which are
+# written under new names before the commit. Segments and files dropped by a commit are kept for
+# RETIRE_SECONDS, so readers still using an older manifest can finish their queries.
+#
+# The doc ids of the postings and statistics are the record numbers of the document
+# store, given in indexing order. Indexes built before used the crc32 hash of the
+# article id instead, renumber_documents rewrites their segments and statistics once.
+
+SEGMENTS_PATH = './Segments'
+MANIFEST_FILE = 'segments.json'
+SEGMENT_LEXICON_FILE = 'lexicon.bin'
+
+# number of segments of similar size which are merged together
+MERGE_FACTOR = 10
+
+# most barrels a segment is split into unless the manifest says otherwise
+BARREL_COUNT = 300
+
+# barrels are not made smaller than this many bytes, so small segments use fewer barrels
+MIN_BARREL_SIZE = 256 * 1024
+
+# bytes copied at once when a segment is split into barrels
+COPY_SIZE = 1024 * 1024
+
+# segments smaller than this many bytes are all treated as the lowest tier
+MIN_SEGMENT_SIZE = 1024 * 1024
+
+# keys of the manifest naming the document index, collection statistics, document store keys
+# and surface forms files
+DOCUMENT_INDEX_KEY = 'document_index'
+STATS_KEY = 'stats'
+DOCUMENT_KEYS_KEY = 'document_keys'
+SURFACE_FORMS_KEY = 'surface_forms'
+
+# set in the manifest once the doc ids of the postings are record numbers of the document store
+DENSE_DOC_IDS_KEY = 'dense_doc_ids'
+
+# where the indexer leaves the statistics, document store keys and surface forms including a
+# new batch of documents, the sorter publishes them together with the segment of the batch
+BATCH_FILES = {STATS_KEY: './ForwardBarrels/collection_stats.bin',
+               DOCUMENT_KEYS_KEY: './ForwardBarrels/document_keys.bin',
+               SURFACE_FORMS_KEY: './ForwardBarrels/surface_forms.json'}
+
+# seconds segments and files dropped from the manifest are kept before they are deleted
+RETIRE_SECONDS = 300
+
+# guards reading and rewriting the manifest and allocating segment names
+_manifest_lock = threading.RLock()
+
+
+def get_manifest_path(segments_path: str = SEGMENTS_PATH) -> str:
+    """returns path of the segments manifest"""
+
+    return os.path.join(segments_path, MANIFEST_FILE)
+
+
+def load_manifest(segments_path: str = SEGMENTS_PATH) -> Dict[str, Any]:
+    """returns the segments manifest or an empty one if no segment was committed yet"""
+
+    manifest_path = get_manifest_path(segments_path)
+    if not os.path.isfile(manifest_path):
+        return {"generation": 0, "segments": []}
+    with open(manifest_path, 'r') as manifest_file:
+        return json.load(manifest_file)
+
+
+def write_manifest(manifest: Dict[str, Any], segments_path: str = SEGMENTS_PATH) -> None:
+    """writes the manifest to a temporary file and renames it over the old one"""
+
+    atomic_write(get_manifest_path(segments_path), json.dumps(manifest))
+
+
+def get_index_file(key: str, default: str | None, segments_path: str = SEGMENTS_PATH,
+                   manifest: Dict[str, Any] | None = None) -> str | None:
+    """returns path of the file the manifest names under key, indexes committed
+    before the manifest named their files keep them at the default path
+    """
+
+    if manifest is None:
+        manifest = load_manifest(segments_path)
+    if key in manifest:
+        return os.path.join(segments_path, manifest[key])
+    return default
+
+
+def create_segment_dir(segments_path: str = SEGMENTS_PATH) -> str:
+    """creates the directory of a new segment and returns its name"""
+
+    with _manifest_lock:
+        os.makedirs(segments_path, exist_ok=True)
+        numbers = [int(name[len('segment_'):]) for name in os.listdir(segments_path)
+                   if name.startswith('segment_') and name[len('segment_'):].isnumeric()]
+        name = 'segment_{:06d}'.format(max(numbers, default=0) + 1)
+        os.mkdir(os.path.join(segments_path, name))
+    return name
+
+
+def get_segment_size(segment_path: str) -> int:
+    """returns the number of bytes used by the barrels of a segment"""
+
+    return sum(os.path.getsize(os.path.join(segment_path, file_name))
+               for file_name in os.listdir(segment_path) if is_barrel_file(file_name))
+
+
+def write_segment_lexicon(segment_path: str, lexicon: Dict[str, List[int]]) -> None:
+    """writes the binary lexicon of the words stored in a segment"""
+
+    write_binary_lexicon(lexicon, os.path.join(
+        segment_path, SEGMENT_LEXICON_FILE))
+
+
+def delete_retired(retired: List[Dict[str, Any]], segments_path: str = SEGMENTS_PATH) -> List[Dict[str, Any]]:
+    """deletes the segments and files retired more than RETIRE_SECONDS ago and returns the others"""
+
+    kept = []
+    for entry in retired:
+        if time.time() - entry["time"] < RETIRE_SECONDS:
+            kept.append(entry)
+            continue
+        path = os.path.join(segments_path, entry["name"])
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.exists(path):
+            os.remove(path)
+    return kept
+
+
+def commit_segments(added: List[Dict[str, Any]], removed: List[str], segments_path: str = SEGMENTS_PATH,
+                    files: Dict[str, str] | None = None, settings: Dict[str, Any] | None = None) -> Dict[str, Any]:
+    """publishes added segments and drops removed ones in a new manifest generation.
+    files maps manifest keys to finished files which replace the ones the manifest
+    names, they are moved into the segments directory under a name of the generation.
+    settings are other manifest entries changed by the same commit.
+    """
+
+    with _manifest_lock:
+        manifest = load_manifest(segments_path)
+        generation = manifest["generation"] + 1
+        retired = delete_retired(manifest.get("retired", []), segments_path)
+        now = time.time()
+
+        for key, path in (files or {}).items():
+            root, extension = os.path.splitext(os.path.basename(path))
+            name = '{}_{:06d}{}'.format(root, generation, extension)
+            os.replace(path, os.path.join(segments_path, name))
+            if key in manifest:
+                retired.append({"name": manifest[key], "time": now})
+            manifest[key] = name
+
+        manifest.update(settings or {})
+        manifest["segments"] = [info for info in manifest["segments"]
+                                if info["name"] not in removed] + added
+        manifest["retired"] = retired + \
+            [{"name": name, "time": now} for name in removed]
+        manifest["generation"] = generation
+        write_manifest(manifest, segments_path)
+    return manifest
+
+
+class Segment:
+    """Read only view of a committed segment. Barrel files are opened on first
+    use and kept open, they are read with pread so threads can share them.
+    """
+
+    def __init__(self, info: Dict[str, Any], segments_path: str = SEGMENTS_PATH) -> None:
+        self.name = info["name"]
+        self.doc_count = info["doc_count"]
+        self.path = os.path.join(segments_path, self.name)
+        # first word id of every barrel, segments written before the barrel layout
+        # was configurable use barrels of WORDS_PER_BARREL word ids
+        self.barrels = info.get("barrels")
+        # segments without a format were written before term blocks had skip tables
+        self.postings_format = info.get("format", 1)
+        self.lexicon = BinaryLexicon(
+            os.path.join(self.path, SEGMENT_LEXICON_FILE))
+        self._barrel_fds = {}
+        self._lock = threading.Lock()
+
+    def search_lexicon(self, word: str) -> List[int] | None:
+        """returns [word_id, offset] of the word in this segment"""
+
+        return self.lexicon.get(word)
+
+    def get_barrel_num(self, word_id: int) -> int:
+        """returns number of the barrel of this segment which stores the word"""
+
+        if self.barrels is None:
+            return get_barrel_num(word_id)
+        return bisect_right(self.barrels, word_id)
+
+    def _get_barrel_fd(self, barrel_num: int) -> int:
+        fd = self._barrel_fds.get(barrel_num)
+        if fd is None:
+            with self._lock:
+                fd = self._barrel_fds.get(barrel_num)
+                if fd is None:
+                    fd = os.open(os.path.join(
+                        self.path, get_barrel_file_name(barrel_num)), os.O_RDONLY)
+                    self._barrel_fds[barrel_num] = fd
+        return fd
+
+    def read_postings(self, entry: List[int]) -> List | None:
+        """reads the postings of the word with given [word_id, offset] entry"""
+
+        fd = self._get_barrel_fd(self.get_barrel_num(entry[0]))
+        word_id, doc_count, data, _ = read_term_block(
+            fd, entry[1], self.postings_format)
+        if word_id != entry[0]:
+            return None
+        tracing.count('bytes_read', len(data))
+        tracing.count('postings_decoded', doc_count)
+        return decode_postings(word_id, doc_count, data)
+
+    def read_cursor(self, entry: List[int]) -> Any:
+        """returns a posting cursor over the word with given [word_id, offset] entry,
+        blocks of long posting lists are decoded only when the cursor reaches them
+        """
+
+        fd = self._get_barrel_fd(self.get_barrel_num(entry[0]))
+        word_id, doc_count, data, skip_table = read_term_block(
+            fd, entry[1], self.postings_format)
+        if word_id != entry[0]:
+            return None
+        tracing.count('bytes_read', len(data) + len(skip_table or b''))
+        if skip_table:
+            return BlockPostingCursor(word_id, doc_count, data, skip_table)
+        tracing.count('postings_decoded', doc_count)
+        return PostingCursor(decode_postings(word_id, doc_count, data))
+
+    def close(self) -> None:
+        with self._lock:
+            for fd in self._barrel_fds.values():
+                os.close(fd)
+            self._barrel_fds = {}
+        self.lexicon.close()
+
+    def __del__(self) -> None:
+        for fd in getattr(self, '_barrel_fds', {}).values():
+            os.close(fd)
+
+
+class TieredMergePolicy:
+    """Groups segments into tiers whose sizes differ by merge_factor and merges
+    merge_factor segments of the lowest tier that has that many, so every
+    posting is rewritten only about log(index size) times.
+    """
+
+    def __init__(self, merge_factor: int = MERGE_FACTOR, min_segment_size: int = MIN_SEGMENT_SIZE) -> None:
+        self.merge_factor = merge_factor
+        self.min_segment_size = min_segment_size
+
+    def get_tier(self, size: int) -> int:
+        """returns the largest tier whose segments hold min_segment_size * merge_factor ** tier
+        bytes or more, counted in integers so exact powers are not put a tier too low
+        """
+
+        units = size // self.min_segment_size
+        tier = 0
+        threshold = self.merge_factor
+        while threshold <= units:
+            threshold *= self.merge_factor
+            tier += 1
+        return tier
+
+    def find_merge(self, segments: List[Dict[str, Any]]) -> List[str] | None:
+        """returns names of segments which should be merged or None"""
+
+        tiers = {}
+        for info in segments:
+            tiers.setdefault(self.get_tier(info["size"]), []).append(info)
+
+        for tier in sorted(tiers):
+            if len(tiers[tier]) >= self.merge_factor:
+                smallest = sorted(tiers[tier], key=lambda info: info["size"])
+                return [info["name"] for info in smallest[:self.merge_factor]]
+        return None
+
+
+def get_barrel_files(segment_path: str) -> List[str]:
+    """returns the barrel file names of a segment in word id order"""
+
+    barrel_files = [file_name for file_name in os.listdir(segment_path)
+                    if is_barrel_file(file_name)]
+    return sorted(barrel_files, key=lambda file_name: int(file_name[len('inverted_barrel_'):-len(BARREL_EXTENSION)]))
+
+
+def iter_segment_postings(segment_path: str, postings_format: int = 1) -> Iterator[List]:
+    """yields every posting of a segment sorted by word id and doc id"""
+
+    for file_name in get_barrel_files(segment_path):
+        yield from iter_barrel_postings(os.path.join(segment_path, file_name), postings_format)
+
+
+def split_barrels(postings_path: str, barrel_starts: List[int], segment_path: str) -> None:
+    """copies consecutive byte ranges of the postings file into numbered barrel files"""
+
+    barrel_ends = barrel_starts[1:] + [os.path.getsize(postings_path)]
+    with open(postings_path, 'rb') as postings_file:
+        for barrel_num, (start, end) in enumerate(zip(barrel_starts, barrel_ends), 1):
+            with open(os.path.join(segment_path, get_barrel_file_name(barrel_num)), 'wb') as barrel_file:
+                remaining = end - start
+                while remaining:
+                    chunk = postings_file.read(min(COPY_SIZE, remaining))
+                    barrel_file.write(chunk)
+                    remaining -= len(chunk)
+
+
+def build_segment(sources: List[Iterator[List]], get_word: Callable[[int], str], segments_path: str = SEGMENTS_PATH,
+                  barrel_count: int | None = None) -> Dict[str, Any] | None:
+    """merges posting streams sorted by word id and doc id into a new segment and
+    returns its info, or None if there were no postings. The postings are cut into
+    at most barrel_count barrels at word boundaries so every barrel holds about the
+    same number of bytes, the first word id of every barrel is kept in the info.
+    """
+
+    if barrel_count is None:
+        barrel_count = load_manifest(segments_path).get(
+            "barrel_count", BARREL_COUNT)
+
+    name = create_segment_dir(segments_path)
+    segment_path = os.path.join(segments_path, name)
+    try:
+        # write all term blocks to one file first, the barrel boundaries depend on their sizes
+        postings_path = os.path.join(segment_path, 'postings.tmp')
+        doc_ids = set()
+        offsets = write_merged_barrel(sources, postings_path, doc_ids)
+        if not offsets:
+            shutil.rmtree(segment_path)
+            return None
+
+        total_size = os.path.getsize(postings_path)
+        barrel_count = max(1, min(barrel_count, math.ceil(
+            total_size / MIN_BARREL_SIZE), len(offsets)))
+
+        # a new barrel starts at the first word beyond its share of the bytes
+        barrels = []
+        barrel_starts = []
+        lexicon = {}
+        for word_id, offset in offsets.items():
+            if offset >= len(barrels) * total_size / barrel_count:
+                barrels.append(word_id)
+                barrel_starts.append(offset)
+            lexicon[get_word(word_id)] = [word_id, offset - barrel_starts[-1]]
+
+        if len(barrels) == 1:
+            os.replace(postings_path, os.path.join(
+                segment_path, get_barrel_file_name(1)))
+        else:
+            split_barrels(postings_path, barrel_starts, segment_path)
+            os.remove(postings_path)
+
+        write_segment_lexicon(segment_path, lexicon)
+
+        # the segment must be on disk before a manifest can list it
+        fsync_files(segment_path)
+        fsync_directory(segments_path)
+    except BaseException:
+        # an unfinished segment is never listed in the manifest, just drop it
+        shutil.rmtree(segment_path, ignore_errors=True)
+        raise
+
+    return {"name": name, "doc_count": len(doc_ids), "size": total_size, "barrels": barrels,
+            "format": POSTINGS_FORMAT}
+
+
+def renumber_postings(postings: Iterator[List], doc_ids: Dict[int, int]) -> Iterator[List]:
+    """yields postings sorted by word id and doc id with every doc id replaced by
+    doc_ids[doc_id] and sorted again, postings of documents missing from doc_ids are dropped
+    """
+
+    for _, word_postings in groupby(postings, key=lambda posting: posting[0][1]):
+        renumbered = []
+        for posting in word_postings:
+            doc_id = doc_ids.get(posting[0][0])
+            if doc_id is not None:
+                posting[0][0] = doc_id
+                renumbered.append(posting)
+        renumbered.sort(key=lambda posting: posting[0][0])
+        yield from renumbered
+
+
+def merge_segments(names: List[str], segments_path: str = SEGMENTS_PATH,
+                   doc_ids: Dict[int, int] | None = None, barrel_count: int | None = None) -> Dict[str, Any]:
+    """writes a new segment holding the postings of the given segments and returns its
+    info, the doc ids of the postings are replaced by doc_ids[doc_id] if it is given.
+    The segment has at most barrel_count barrels, the manifest gives the count if it is None.
+    """
+
+    segment_paths = [os.path.join(segments_path, name) for name in names]
+    formats = {info["name"]: info.get("format", 1)
+               for info in load_manifest(segments_path)["segments"]}
+
+    # word ids are global so the lexicons of the segments never disagree
+    words = {}
+    for segment_path in segment_paths:
+        segment_lexicon = BinaryLexicon(
+            os.path.join(segment_path, SEGMENT_LEXICON_FILE))
+        for word, entry in segment_lexicon.items():
+            words[entry[0]] = word
+        segment_lexicon.close()
+
+    sources = [iter_segment_postings(segment_path, formats.get(name, 1))
+               for name, segment_path in zip(names, segment_paths)]
+    if doc_ids is not None:
+        sources = [renumber_postings(source, doc_ids) for source in sources]
+    return build_segment(sources, words.__getitem__, segments_path, barrel_count)
+
+
+class SegmentMerger:
+    """Runs the merges chosen by the merge policy in a background thread so
+    ingestion and searches are never blocked by compaction.
+    """
+
+    def __init__(self, segments_path: str = SEGMENTS_PATH, policy: TieredMergePolicy | None = None) -> None:
+        self.segments_path = segments_path
+        self.policy = policy or TieredMergePolicy()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._merge_lock = threading.Lock()
+
+    def maybe_merge(self) -> None:
+        """starts a background merge if none is running"""
+
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self.run, daemon=True)
+                self._thread.start()
+
+    def run(self) -> None:
+        """merges segments until the policy finds nothing more to merge"""
+
+        while True:
+            names = self.policy.find_merge(
+                load_manifest(self.segments_path)["segments"])
+            if names is None:
+                return
+            self.merge(names)
+
+    @tracing.traced('merge')
+    def merge(self, names: List[str]) -> None:
+        """merges the given segments, publishes the result and retires the inputs"""
+
+        # merges are serialized, segments rewritten by an earlier merge are skipped
+        with self._merge_lock:
+            live = {info["name"]
+                    for info in load_manifest(self.segments_path)["segments"]}
+            if not set(names) <= live:
+                return
+
+            with tracing.stage('merge_segments'):
+                info = merge_segments(names, self.segments_path)
+            with tracing.stage('commit'):
+                commit_segments([info] if info else [],
+                                names, self.segments_path)
+            tracing.count('segments_merged', len(names))
+            if info:
+                tracing.count('segment_bytes_written', info["size"])
+
+    def reshard(self, barrel_count: int) -> None:
+        """rewrites every segment with a size balanced layout of at most barrel_count
+        barrels and publishes them with the new barrel count in one commit, so the
+        index never mixes the layouts of a reshard which did not finish
+        """
+
+        with self._merge_lock:
+            manifest = load_manifest(self.segments_path)
+            added = []
+            try:
+                for info in manifest["segments"]:
+                    with tracing.stage('merge_segments'):
+                        added.append(merge_segments(
+                            [info["name"]], self.segments_path, barrel_count=barrel_count))
+            except BaseException:
+                # segments of an unfinished reshard are never listed in the manifest, just drop them
+                for info in added:
+                    if info:
+                        shutil.rmtree(os.path.join(self.segments_path, info["name"]), ignore_errors=True)
+                raise
+
+            commit_segments([info for info in added if info], [info["name"] for info in manifest["segments"]],
+                            self.segments_path, settings={"barrel_count": barrel_count})
+
+    def renumber_documents(self) -> bool:
+        """switches an index whose postings use crc32 hashes of the article ids as doc
+        ids to the record numbers of the document store. Every segment and the statistics
+        are rewritten and published in one commit, the urls of an index built before the
+        document store are added to it first. Returns False if there was nothing to do.
+        """
+
+        with self._merge_lock:
+            manifest = load_manifest(self.segments_path)
+            if manifest.get(DENSE_DOC_IDS_KEY):
+                return False
+
+            store = DocumentStoreWriter(self.segments_path, get_index_file(
+                DOCUMENT_KEYS_KEY, None, self.segments_path, manifest))
+            try:
+                document_index_path = get_index_file(
+                    DOCUMENT_INDEX_KEY, './document_index.txt', self.segments_path, manifest)
+                if not len(store) and os.path.isfile(document_index_path):
+                    with open(document_index_path) as document_index_file:
+                        for key, url in json.load(document_index_file).items():
+                            store.add({"url": url}, int(key))
+            finally:
+                store.close()
+
+            # the crc32 doc ids are the keys of the store, the old index deduplicated by them
+            doc_ids = dict(store.keys + store.new_keys)
+            if manifest["segments"] and not doc_ids:
+                raise ValueError(
+                    "the index has no document index, its doc ids can not be renumbered")
+            files = {}
+            if doc_ids:
+                files[DOCUMENT_KEYS_KEY] = os.path.join(
+                    self.segments_path, KEYS_FILE)
+                store.commit(files[DOCUMENT_KEYS_KEY])
+
+            added = []
+            for info in manifest["segments"]:
+                with tracing.stage('merge_segments'):
+                    added.append(merge_segments(
+                        [info["name"]], self.segments_path, doc_ids))
+
+            stats_path = get_index_file(
+                STATS_KEY, STATS_FILE, self.segments_path, manifest)
+            if os.path.isfile(stats_path):
+                files[STATS_KEY] = os.path.join(
+                    self.segments_path, STATS_FILE)
+                CollectionStats.load(stats_path).renumber(
+                    doc_ids).save(files[STATS_KEY])
+
+            commit_segments([info for info in added if info], [info["name"] for info in manifest["segments"]],
+                            self.segments_path, files, {DENSE_DOC_IDS_KEY: True})
+        return True
+
+    def wait(self) -> None:
+        """blocks until the running background merge finishes"""
+
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+
+
+_mergers = {}
+
+
+def get_merger(segments_path: str = SEGMENTS_PATH) -> SegmentMerger:
+    """returns the merger of the segments directory shared by the whole process"""
+
+    with _manifest_lock:
+        if segments_path not in _mergers:
+            _mergers[segments_path] = SegmentMerger(segments_path)
+        return _mergers[segments_path]
+
+
+def import_legacy_index(segments_path: str = SEGMENTS_PATH, barrels_path: str = './InvertedBarrels') -> str | None:
+    """turns the barrels in barrels_path built before segments existed into a
+    segment, returns its name or None if there is nothing to import. Barrels of the
+    json per line format are converted to binary barrels of the segment. The old
+    barrels are only deleted once the segment is committed, so an import which
+    fails can be run again.
+    """
+
+    file_names = os.listdir(barrels_path)
+    text_barrels = {file_name[:-len('.txt')] + BARREL_EXTENSION: file_name
+                    for file_name in file_names if is_text_barrel_file(file_name)}
+    # a barrel converted by an older in place migration is converted again from its text barrel
+    barrel_files = sorted(set(text_barrels) | {file_name for file_name in file_names
+                                               if is_barrel_file(file_name)})
+    if not barrel_files:
+        return None
+    if load_manifest(segments_path).get(DENSE_DOC_IDS_KEY):
+        raise ValueError(
+            "legacy barrels use crc32 doc ids, they can not be added to an index which was renumbered")
+
+    if os.path.isfile('lexicon.bin'):
+        lexicon = dict(BinaryLexicon('lexicon.bin').items())
+    else:
+        with open('lexicon.txt', 'r') as lexicon_file:
+            lexicon = json.load(lexicon_file)
+        lexicon.pop("word_count", None)
+    words = {entry[0]: word for word, entry in lexicon.items()}
+
+    name = create_segment_dir(segments_path)
+    segment_path = os.path.join(segments_path, name)
+    try:
+        for file_name in barrel_files:
+            if file_name in text_barrels:
+                convert_text_barrel(os.path.join(barrels_path, text_barrels[file_name]),
+                                    os.path.join(segment_path, file_name), lexicon, words)
+            else:
+                # the barrel is linked, it stays in barrels_path until the commit
+                os.link(os.path.join(barrels_path, file_name),
+                        os.path.join(segment_path, file_name))
+
+        doc_ids = {posting[0][0] for posting in iter_segment_postings(segment_path)}
+
+        # words which were indexed but never sorted have no postings in the barrels
+        lexicon = {word: entry for word, entry in lexicon.items()
+                   if get_barrel_file_name(get_barrel_num(entry[0])) in barrel_files}
+
+        write_segment_lexicon(segment_path, lexicon)
+        fsync_files(segment_path)
+        fsync_directory(segments_path)
+    except BaseException:
+        # an unfinished segment is never listed in the manifest, just drop it
+        shutil.rmtree(segment_path, ignore_errors=True)
+        raise
+
+    commit_segments([{"name": name, "doc_count": len(doc_ids),
+                      "size": get_segment_size(segment_path)}], [], segments_path)
+
+    # the segment holds the postings now, the old barrels are no longer needed
+    for file_name in barrel_files:
+        for old_name in (file_name, text_barrels.get(file_name)):
+            if old_name is not None and os.path.isfile(os.path.join(barrels_path, old_name)):
+                os.remove(os.path.join(barrels_path, old_name))
+    return name
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command == 'import-legacy':
+        print("Imported segment:", import_legacy_index())
+    elif command == 'reshard' and len(sys.argv) > 2:
+        get_merger().reshard(int(sys.argv[2]))
+        print("Segments:", [(info["name"], len(info["barrels"]))
+              for info in load_manifest()["segments"]])
+    elif command == 'renumber':
+        print("Renumbered:", get_merger().renumber_documents())
+    elif command == 'merge':
+        # merge every live segment into a single one
+        names = [info["name"] for info in load_manifest()["segments"]]
+        if len(names) > 1:
+            get_merger().merge(names)
+        print("Segments:", [info["name"]
+              for info in load_manifest()["segments"]])
+    else:
+        print("usage: python segments.py import-legacy | renumber | merge | reshard <barrel count>")
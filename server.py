@@ -0,0 +1,413 @@
+import os
+import json
+import time
+import asyncio
+import argparse
+import ipaddress
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+from urllib.parse import urlsplit, parse_qs
+
+import tracing
+from near_duplicates import DEFAULT_DUPLICATE_POLICY, DUPLICATE_POLICIES
+from query import parse_query
+from searcher import DEFAULT_RESULT_COUNT, RANKINGS, Searcher, format_results
+from suggest import SUGGESTION_COUNT
+from tokenizer import tokenizer
+
+# The service answers plain HTTP/1.1 on a loopback address. Requests are parsed on
+# the event loop, searches run in a thread pool sharing one searcher, so the
+# segments, memory mapped lexicons, open barrel files and caches stay warm across
+# requests. At most `concurrency` searches run at once and at most `max_pending`
+# wait for a slot, further requests are rejected with 503 right away instead of
+# queueing without bound. Indexing runs in its own thread, one directory at a time.
+#
+#   GET  /search?q=<query>&k=<count>&ranking=<bm25|hits>&snippets=1&trace=1
+#   GET  /suggest?q=<text>&k=<count>
+#                                  completions of the last word and a corrected query
+#   POST /index?path=<directory>&duplicates=<cluster|skip>
+#                                  starts indexing the directory, 202 or 409 if busy
+#   GET  /index                    state of the index and of the last indexing run
+#   GET  /metrics                  stage timings and counters of traced operations
+#
+# Results have the url and title of the document, snippets=1 adds an html snippet of its
+# text with the query words in bold. Near duplicates are collapsed to the best ranked
+# document of their cluster. trace=1 returns the stage timings and counters of
+# that search with its results. If words of the query are not in the index the
+# response has the query with their closest terms as did_you_mean. Suggestions are
+# meant for every keystroke and share the workers and admission control of searches.
+
+HOST = '127.0.0.1'
+PORT = 8080
+
+# threads running searches, most of a search is spent reading and decoding postings
+WORKERS = 8
+
+# searches running at once and searches allowed to wait for one of them
+CONCURRENCY = 8
+MAX_PENDING = 64
+
+# largest number of results a request can ask for
+MAX_RESULT_COUNT = 1000
+
+# seconds a client gets to send its request line and headers, and most bytes of them
+REQUEST_TIMEOUT = 10
+MAX_HEADER_LINES = 100
+MAX_BODY_SIZE = 64 * 1024
+
+STATUS_TEXT = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               409: 'Conflict', 413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+def check_loopback(host: str) -> None:
+    """raises ValueError unless host is a loopback address, the service is never exposed"""
+
+    if host == 'localhost':
+        return
+    try:
+        if ipaddress.ip_address(host).is_loopback:
+            return
+    except ValueError:
+        pass
+    raise ValueError("the search service only listens on localhost, not on {}".format(host))
+
+
+def encode_response(status: int, body: Dict | str, keep_alive: bool, headers: Dict[str, str] | None = None) -> bytes:
+    """returns the bytes of an HTTP response with a json body, or a plain text body if it is a string"""
+
+    if isinstance(body, str):
+        payload = body.encode()
+        content_type = "text/plain; version=0.0.4"
+    else:
+        payload = json.dumps(body).encode()
+        content_type = "application/json"
+    lines = ["HTTP/1.1 {} {}".format(status, STATUS_TEXT[status]),
+             "Content-Type: {}".format(content_type),
+             "Content-Length: {}".format(len(payload)),
+             "Connection: {}".format('keep-alive' if keep_alive else 'close')]
+    lines += ["{}: {}".format(name, value)
+              for name, value in (headers or {}).items()]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode() + payload
+
+
+class HTTPError(Exception):
+    """Error answered to the client with the status code"""
+
+    def __init__(self, status: int, message: str, headers: Dict[str, str] | None = None) -> None:
+        super().__init__(message)
+        self.status = status
+        self.headers = headers
+
+
+def get_count(params: Dict[str, str], default: int) -> int:
+    """returns the number of results asked for by the k parameter"""
+
+    try:
+        k = int(params.get('k', default))
+    except ValueError:
+        raise HTTPError(400, "k must be a number")
+    if not 0 < k <= MAX_RESULT_COUNT:
+        raise HTTPError(400, "k must be between 1 and {}".format(MAX_RESULT_COUNT))
+    return k
+
+
+class SearchService:
+    """Asyncio HTTP front end of a long lived searcher with a bounded worker pool
+    and admission control, and a single indexing thread which commits new
+    segments the searcher picks up on its next query.
+    """
+
+    def __init__(self, searcher: Searcher | None = None, workers: int = WORKERS,
+                 concurrency: int = CONCURRENCY, max_pending: int = MAX_PENDING) -> None:
+        self.searcher = searcher or Searcher()
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='search')
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self.served = 0
+        self._slots = None
+        self._server = None
+        self._index_thread = None
+        self._index_lock = threading.Lock()
+        self._last_index_run = None
+
+    async def start(self, host: str = HOST, port: int = PORT) -> asyncio.AbstractServer:
+        """opens the index and starts listening on host and port"""
+
+        check_loopback(host)
+        self._slots = asyncio.Semaphore(self.concurrency)
+        # load the manifest, lexicons, document store, statistics, the term indexes of the
+        # suggestions and the stemmer before the first request
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(loop.run_in_executor(self.executor, self.searcher.load_term_indexes),
+                             loop.run_in_executor(self.executor, tokenizer.stem_cache.load_stemmer))
+        self._server = await asyncio.start_server(self.handle_connection, host, port)
+        return self._server
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self.executor.shutdown(wait=True)
+
+    async def read_request(self, reader: asyncio.StreamReader) -> Tuple[str, str, Dict[str, str], bytes] | None:
+        """reads one request, returns None if the client closed the connection"""
+
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        try:
+            method, target, _ = request_line.decode('latin-1').split()
+        except ValueError:
+            raise HTTPError(400, "malformed request line")
+
+        headers = {}
+        for _ in range(MAX_HEADER_LINES):
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        else:
+            raise HTTPError(400, "too many headers")
+
+        try:
+            length = int(headers.get('content-length', 0) or 0)
+        except ValueError:
+            raise HTTPError(400, "malformed content length")
+        if length > MAX_BODY_SIZE:
+            raise HTTPError(413, "request body is too large")
+        body = await reader.readexactly(length) if length else b''
+        return method, target, headers, body
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """serves the requests of one connection until the client closes it"""
+
+        try:
+            while True:
+                keep_alive = False
+                try:
+                    request = await asyncio.wait_for(self.read_request(reader), REQUEST_TIMEOUT)
+                    if request is None:
+                        break
+                    method, target, headers, body = request
+                    keep_alive = headers.get('connection', '').lower() != 'close'
+                    status, response = await self.dispatch(method, target, body)
+                    extra_headers = None
+                except HTTPError as error:
+                    status, response, extra_headers = error.status, {
+                        "error": str(error)}, error.headers
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+                    break
+                except Exception as error:
+                    status, response, extra_headers = 500, {
+                        "error": str(error)}, None
+
+                writer.write(encode_response(
+                    status, response, keep_alive, extra_headers))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method: str, target: str, body: bytes) -> Tuple[int, Dict | str]:
+        """routes a request to its endpoint"""
+
+        url = urlsplit(target)
+        params = {name: values[-1]
+                  for name, values in parse_qs(url.query).items()}
+
+        if url.path == '/search':
+            if method != 'GET':
+                raise HTTPError(405, "use GET /search")
+            return await self.search(params)
+
+        if url.path == '/suggest':
+            if method != 'GET':
+                raise HTTPError(405, "use GET /suggest")
+            return await self.suggest(params)
+
+        if url.path == '/index':
+            if method == 'GET':
+                return 200, self.get_index_state()
+            if method == 'POST':
+                if body:
+                    try:
+                        params.update(json.loads(body))
+                    except (ValueError, TypeError):
+                        raise HTTPError(400, "body must be a json object")
+                return self.start_indexing(params.get('path'), params.get('duplicates', DEFAULT_DUPLICATE_POLICY))
+            raise HTTPError(405, "use GET or POST /index")
+
+        if url.path == '/metrics':
+            return 200, tracing.metrics_text()
+
+        raise HTTPError(404, "unknown path {}".format(url.path))
+
+    async def run_admitted(self, function: Any, *args: Any) -> Tuple[Any, float]:
+        """runs the function in the worker pool if a slot is free or can be waited for,
+        returns its result and the seconds it took including the wait
+        """
+
+        # admission control, a request which would wait behind too many others is turned away
+        if self.pending >= self.concurrency + self.max_pending:
+            self.rejected += 1
+            raise HTTPError(503, "too many pending searches", {"Retry-After": "1"})
+
+        self.pending += 1
+        try:
+            async with self._slots:
+                start = time.perf_counter()
+                result = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, function, *args)
+                return result, time.perf_counter() - start
+        finally:
+            self.pending -= 1
+
+    async def search(self, params: Dict[str, str]) -> Tuple[int, Dict]:
+        """runs the search in the worker pool if a slot is free or can be waited for"""
+
+        text = params.get('q', '')
+        k = get_count(params, DEFAULT_RESULT_COUNT)
+        ranking = params.get('ranking')
+        if ranking is not None and ranking not in RANKINGS:
+            raise HTTPError(400, "ranking must be one of {}".format(', '.join(RANKINGS)))
+        trace = params.get('trace', '') not in ('', '0', 'false')
+        snippets = params.get('snippets', '') not in ('', '0', 'false')
+
+        (results, suggestion, search_trace), elapsed = await self.run_admitted(
+            self.run_search, text, k, ranking, trace, snippets)
+
+        self.served += 1
+        response = {"query": text, "k": k, "time": elapsed, "results": results}
+        if suggestion is not None:
+            response["did_you_mean"] = suggestion
+        if search_trace is not None:
+            response["trace"] = search_trace.to_dict()
+        return 200, response
+
+    def run_search(self, text: str, k: int, ranking: str | None, trace: bool = False,
+                   snippets: bool = False) -> Tuple[List[Dict[str, Any]], str | None, tracing.Trace | None]:
+        """searches the query and returns the ranked documents with their urls and
+        titles, snippets if they were asked for, the corrected query if words are
+        missing from the index and the trace of the search if it was asked for
+        """
+
+        words = parse_query(text).words if snippets else None
+        # the results are looked up in the documents of the commit they were ranked in
+        snapshot = self.searcher.snapshot()
+        if not trace:
+            ranked_documents = self.searcher.search_query(text, k, ranking, snapshot)
+            return (format_results(ranked_documents, snapshot[2], words),
+                    self.searcher.suggest_query(text), None)
+
+        with tracing.trace('search') as search_trace:
+            ranked_documents = self.searcher.search_query(text, k, ranking, snapshot)
+            with tracing.stage('format'):
+                results = format_results(
+                    ranked_documents, snapshot[2], words)
+            suggestion = self.searcher.suggest_query(text)
+        return results, suggestion, search_trace
+
+    async def suggest(self, params: Dict[str, str]) -> Tuple[int, Dict]:
+        """completes the last word of the text and corrects the words missing from the index"""
+
+        text = params.get('q', '')
+        k = get_count(params, SUGGESTION_COUNT)
+        (completions, suggestion), elapsed = await self.run_admitted(self.run_suggest, text, k)
+        return 200, {"query": text, "time": elapsed, "did_you_mean": suggestion,
+                     "completions": [{"term": term, "documents": count} for term, count in completions]}
+
+    def run_suggest(self, text: str, k: int) -> Tuple[List[Tuple[str, int]], str | None]:
+        """returns the k most frequent completions of the last word and the corrected text"""
+
+        return self.searcher.complete(text, k), self.searcher.suggest_query(text, partial=True)
+
+    def start_indexing(self, path: str | None, duplicate_policy: str = DEFAULT_DUPLICATE_POLICY) -> Tuple[int, Dict]:
+        """starts indexing the directory in the background unless a run is in progress"""
+
+        if not isinstance(path, str) or not os.path.isdir(path):
+            raise HTTPError(400, "path must be a directory")
+        if duplicate_policy not in DUPLICATE_POLICIES:
+            raise HTTPError(400, "duplicates must be one of {}".format(', '.join(DUPLICATE_POLICIES)))
+
+        with self._index_lock:
+            if self._index_thread is not None and self._index_thread.is_alive():
+                raise HTTPError(409, "indexing is already running")
+            self._last_index_run = {"path": path, "running": True}
+            self._index_thread = threading.Thread(
+                target=self.run_indexing, args=(path, duplicate_policy), name='indexer', daemon=True)
+            self._index_thread.start()
+        return 202, {"path": path, "running": True}
+
+    def run_indexing(self, path: str, duplicate_policy: str = DEFAULT_DUPLICATE_POLICY) -> None:
+        """indexes the directory into a new segment, the searcher sees it once it is committed"""
+
+        from indexer import generate_forward_index
+        from sorter import inverted_index_generator
+
+        run = {"path": path, "running": False}
+        try:
+            index_info = generate_forward_index(
+                path, duplicate_policy=duplicate_policy)
+            run.update(doc_count=index_info[1],
+                       forward_index_time=index_info[2])
+            if index_info[0]:
+                run["inverted_index_time"] = inverted_index_generator()
+                # open the new segment and make its term index here rather than on the next request
+                self.searcher.refresh()
+        except Exception as error:
+            run["error"] = str(error)
+        self._last_index_run = run
+
+    def get_index_state(self) -> Dict[str, Any]:
+        """returns the committed index and the state of the last indexing run"""
+
+        segments, generation, documents = self.searcher.snapshot()
+        return {"generation": generation,
+                "segments": [{"name": segment.name, "doc_count": segment.doc_count} for segment in segments],
+                "documents": len(documents),
+                "indexing": self._last_index_run,
+                "searches": {"pending": self.pending, "served": self.served, "rejected": self.rejected},
+                "cache": self.searcher.cache_stats()}
+
+
+async def serve(host: str, port: int, workers: int, concurrency: int, max_pending: int, trace: bool = False) -> None:
+    tracing.enable(trace)
+    service = SearchService(workers=workers, concurrency=concurrency, max_pending=max_pending)
+    server = await service.start(host, port)
+    print("Serving on http://{}:{}".format(host, port))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve searches of the index in current directory over HTTP on localhost")
+    parser.add_argument("--host", default=HOST,
+                        help="loopback address to listen on")
+    parser.add_argument("-p", "--port", type=int, default=PORT)
+    parser.add_argument("-w", "--workers", type=int, default=WORKERS,
+                        help="threads running searches")
+    parser.add_argument("-c", "--concurrency", type=int, default=CONCURRENCY,
+                        help="searches running at once")
+    parser.add_argument("--max-pending", type=int, default=MAX_PENDING,
+                        help="searches waiting for a slot before new ones are rejected")
+    parser.add_argument("--trace", action="store_true",
+                        help="trace every search and indexing run for /metrics")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers,
+                    args.concurrency, args.max_pending, args.trace))
+    except KeyboardInterrupt:
+        pass
@@ -1,92 +1,124 @@
 import os
 import json
-from typing import List, Tuple, Any
+import heapq
+import tempfile
+from typing import List, Iterator
 from datetime import datetime
 
+import tracing
+from postings import posting_key
+from segments import BATCH_FILES, SEGMENTS_PATH, build_segment, commit_segments, get_merger
 
-def sort(input_list: List) -> List[List]:
-    """performs sorting on forward barrel content"""
+# bytes of forward barrel content which are sorted in memory before a run is written to disk
+MEMORY_BUDGET = 64 * 1024 * 1024
 
-    # creates a list of 533 lists corresponding to the number of words in one fwd index file
-    sorted_list = [[] for i in range(533)]
 
-    # Uses counting sort to sort in O(n) time
-    for value in input_list:
-        sorted_list[value[0][1] % 533].append(value)
+def get_forward_barrel_num(curr_barrel: str) -> str:
+    """returns barrel number of a forward barrel file name"""
 
-    return sorted_list
+    return curr_barrel[len('forward_barrel_'):-len('.txt')]
 
 
-def get_single_inverted_barrel_content(curr_barrel: str, barrels: List) -> Tuple[List, str]:
-    """Takes data from corresponding forward barrel, combines it
-    with content of inverted barrel if exist and returns all content
+def write_sorted_runs(forward_barrel_path: str, run_dir: str, memory_budget: int) -> List[str]:
+    """reads the forward barrel in chunks of at most memory_budget bytes, sorts every
+    chunk by word id and doc id and writes it to a run file, returns run file paths
     """
 
-    with open('./ForwardBarrels/{}'.format(curr_barrel)) as forward_file:
-        inverted_list = []
-
-        # get the barrel number corresponding to the forward index file because they are not sorted
-        if curr_barrel[17].isnumeric() and curr_barrel[16].isnumeric():
-            barrel_num = curr_barrel[15] + curr_barrel[16] + curr_barrel[17]
-        elif curr_barrel[16].isnumeric():
-            barrel_num = curr_barrel[15] + curr_barrel[16]
-        else:
-            barrel_num = curr_barrel[15]
-
-        # if inverted barrel is present we load its content to a list
-        inverted_barrel_path = "./InvertedBarrels/inverted_barrel_" + barrel_num + ".txt"
-        if os.path.isfile(inverted_barrel_path):
-            with open(inverted_barrel_path, 'r') as inverted_index:
-                for line in inverted_index:
-                    inverted_list.append(json.loads(line))
-
-        # we append content of forward barrel to inverted list
-        for line in forward_file:
-            inverted_list.append(json.loads(line))
+    run_paths = []
 
-    return inverted_list, barrel_num
+    def write_run(run: List) -> None:
+        run.sort(key=lambda entry: entry[0])
+        run_path = os.path.join(run_dir, "run_{}.txt".format(len(run_paths)))
+        with open(run_path, 'w') as run_file:
+            for _, line in run:
+                run_file.write(line)
+        run_paths.append(run_path)
 
+    with open(forward_barrel_path) as forward_file:
+        run = []
+        run_size = 0
+        for line in forward_file:
+            run.append((posting_key(json.loads(line)), line))
+            run_size += len(line)
+            if run_size >= memory_budget:
+                write_run(run)
+                run = []
+                run_size = 0
+        if run:
+            write_run(run)
 
-def write_inverted_barrel(inverted_list: List, barrel_num: str, lexicon: Any, lexicon_keys: List) -> None:
-    """sorts content by wordID and write content to single inverted barrel"""
+    return run_paths
 
-    inverted_barrel_path = "./InvertedBarrels/inverted_barrel_" + barrel_num + ".txt"
-    with open(inverted_barrel_path, 'w') as inverted_file:
-        sorted_list = sort(inverted_list)
-        for i in range(len(sorted_list)):
-            for j in range(len(sorted_list[i])):
-                if j == 0:
-                    lexicon[lexicon_keys[sorted_list[i][0][0][1]+1]
-                            ][1] = inverted_file.tell()
-                inverted_file.write(json.dumps(sorted_list[i][j]))
-                inverted_file.write('\n')
 
+def iter_run(run_path: str) -> Iterator[List]:
+    """yields the postings of a sorted run file"""
 
-def inverted_index_generator() -> str:
-    """Generate inverted index from forward index"""
+    with open(run_path) as run_file:
+        for line in run_file:
+            yield json.loads(line)
 
-    start = datetime.now()
 
-    # we find forward barrels present in directory
-    barrels = [forward_barrel for forward_barrel in os.listdir(
-        "./ForwardBarrels") if forward_barrel.startswith('forward_barrel_')]
+def iter_forward_postings(run_dir: str, memory_budget: int) -> Iterator[List]:
+    """yields the postings of all forward barrels sorted by word id and doc id,
+    every forward barrel holds a consecutive range of word ids so they are sorted
+    one at a time and chained in barrel order
+    """
 
-    # opening lexicon to update the offset values into inverted barrels
-    with open("lexicon.txt", "r") as lexicon_file:
-        lexicon = json.load(lexicon_file)
-        lexicon_keys = list(lexicon.keys())
+    barrels = sorted((forward_barrel for forward_barrel in os.listdir("./ForwardBarrels")
+                      if forward_barrel.startswith('forward_barrel_')),
+                     key=lambda forward_barrel: int(get_forward_barrel_num(forward_barrel)))
 
     for curr_barrel in barrels:
 
-        # at a time we open one forward barrel and get all content
-        inverted_list, barrel_num = get_single_inverted_barrel_content(
-            curr_barrel, barrels)
+        # forward barrels which received no postings in this batch have nothing to add
+        forward_barrel_path = './ForwardBarrels/{}'.format(curr_barrel)
+        if os.path.getsize(forward_barrel_path) == 0:
+            continue
+
+        # sort the new content of the forward barrel in bounded runs and merge them
+        with tracing.stage('sort_runs'):
+            run_paths = write_sorted_runs(
+                forward_barrel_path, run_dir, memory_budget)
+        yield from heapq.merge(*[iter_run(run_path) for run_path in run_paths], key=posting_key)
+
+        for run_path in run_paths:
+            os.remove(run_path)
+
+
+@tracing.traced('invert')
+def inverted_index_generator(memory_budget: int = MEMORY_BUDGET, segments_path: str = SEGMENTS_PATH,
+                             barrel_count: int | None = None) -> str:
+    """Generate inverted index from forward index. The new forward barrels are
+    sorted in runs of at most memory_budget bytes and merged into a new segment
+    of at most barrel_count barrels of similar size, the manifest gives the count
+    if it is None. Existing segments are never rewritten, small segments are then
+    compacted by the background merger. The segment is published together with
+    the statistics and document store keys the indexer left for the batch in one
+    manifest commit, so searches see either all of the batch or none of it.
+    """
 
-        # re sort the inverted list and write to the inverted barrel
-        write_inverted_barrel(inverted_list, barrel_num, lexicon, lexicon_keys)
+    start = datetime.now()
 
-    with open("lexicon.txt", "w") as lexicon_file:
-        lexicon_file.write(json.dumps(lexicon))
+    # the lexicon gives the words of the word ids stored in the forward barrels
+    with open("lexicon.txt", "r") as lexicon_file:
+        lexicon_keys = list(json.load(lexicon_file).keys())
+
+    # sorting the runs of the forward barrels is part of writing the segment, which consumes them
+    with tempfile.TemporaryDirectory(prefix='runs_', dir='.') as run_dir, tracing.stage('segment_write'):
+        segment_info = build_segment([iter_forward_postings(run_dir, memory_budget)],
+                                     lambda word_id: lexicon_keys[word_id + 1],
+                                     segments_path, barrel_count)
+
+    # the segment becomes searchable once it is listed in the manifest
+    batch_files = {key: path for key, path in BATCH_FILES.items()
+                   if os.path.isfile(path)}
+    if segment_info is not None or batch_files:
+        with tracing.stage('commit'):
+            commit_segments([segment_info] if segment_info else [],
+                            [], segments_path, batch_files)
+    if segment_info is not None:
+        tracing.count('segment_bytes_written', segment_info["size"])
+        get_merger(segments_path).maybe_merge()
 
     end = datetime.now()
     time_taken = str(end - start)
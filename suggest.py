@@ -0,0 +1,289 @@
+import re
+from bisect import bisect_left
+from typing import Any, List, Tuple
+
+from binary_lexicon import BinaryLexicon
+from collection_stats import CollectionStats
+
+# Term suggestions over the lexicons of the committed segments, ranked by the number of
+# documents containing each term. Terms are stems, like every word of the index, the
+# searcher shows them by their surface forms.
+#
+# Autocomplete: the terms of a segment lexicon are already sorted, so the sorted list
+# serves as the trie. The terms starting with a prefix are the range between two binary
+# searches and its most frequent terms are picked with numpy argpartition.
+#
+# Spelling correction: a symmetric delete index as in SymSpell. Every term is keyed by
+# the strings left after deleting up to MAX_EDIT_DISTANCE characters of its first
+# PREFIX_LENGTH characters, a misspelled word generates its own deletes and the terms
+# sharing one of them are the candidates. Candidates whose length or letters differ
+# too much are dropped with vectorized checks, the others are verified with a bounded
+# edit distance counting transpositions of neighbouring letters as one edit. The keys
+# are stored as sorted python string hashes, which differ between processes, so the
+# index is only kept in memory.
+#
+# A segment never changes, so its terms are read and its delete index is made once when
+# its term index is made, then both are kept as long as the segment is live. Making the
+# delete index takes a moment for a large lexicon, so the searcher makes term indexes
+# off the request path. numpy is imported when the first term index is made.
+
+# most edits between a misspelled word and a correction
+MAX_EDIT_DISTANCE = 2
+
+# shortest words corrected with one and with two edits, shorter ones have too many neighbours
+ONE_EDIT_LENGTH = 3
+TWO_EDIT_LENGTH = 6
+
+# characters of a term whose deletes key it, longer terms share the keys of their prefix
+PREFIX_LENGTH = 7
+
+# completions and corrections returned unless asked otherwise
+SUGGESTION_COUNT = 5
+
+# sorts after every character, the terms starting with a prefix sort before prefix + LAST_CHARACTER
+LAST_CHARACTER = '\U0010ffff'
+
+# the word being typed at the end of a query
+LAST_WORD = re.compile('[a-zA-Z]+$')
+
+# the numpy module and the number of set bits of every 16 bit value, set by load_numpy
+np = None
+POPCOUNT = None
+
+
+def load_numpy() -> None:
+    """imports numpy and makes the bit count table on first use"""
+
+    global np, POPCOUNT
+    if np is None:
+        import numpy
+        POPCOUNT = numpy.array([bin(value).count('1') for value in range(1 << 16)], dtype=numpy.uint8)
+        np = numpy
+
+
+def get_last_word(text: str) -> str:
+    """returns the lowercase word at the end of the text, empty if the text ends with another character"""
+
+    match = LAST_WORD.search(text)
+    return match.group(0).lower() if match else ''
+
+
+def get_max_distance(word: str) -> int:
+    """returns the most edits allowed to correct a word of its length"""
+
+    if len(word) >= TWO_EDIT_LENGTH:
+        return MAX_EDIT_DISTANCE
+    if len(word) >= ONE_EDIT_LENGTH:
+        return 1
+    return 0
+
+
+def get_deletes(word: str, max_distance: int) -> set:
+    """returns the strings left after deleting up to max_distance characters of the
+    prefix of the word, including the prefix itself
+    """
+
+    deletes = {word[:PREFIX_LENGTH]}
+    edge = deletes
+    for _ in range(max_distance):
+        edge = {delete[:i] + delete[i + 1:] for delete in edge for i in range(len(delete))}
+        deletes |= edge
+    return deletes
+
+
+def get_delete_keys(word: str, max_distance: int) -> Any:
+    """returns the hashes of the deletes of the word as an array"""
+
+    load_numpy()
+    return np.array([hash(delete) for delete in get_deletes(word, max_distance)], dtype=np.int64)
+
+
+def get_letters(word: str) -> int:
+    """returns the bit set of the letters of the word, an edit adds or removes at most one"""
+
+    letters = 0
+    for char in word:
+        letters |= 1 << (ord(char) & 31)
+    return letters
+
+
+def count_bits(values: Any) -> Any:
+    """returns the number of set bits of every uint32 value"""
+
+    return POPCOUNT[values & 0xffff] + POPCOUNT[values >> 16]
+
+
+def edit_distance(word: str, other: str, max_distance: int) -> int:
+    """returns the optimal string alignment distance of the words, or max_distance + 1
+    if it is larger. Only the band of max_distance cells around the diagonal is computed.
+    """
+
+    # the common prefix and suffix do not change the distance
+    shortest = min(len(word), len(other))
+    prefix = 0
+    while prefix < shortest and word[prefix] == other[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < shortest - prefix and word[-1 - suffix] == other[-1 - suffix]:
+        suffix += 1
+    word = word[prefix:len(word) - suffix]
+    other = other[prefix:len(other) - suffix]
+
+    limit = max_distance + 1
+    if abs(len(word) - len(other)) > max_distance:
+        return limit
+    if not word or not other:
+        return len(word) or len(other)
+
+    width = len(other)
+    previous = [j if j < limit else limit for j in range(width + 1)]
+    before = previous
+    for i in range(1, len(word) + 1):
+        char = word[i - 1]
+        current = [limit] * (width + 1)
+        if i < limit:
+            current[0] = i
+        low = i - max_distance if i > max_distance else 1
+        high = i + max_distance if i + max_distance < width else width
+        row_min = limit
+        for j in range(low, high + 1):
+            value = previous[j - 1] if other[j - 1] == char else previous[j - 1] + 1
+            if previous[j] + 1 < value:
+                value = previous[j] + 1
+            if current[j - 1] + 1 < value:
+                value = current[j - 1] + 1
+            # neighbouring letters swapped
+            if i > 1 and j > 1 and char == other[j - 2] and word[i - 2] == other[j - 1] and before[j - 2] + 1 < value:
+                value = before[j - 2] + 1
+            current[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min >= limit:
+            return limit
+        before, previous = previous, current
+    return min(previous[width], limit)
+
+
+def get_document_frequencies(stats: CollectionStats) -> Any:
+    """returns the document frequencies of the statistics as an array indexed by word id, without copying"""
+
+    load_numpy()
+    return np.frombuffer(stats.document_frequencies, dtype=np.uint32)
+
+
+class TermIndex:
+    """Sorted terms of one segment lexicon with their word ids for autocomplete, and
+    the delete index of the terms for spelling correction. Frequencies are looked up
+    by word id in the collection statistics of the caller, so the index stays valid
+    while other segments are added.
+    """
+
+    def __init__(self, lexicon: BinaryLexicon) -> None:
+        load_numpy()
+        self.terms, word_ids = lexicon.read_terms()
+        self.word_ids = np.array(word_ids, dtype=np.uint32)
+        self._make_deletes()
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def _make_deletes(self) -> None:
+        """makes the sorted delete keys of every term with the term they belong to"""
+
+        keys = []
+        key_terms = []
+        for term_num, term in enumerate(self.terms):
+            hashes = [hash(delete) for delete in get_deletes(term, MAX_EDIT_DISTANCE)]
+            keys.extend(hashes)
+            key_terms.extend([term_num] * len(hashes))
+        keys = np.array(keys, dtype=np.int64)
+        order = np.argsort(keys, kind='stable')
+        self._keys = keys[order]
+        self._key_terms = np.array(key_terms, dtype=np.uint32)[order]
+        self._lengths = np.array([len(term) for term in self.terms], dtype=np.int32)
+        self._letters = np.array([get_letters(term) for term in self.terms], dtype=np.uint32)
+
+    def get_frequencies(self, term_nums: Any, frequencies: Any) -> Any:
+        """returns the document frequencies of the terms, 0 for word ids without statistics"""
+
+        word_ids = self.word_ids[term_nums]
+        counts = np.zeros(len(word_ids), dtype=np.int64)
+        known = word_ids < len(frequencies)
+        counts[known] = frequencies[word_ids[known]]
+        return counts
+
+    def complete(self, prefix: str, frequencies: Any, k: int = SUGGESTION_COUNT) -> List[Tuple[str, int]]:
+        """returns the k most frequent terms starting with the prefix and their document frequencies"""
+
+        low = bisect_left(self.terms, prefix)
+        high = bisect_left(self.terms, prefix + LAST_CHARACTER, low)
+        if low == high:
+            return []
+        counts = self.get_frequencies(np.arange(low, high), frequencies)
+        if high - low > k:
+            best = np.argpartition(counts, high - low - k)[high - low - k:]
+        else:
+            best = range(high - low)
+        return [(self.terms[low + i], int(counts[i])) for i in best]
+
+    def correct(self, word: str, keys: Any, frequencies: Any, max_distance: int) -> List[Tuple[str, int, int]]:
+        """returns the terms at most max_distance edits away from the word with their
+        distance and document frequency, keys are the delete keys of the word
+        """
+
+        lows = np.searchsorted(self._keys, keys, 'left').tolist()
+        highs = np.searchsorted(self._keys, keys, 'right').tolist()
+        ranges = [self._key_terms[low:high] for low, high in zip(lows, highs) if low < high]
+        if not ranges:
+            return []
+        candidates = np.unique(np.concatenate(ranges))
+
+        # an edit changes the length by at most one and adds or removes at most one letter
+        letters = np.uint32(get_letters(word))
+        candidate_letters = self._letters[candidates]
+        candidates = candidates[(np.abs(self._lengths[candidates] - len(word)) <= max_distance) &
+                                (count_bits(candidate_letters & ~letters) <= max_distance) &
+                                (count_bits(letters & ~candidate_letters) <= max_distance)]
+
+        corrections = []
+        for term_num in candidates.tolist():
+            distance = edit_distance(word, self.terms[term_num], max_distance)
+            if distance <= max_distance:
+                corrections.append((term_num, distance))
+        counts = self.get_frequencies([term_num for term_num, _ in corrections], frequencies)
+        return [(self.terms[term_num], distance, int(count))
+                for (term_num, distance), count in zip(corrections, counts)]
+
+
+def complete_term(term_indexes: List[TermIndex], prefixes: List[str], stats: CollectionStats,
+                  k: int = SUGGESTION_COUNT) -> List[Tuple[str, int]]:
+    """returns the k most frequent terms of all segments starting with one of the
+    prefixes. Frequencies are shared by the segments, so the best terms of the
+    collection are among the best of the segments containing them.
+    """
+
+    frequencies = get_document_frequencies(stats)
+    completions = {}
+    for term_index in term_indexes:
+        for prefix in prefixes:
+            completions.update(term_index.complete(prefix, frequencies, k))
+    return sorted(completions.items(), key=lambda completion: (-completion[1], completion[0]))[:k]
+
+
+def correct_term(term_indexes: List[TermIndex], word: str, stats: CollectionStats,
+                 k: int = SUGGESTION_COUNT) -> List[Tuple[str, int, int]]:
+    """returns the k closest terms of all segments within the edits allowed for the
+    word, the most frequent first among equally close ones
+    """
+
+    max_distance = get_max_distance(word)
+    if not max_distance:
+        return []
+    frequencies = get_document_frequencies(stats)
+    keys = get_delete_keys(word, max_distance)
+    corrections = {}
+    for term_index in term_indexes:
+        for term, distance, count in term_index.correct(word, keys, frequencies, max_distance):
+            corrections[term] = (distance, count)
+    return sorted(((term, distance, count) for term, (distance, count) in corrections.items()),
+                  key=lambda correction: (correction[1], -correction[2], correction[0]))[:k]
@@ -0,0 +1,108 @@
+import os
+import random
+
+import pytest
+
+from postings import (BLOCK_SIZE, END_OF_POSTINGS, BlockPostingCursor, PostingCursor, decode_postings, decode_varint,
+                      decode_varints, encode_blocks, encode_postings, encode_varint, read_term_block,
+                      write_term_postings)
+
+
+def make_postings(doc_ids, word_id=7, seed=0):
+    """returns sorted postings of a word in the given documents with random hits"""
+
+    rng = random.Random(seed)
+    postings = []
+    for doc_id in sorted(doc_ids):
+        positions = sorted(rng.sample(range(1, 5000), rng.randint(0, 6)))
+        postings.append([[doc_id, word_id], [[1, rng.randint(0, 3)], [0, len(positions)] + positions]])
+    return postings
+
+
+@pytest.mark.parametrize("value", [0, 1, 127, 128, 300, 16383, 16384, 2 ** 32 - 1, 2 ** 63])
+def test_varint_round_trip(value):
+    out = bytearray()
+    encode_varint(value, out)
+    assert decode_varint(bytes(out), 0) == (value, len(out))
+    assert decode_varints(bytes(out)) == [value]
+
+
+def test_varints_decode_in_sequence():
+    values = [5, 0, 128, 1, 2 ** 40, 127]
+    out = bytearray()
+    for value in values:
+        encode_varint(value, out)
+    assert decode_varints(bytes(out)) == values
+
+
+def test_postings_round_trip():
+    postings = make_postings([3, 4, 90, 100000, 2 ** 31])
+    assert decode_postings(7, len(postings), encode_postings(postings)) == postings
+
+
+def test_blocks_round_trip():
+    postings = make_postings(range(0, 7 * BLOCK_SIZE + 5, 3))
+    payload, skip_table = encode_blocks(postings)
+    # the blocks are the same bytes as the postings written in one piece
+    assert payload == encode_postings(postings)
+    cursor = BlockPostingCursor(7, len(postings), payload, skip_table)
+    decoded = []
+    while cursor.doc_id != END_OF_POSTINGS:
+        decoded.append(cursor.posting)
+        cursor.next()
+    assert decoded == postings
+
+
+@pytest.mark.parametrize("postings_format", [1, 2])
+def test_term_block_round_trip(tmp_path, postings_format):
+    long_postings = make_postings(range(1, 3 * BLOCK_SIZE + 10, 2), word_id=3)
+    short_postings = make_postings([8, 2, 5], word_id=4)
+    path = os.path.join(tmp_path, 'inverted_barrel_1.bin')
+    with open(path, 'wb') as barrel_file:
+        offsets = [write_term_postings(barrel_file, postings, postings_format)
+                   for postings in (long_postings, short_postings)]
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        for offset, postings in zip(offsets, (long_postings, short_postings)):
+            word_id, doc_count, data, skip_table = read_term_block(fd, offset, postings_format)
+            assert (word_id, doc_count) == (postings[0][0][1], len(postings))
+            assert bool(skip_table) == (postings_format == 2 and len(postings) > BLOCK_SIZE)
+            # write_term_postings sorts the postings by doc id
+            assert decode_postings(word_id, doc_count, data) == sorted(postings, key=lambda posting: posting[0][0])
+    finally:
+        os.close(fd)
+
+
+def test_block_cursor_next_geq_matches_decoded_cursor():
+    rng = random.Random(1)
+    doc_ids = sorted(rng.sample(range(1, 100000), 5 * BLOCK_SIZE + 17))
+    postings = make_postings(doc_ids)
+    payload, skip_table = encode_blocks(postings)
+
+    for seed in range(20):
+        rng = random.Random(seed)
+        block_cursor = BlockPostingCursor(7, len(postings), payload, skip_table)
+        cursor = PostingCursor(postings)
+        target = 0
+        while cursor.doc_id != END_OF_POSTINGS:
+            # short steps stay in a block, long ones skip blocks, some targets are doc ids
+            target += rng.choice([1, 2, 50, 3000, 20000])
+            if rng.random() < 0.3 and cursor.pos + 1 < len(postings):
+                target = max(target, doc_ids[min(cursor.pos + rng.randint(1, 300), len(doc_ids) - 1)])
+            assert block_cursor.next_geq(target) == cursor.next_geq(target)
+            if cursor.doc_id != END_OF_POSTINGS:
+                assert block_cursor.posting == cursor.posting
+        assert block_cursor.next_geq(target + 1) == END_OF_POSTINGS
+
+
+def test_block_cursor_next_geq_at_block_edges():
+    postings = make_postings(range(1, 3 * BLOCK_SIZE + 1))
+    payload, skip_table = encode_blocks(postings)
+    cursor = BlockPostingCursor(7, len(postings), payload, skip_table)
+    # the last doc id of a block, the first of the next one and a target behind the cursor
+    assert cursor.next_geq(BLOCK_SIZE) == BLOCK_SIZE
+    assert cursor.next_geq(BLOCK_SIZE + 1) == BLOCK_SIZE + 1
+    assert cursor.next_geq(5) == BLOCK_SIZE + 1
+    assert cursor.next_geq(3 * BLOCK_SIZE) == 3 * BLOCK_SIZE
+    assert cursor.next_geq(3 * BLOCK_SIZE + 1) == END_OF_POSTINGS
@@ -0,0 +1,97 @@
+import pytest
+
+from postings import END_OF_POSTINGS, PostingCursor
+from query import near_occurs, parse_query, phrase_occurs
+
+
+def make_postings(documents):
+    """returns decoded postings of one word from {doc_id: content positions}"""
+
+    return [[[doc_id, 0], [[1, 0], [0, len(positions)] + positions]]
+            for doc_id, positions in sorted(documents.items())]
+
+
+def match_all(text, index):
+    """returns the doc ids matched by the query over {word: {doc_id: positions}}"""
+
+    def get_cursor(word):
+        return PostingCursor(make_postings(index[word])) if word in index else None
+
+    matcher = parse_query(text).get_matcher(get_cursor)
+    if matcher is None:
+        return []
+    doc_ids = []
+    doc_id = matcher.next_geq(0)
+    while doc_id != END_OF_POSTINGS:
+        doc_ids.append(doc_id)
+        doc_id = matcher.next_geq(doc_id + 1)
+    return doc_ids
+
+
+@pytest.mark.parametrize("text", ["AND", "OR", "NOT", "AND OR NOT", "()", "(", ")", '""', "the"])
+def test_operators_and_stop_words_alone_are_empty(text):
+    query = parse_query(text)
+    assert query.root is None
+    assert query.words == []
+    assert query.is_plain()
+
+
+@pytest.mark.parametrize("text", ["trump AND", "OR trump", "trump NOT", "trump NEAR/3", "NEAR/3 trump",
+                                  "(trump", "trump)", "trump AND OR"])
+def test_dangling_operators_are_dropped(text):
+    query = parse_query(text)
+    assert query.root == ('word', 'trump')
+    assert query.words == ['trump']
+
+
+def test_dangling_operator_between_operands_is_skipped():
+    assert parse_query("trump AND OR biden").root == ('or', [('word', 'trump'), ('word', 'biden')])
+
+
+def test_only_negated_words_do_not_rank():
+    query = parse_query("NOT trump")
+    assert query.root == ('not', ('word', 'trump'))
+    assert query.words == []
+    assert query.all_words == ['trump']
+
+
+def test_unbalanced_quote_ends_the_phrase_at_the_end_of_the_query():
+    assert parse_query('"donald trump').root == ('phrase', ['donald', 'trump'])
+    assert parse_query('biden "donald trump').root == ('seq', [('word', 'biden'), ('phrase', ['donald', 'trump'])])
+
+
+def test_phrase_words_are_stemmed_without_stop_words():
+    assert parse_query('"the houses"').root == ('phrase', ['hous'])
+
+
+def test_near_zero_is_parsed_with_its_distance():
+    query = parse_query("trump NEAR/0 biden")
+    assert query.root == ('and', [('word', 'trump'), ('word', 'biden'), ('near', 'trump', 'biden', 0)])
+    assert not query.is_plain()
+
+
+def test_near_zero_needs_the_same_position():
+    assert not near_occurs([0, 1, 5], [0, 1, 6], 0)
+    assert near_occurs([0, 1, 5], [0, 1, 6], 1)
+    assert near_occurs([0, 2, 3, 9], [0, 2, 1, 11], 2)
+    assert not near_occurs([0, 2, 3, 9], [0, 2, 1, 12], 1)
+
+
+def test_phrase_occurs_checks_offsets_from_the_rarest_word():
+    # "donald trump" with trump at 4 and 8, donald only at 7
+    assert phrase_occurs([[0, 1, 7], [0, 2, 4, 8]], [0, 1])
+    assert not phrase_occurs([[0, 1, 7], [0, 2, 4, 9]], [0, 1])
+
+
+def test_matchers_evaluate_phrases_near_and_boolean_operators():
+    index = {'donald': {1: [1], 2: [5], 3: [2]},
+             'trump': {1: [2], 2: [9], 3: [7], 4: [1]},
+             'biden': {2: [8], 4: [3]}}
+    assert match_all('"donald trump"', index) == [1]
+    assert match_all('trump NEAR/1 biden', index) == [2]
+    assert match_all('trump NEAR/0 biden', index) == []
+    assert match_all('trump AND biden', index) == [2, 4]
+    assert match_all('donald OR biden', index) == [1, 2, 3, 4]
+    assert match_all('trump NOT biden', index) == [1, 3]
+    assert match_all('(donald OR biden) AND trump NOT "donald trump"', index) == [2, 3, 4]
+    assert match_all('"donald vaccine"', index) == []
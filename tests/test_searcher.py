@@ -0,0 +1,64 @@
+import random
+
+import pytest
+
+from searcher import HitCountScorer, score_document, top_k_documents
+
+
+def make_postings_lists(seed, query_length, doc_range=300):
+    """returns postings of every query word with random hits, words occur in a random share of the documents"""
+
+    rng = random.Random(seed)
+    postings_lists = []
+    for word_id in range(query_length):
+        doc_ids = sorted(rng.sample(range(doc_range), rng.randint(0, doc_range // 2)))
+        postings = []
+        for doc_id in doc_ids:
+            positions = sorted(rng.sample(range(1, 400), rng.randint(0, 5)))
+            title_hits = rng.randint(0, 2) if positions else rng.randint(1, 2)
+            postings.append([[doc_id, word_id], [[1, title_hits], [0, len(positions)] + positions]])
+        postings_lists.append(postings)
+    return postings_lists
+
+
+def exhaustive_ranking(postings_lists):
+    """scores every document containing a query word, the postings are passed in query order"""
+
+    documents = {}
+    for postings in postings_lists:
+        for line in postings:
+            documents.setdefault(line[0][0], []).append(line)
+    return {doc_id: score_document(doc_id, lines) for doc_id, lines in documents.items()}
+
+
+@pytest.mark.parametrize("seed", range(30))
+@pytest.mark.parametrize("k", [1, 5, 20])
+def test_top_k_matches_exhaustive_scoring(seed, k):
+    postings_lists = make_postings_lists(seed, query_length=1 + seed % 4)
+    entries = exhaustive_ranking(postings_lists)
+    expected_scores = sorted((entry[0] for entry in entries.values()), reverse=True)[:k]
+
+    ranked_documents = top_k_documents(postings_lists, k, HitCountScorer())
+
+    # documents tied with the k-th score may differ, their scores may not
+    assert [entry[0] for _, entry in ranked_documents] == expected_scores
+    for doc_id, entry in ranked_documents:
+        assert entry == entries[int(doc_id)]
+
+
+def test_top_k_larger_than_matches_returns_every_document():
+    postings_lists = make_postings_lists(3, query_length=2, doc_range=20)
+    entries = exhaustive_ranking(postings_lists)
+
+    ranked_documents = top_k_documents(postings_lists, len(entries) + 10)
+
+    assert sorted(int(doc_id) for doc_id, _ in ranked_documents) == sorted(entries)
+
+
+@pytest.mark.parametrize("k", [0, -1])
+def test_top_k_without_results(k):
+    assert top_k_documents(make_postings_lists(0, query_length=2), k) == []
+
+
+def test_top_k_without_postings():
+    assert top_k_documents([[], []], 5) == []
@@ -0,0 +1,174 @@
+import os
+import re
+import json
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Callable
+
+from atomic_file import atomic_write
+from stop_words import STOP_WORDS
+
+# number of distinct words whose stems are kept in memory
+STEM_CACHE_SIZE = 100000
+
+
+def load_stemmer() -> Any:
+    """returns the english Snowball stemmer, importing nltk takes longer than the rest of startup"""
+
+    from nltk.stem.snowball import SnowballStemmer
+    return SnowballStemmer(language='english')
+
+
+class StemCache:
+    """Bounded cache of word -> stem with least recently used eviction.
+    Natural text repeats a few thousand words most of the time, so most
+    calls are answered without running the stemmer. Queries of the search
+    service are parsed by several threads, so the cache is locked. Without
+    a stemmer the Snowball stemmer is loaded on the first cache miss.
+    """
+
+    def __init__(self, stemmer: Any = None, max_size: int = STEM_CACHE_SIZE) -> None:
+        self.stemmer = stemmer
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._stems = OrderedDict()
+        self._lock = threading.Lock()
+
+    def stem(self, word: str) -> str:
+        """returns stem of the word, stemming it only on a cache miss"""
+
+        with self._lock:
+            stem = self._stems.get(word)
+            if stem is not None:
+                self.hits += 1
+                self._stems.move_to_end(word)
+                return stem
+
+        stem = (self.stemmer or self.load_stemmer()).stem(word)
+        with self._lock:
+            self.misses += 1
+            self._stems[word] = stem
+            if len(self._stems) > self.max_size:
+                self._stems.popitem(last=False)
+        return stem
+
+    def load_stemmer(self) -> Any:
+        """returns the stemmer, loading it if it was not loaded yet"""
+
+        with self._lock:
+            if self.stemmer is None:
+                self.stemmer = load_stemmer()
+        return self.stemmer
+
+    def __len__(self) -> int:
+        return len(self._stems)
+
+    def stats(self) -> Dict[str, Any]:
+        """returns hit and miss counters of the cache"""
+
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._stems),
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+    def save(self, path: str) -> None:
+        """writes cached stems to path, most recently used last. The entries are
+        copied under the lock, other threads may keep stemming while they are written
+        """
+
+        with self._lock:
+            stems = list(self._stems.items())
+        atomic_write(path, json.dumps(stems))
+
+    def load(self, path: str) -> None:
+        """loads stems saved by a previous run if the file exists"""
+
+        if not os.path.isfile(path):
+            return
+        with open(path, 'r') as cache_file:
+            for word, stem in json.load(cache_file):
+                self._stems[word] = stem
+        while len(self._stems) > self.max_size:
+            self._stems.popitem(last=False)
+
+
+class SurfaceForms:
+    """Most frequent indexed spelling of every stem, so suggestions show words
+    instead of stems. The indexer counts the words of the documents it adds and
+    merges them with the forms of earlier batches, a form is kept with its count
+    and replaced once another spelling of its stem was counted more often.
+    """
+
+    def __init__(self, forms: Dict[str, List] | None = None) -> None:
+        # stem -> [word, number of times the word was indexed]
+        self.forms = forms or {}
+
+    def __len__(self) -> int:
+        return len(self.forms)
+
+    def add_words(self, word_counts: Dict[str, int], stem: Callable[[str], str]) -> None:
+        """counts the words of word_counts for their stems"""
+
+        counts = {}
+        for word, count in word_counts.items():
+            counts.setdefault(stem(word), {})[word] = count
+
+        for word_stem, stem_counts in counts.items():
+            form = self.forms.get(word_stem)
+            if form is not None:
+                stem_counts[form[0]] = stem_counts.get(form[0], 0) + form[1]
+            word = max(stem_counts, key=lambda word: (stem_counts[word], word == word_stem))
+            self.forms[word_stem] = [word, stem_counts[word]]
+
+    def get(self, word_stem: str) -> str:
+        """returns the most frequent spelling of the stem, the stem itself if it has none"""
+
+        form = self.forms.get(word_stem)
+        return form[0] if form is not None else word_stem
+
+    def save(self, path: str) -> None:
+        """writes the forms to path, replacing it atomically"""
+
+        atomic_write(path, json.dumps(self.forms))
+
+    @classmethod
+    def load(cls, path: str | None) -> 'SurfaceForms':
+        """returns the forms saved at path, or no forms if there is no file"""
+
+        if path is None or not os.path.isfile(path):
+            return cls()
+        with open(path, 'r') as forms_file:
+            return cls(json.load(forms_file))
+
+
+class Tokenizer:
+    """Splits text into lowercase words, removes stop words and stems them.
+    The indexer and the search path share it so documents and queries are
+    normalized the same way.
+    """
+
+    def __init__(self, cache_size: int = STEM_CACHE_SIZE) -> None:
+        self.stop_words = STOP_WORDS
+        self.stem_cache = StemCache(max_size=cache_size)
+
+    def split_words(self, content: str) -> List[str]:
+        """split content, lowercase it and remove stop words"""
+
+        stop_words = self.stop_words
+        content = (re.sub('[^a-zA-Z]', ' ', content)).lower().split()
+        return [word for word in content if not word in stop_words]
+
+    def parse_content(self, content: str) -> List[str]:
+        """split content, lowercase it and remove stop words and do stemming"""
+
+        stem = self.stem_cache.stem
+        return [stem(word) for word in self.split_words(content)]
+
+
+tokenizer = Tokenizer()
+
+
+def parse_content(content: str) -> List[str]:
+    """split content, lowercase it and remove stop words and do stemming"""
+
+    return tokenizer.parse_content(content)
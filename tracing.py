@@ -0,0 +1,253 @@
+import json
+import time
+import logging
+import functools
+import threading
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, Iterator
+
+# Lightweight tracing of the index and search pipelines. An operation (a search, an
+# indexing run, a merge) is traced either because tracing is enabled for the whole
+# process or because the caller wraps it in trace(). While a trace is active on the
+# current thread, stage() times the named stages it runs and count() adds to its
+# counters (postings decoded, bytes read, cache hits). Finished traces are added to
+# process wide totals, which metrics_text() exports in the Prometheus text format,
+# and are logged as one json object each to the "tracing" logger.
+#
+# When no trace is active stage() returns a shared object whose enter and exit do
+# nothing, so instrumented code pays one context variable lookup per stage.
+
+logger = logging.getLogger('tracing')
+
+_current = ContextVar('trace', default=None)
+_enabled = False
+
+
+class Trace:
+    """Stage timings and counters of one traced operation"""
+
+    def __init__(self, operation: str) -> None:
+        self.operation = operation
+        self.stages = {}
+        self.counters = {}
+        self.seconds = 0.0
+        self._start = 0.0
+
+    def add_stage(self, name: str, seconds: float) -> None:
+        stage = self.stages.get(name)
+        if stage is None:
+            self.stages[name] = [seconds, 1]
+        else:
+            stage[0] += seconds
+            stage[1] += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"operation": self.operation, "seconds": self.seconds,
+                "stages": {name: {"seconds": seconds, "calls": calls}
+                           for name, (seconds, calls) in self.stages.items()},
+                "counters": dict(self.counters)}
+
+
+class Stage:
+    """Times one run of a stage of the active trace"""
+
+    __slots__ = ('trace', 'name', 'start')
+
+    def __init__(self, trace: Trace, name: str) -> None:
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self) -> 'Stage':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.trace.add_stage(self.name, time.perf_counter() - self.start)
+
+
+class NullStage:
+    """Stage used when nothing is traced"""
+
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, *exc_info) -> None:
+        return None
+
+
+NULL_STAGE = NullStage()
+
+
+class TraceContext:
+    """Activates a new trace for the current thread until it is exited"""
+
+    __slots__ = ('trace', 'token')
+
+    def __init__(self, operation: str) -> None:
+        self.trace = Trace(operation)
+
+    def __enter__(self) -> Trace:
+        self.token = _current.set(self.trace)
+        self.trace._start = time.perf_counter()
+        return self.trace
+
+    def __exit__(self, *exc_info) -> None:
+        self.trace.seconds = time.perf_counter() - self.trace._start
+        _current.reset(self.token)
+        metrics.add(self.trace)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps(self.trace.to_dict()))
+
+
+class Metrics:
+    """Totals of the stage timings and counters of all finished traces by operation"""
+
+    def __init__(self) -> None:
+        self.operations = {}
+        self._lock = threading.Lock()
+
+    def add(self, trace: Trace) -> None:
+        with self._lock:
+            totals = self.operations.get(trace.operation)
+            if totals is None:
+                totals = self.operations[trace.operation] = {
+                    "count": 0, "seconds": 0.0, "stages": {}, "counters": {}}
+            totals["count"] += 1
+            totals["seconds"] += trace.seconds
+            for name, (seconds, calls) in trace.stages.items():
+                stage = totals["stages"].setdefault(name, [0.0, 0])
+                stage[0] += seconds
+                stage[1] += calls
+            for name, value in trace.counters.items():
+                totals["counters"][name] = totals["counters"].get(
+                    name, 0) + value
+
+    def reset(self) -> None:
+        with self._lock:
+            self.operations = {}
+
+    def to_prometheus(self) -> str:
+        """returns the totals in the Prometheus text exposition format"""
+
+        lines = []
+
+        def family(name: str, help_text: str, samples: list) -> None:
+            lines.append("# HELP {} {}".format(name, help_text))
+            lines.append("# TYPE {} counter".format(name))
+            for labels, value in samples:
+                label_text = ','.join('{}="{}"'.format(key, label)
+                                      for key, label in labels)
+                lines.append("{}{{{}}} {}".format(name, label_text, value))
+
+        with self._lock:
+            operations = sorted(self.operations.items())
+            family("talaash_operations_total", "Number of traced operations.",
+                   [((("operation", operation),), totals["count"]) for operation, totals in operations])
+            family("talaash_operation_seconds_total", "Time spent in traced operations.",
+                   [((("operation", operation),), totals["seconds"]) for operation, totals in operations])
+            family("talaash_stage_seconds_total", "Time spent in each stage of traced operations.",
+                   [((("operation", operation), ("stage", stage)), seconds) for operation, totals in operations
+                    for stage, (seconds, _) in sorted(totals["stages"].items())])
+            family("talaash_stage_calls_total", "Number of runs of each stage of traced operations.",
+                   [((("operation", operation), ("stage", stage)), calls) for operation, totals in operations
+                    for stage, (_, calls) in sorted(totals["stages"].items())])
+            family("talaash_events_total", "Postings decoded, bytes read, cache hits and other counters.",
+                   [((("operation", operation), ("name", name)), value) for operation, totals in operations
+                    for name, value in sorted(totals["counters"].items())])
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def enable(enabled: bool = True) -> None:
+    """traces every operation of the process when enabled"""
+
+    global _enabled
+    _enabled = enabled
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def trace(operation: str) -> TraceContext:
+    """returns a context tracing the operation run inside it, whether or not tracing is enabled"""
+
+    return TraceContext(operation)
+
+
+def operation(name: str) -> Any:
+    """returns the context of an operation boundary: a stage of the active trace, a new
+    trace if tracing is enabled, otherwise a context doing nothing
+    """
+
+    active = _current.get()
+    if active is not None:
+        return Stage(active, name)
+    if _enabled:
+        return TraceContext(name)
+    return NULL_STAGE
+
+
+def traced(name: str) -> Callable:
+    """decorates a function which is a traced operation"""
+
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with operation(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def stage(name: str) -> Any:
+    """returns a context timing the named stage of the active trace"""
+
+    active = _current.get()
+    if active is None:
+        return NULL_STAGE
+    return Stage(active, name)
+
+
+def iter_stage(name: str, iterable: Iterable) -> Iterable:
+    """returns the iterable, timing the named stage while each item is produced if a trace is active"""
+
+    active = _current.get()
+    if active is None:
+        return iterable
+    return _iter_stage(active, name, iterable)
+
+
+def _iter_stage(active: Trace, name: str, iterable: Iterable) -> Iterator:
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            active.add_stage(name, time.perf_counter() - start)
+        yield item
+
+
+def count(name: str, value: int = 1) -> None:
+    """adds value to the named counter of the active trace"""
+
+    active = _current.get()
+    if active is not None:
+        active.counters[name] = active.counters.get(name, 0) + value
+
+
+def current() -> Trace | None:
+    return _current.get()
+
+
+def metrics_text() -> str:
+    """returns the totals of all finished traces in the Prometheus text format"""
+
+    return metrics.to_prometheus()